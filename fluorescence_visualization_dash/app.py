@@ -4,66 +4,319 @@ from dash import Input, Output, dcc, html, State
 from fluorescence_visualization_dash.components.components import main_content, \
     sidebar, dropdown_content, \
     upload_content, load_bookmarks, save_bookmarks, \
-    spectrum_page, return_bookmark_data, table, remove_bookmarks_json
-from dash import no_update, callback_context as ctx
+    spectrum_page, return_bookmark_data, table, remove_bookmarks, trend_page
+from dash import no_update, Patch, callback_context as ctx
 from dash.exceptions import PreventUpdate
 from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+from fluorescence_visualization_dash.session.session import SessionStore
+from fluorescence_visualization_dash.preprocessing.preprocessing import make_pipeline, ArrayCache
+from fluorescence_visualization_dash.bookmarks.bookmarks import BookmarkWarmer, subscribe_default
+from typing import Any, List, NamedTuple, Optional, Tuple
+import json
 import textwrap
 import os
-from fluorescence_visualization_dash.utils.utils import load_json_file
+import io
+import uuid
+import logging
+import threading
+import base64
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from fluorescence_visualization_dash.utils.io import load_json_file
+from fluorescence_visualization_dash.utils.utils import SUMMARY_COLUMNS, INDEX_COLUMNS, figure_nbytes
 
 
 DATA_FOLDER_PATH = load_json_file("config.json").get("data_path", None)
+# "float32" (default), or "float16"/"uint16" to keep the arrays compact in memory
+STORAGE = load_json_file("config.json").get("storage", "float32")
+SCATTER_ENGINE = load_json_file("config.json").get("scatter_engine", "reference")
 
 app = dash.Dash(external_stylesheets=[dbc.themes.YETI],
                 suppress_callback_exceptions=True)
 
-fluorescence_obj = None
-fluorescence_obj_scatter_corr = None
+if not (DATA_FOLDER_PATH and os.path.exists(DATA_FOLDER_PATH)): 
+    DATA_FOLDER_PATH = None
+
+# Shared, read-only archive. Uploads live in per-session overlays on top of it.
+# Starts empty and is replaced once load_data finished in the background. 
+# Scatter correction is applied lazily to the requested samples only.
+fluorescence_obj = FluorescenceData(filepath=None)
+
+# generation counts the archives loaded so far, cached figures are only valid for theirs
+DATA_STATE = {"status": "idle" if DATA_FOLDER_PATH else "ready", "error": None, "generation": 0}
+_loading_lock = threading.Lock()
+
+
+def load_data() -> None: 
+    global fluorescence_obj
+    try: 
+        fluorescence_obj = FluorescenceData(filepath=DATA_FOLDER_PATH, storage=STORAGE, scatter_engine=SCATTER_ENGINE)
+    except Exception as e: 
+        logging.exception("Loading the data folder failed")
+        DATA_STATE.update(status="failed", error=str(e))
+        return
+    # the archive is replaced before the generation changes, see warm_bookmark
+    DATA_STATE["generation"] += 1
+    figure_cache.clear()
+    DATA_STATE["status"] = "ready"
+    bookmark_warmer.request()
+
+
+def start_loading() -> None: 
+    """Loads the data folder in a background thread (only once)."""
+    with _loading_lock: 
+        if DATA_STATE["status"] != "idle": 
+            return
+        DATA_STATE["status"] = "loading"
+    threading.Thread(target=load_data, name="data-loader", daemon=True).start()
+
+session_store = SessionStore(Path(__file__).parent/"cache/sessions")
+
+
+def session_data(session_id) -> FluorescenceData: 
+    """Archive plus the uploads of this session, combined once per upload (and archive)."""
+    archive = fluorescence_obj
+    return session_store.derived(session_id, archive, archive.with_overlay, FluorescenceData.view_nbytes)
+
+
+def scatter_params(pp_type, band, order, width, truncate, fill): 
+    """scatter_removal parameters from the spectrum page, None for raw data."""
+    if pp_type == "Raw": 
+        return None
+    return {"band": band, "order": order, "excision_width": width or 0, 
+            "truncate": None if truncate == "none" else truncate, 
+            "fill": None if fill == "nan" else fill}
+
+
+def build_pipeline(obj: FluorescenceData, index_loc, steps, blank_sample, scatter=None): 
+    """Preprocessing pipeline from the options of the spectrum page (None if nothing is chosen)."""
+    if not steps: 
+        return None
+    blank = None
+    if blank_sample: 
+        _sample, _batch = [str(s.strip()) for s in blank_sample.split("FROM")]
+        blank = obj.scatter_corrected(obj.select(_batch, _sample), scatter).Data.iloc[0]
+    return make_pipeline(steps, obj.axes(obj.select(index_loc=index_loc)), blank)
+
+
+class FigureRequest(NamedTuple): 
+    """Options of the spectrum page the figures depend on, the defaults are what it starts with."""
+    select_range: Tuple = ((200, 800), (200, 800))
+    colorbar: str = "individual"
+    pipeline_steps: Tuple = ()
+    blank_sample: Optional[str] = None
+    scatter: Optional[dict] = scatter_params("Preprocessed", "rayleigh", "both", 25, "below", "interp")
+    compare_mode: str = "none"
+    compare_reference: Optional[str] = None
+    batch_aggregate: bool = False
+    slice_axis: str = "all"
+    wavelengths: Tuple = ()
+
+
+class CachedFigures(NamedTuple): 
+    fig_1d: Any
+    fig_2d: Any
+    nbytes: int
+
+
+# Figures by (data generation, samples, FigureRequest), filled by get and by the bookmark warmer
+figure_cache = ArrayCache(max_bytes=128 * 1024**2)
+
+
+def figure_key(generation: int, index_loc, request: FigureRequest) -> str: 
+    return json.dumps([generation, [int(i) for i in index_loc], request])
+
+
+def build_figures(obj: FluorescenceData, data, index_loc, request: FigureRequest): 
+    """1D and 2D figure of the spectrum page. Raises ValueError with a message for the user."""
+    em_range, ex_range = request.select_range
+    select_range = (list(em_range), list(ex_range))
+    scatter = request.scatter
+    pipeline = build_pipeline(obj, index_loc, list(request.pipeline_steps), request.blank_sample, scatter)
+
+    if request.batch_aggregate: 
+        # QC view of the raw data of every batch in the table
+        batches = list(dict.fromkeys(row["Batch"] for row in data))
+        fig_1d = obj.get_batch_band_plotly(batches, select_range)
+        fig_2d = obj.get_batch_aggregate_plotly(batches, select_range, colorbar=request.colorbar)
+    else: 
+        if request.slice_axis != "all" and request.wavelengths: 
+            # only the chosen rows/columns of every sample are sent
+            fig_1d = obj.get_slice_plotly(
+                index_loc=index_loc, 
+                select_range=select_range, 
+                pipeline=pipeline, 
+                scatter=scatter, 
+                **{request.slice_axis: list(request.wavelengths)})
+        else: 
+            fig_1d = obj.get_spectrum(
+                index_loc=index_loc, 
+                select_range=select_range, 
+                pipeline=pipeline, 
+                scatter=scatter)
+
+        if request.compare_mode != "none" and request.compare_reference: 
+            fig_2d = obj.get_2d_comparison_plotly(
+                index_loc=index_loc, 
+                reference=comparison_reference(request.compare_reference), 
+                mode=request.compare_mode, 
+                select_range=select_range, 
+                colorbar=request.colorbar, 
+                pipeline=pipeline, 
+                scatter=scatter)
+        else: 
+            fig_2d = obj.get_2d_spectra_plotly_multiple(
+                index_loc=index_loc,
+                select_range=select_range, 
+                colorbar=request.colorbar, 
+                pipeline=pipeline, 
+                scatter=scatter)
+
+    for traces in fig_1d.data: 
+        if traces['name']: 
+            traces['name'] = '<br>'.join(textwrap.wrap(traces['name'], 25))
+    return fig_1d, fig_2d
+
+
+def warm_bookmark(rows) -> None: 
+    """Caches the figures the spectrum page first shows for the rows of a bookmark."""
+    generation = DATA_STATE["generation"]
+    obj = fluorescence_obj
+    index_loc = obj.catalogue.lookup(rows)
+    if not index_loc: 
+        return
+    key = figure_key(generation, index_loc, FigureRequest())
+    if figure_cache.get(key) is None: 
+        fig_1d, fig_2d = build_figures(obj, rows, index_loc, FigureRequest())
+        figure_cache.put(key, CachedFigures(fig_1d, fig_2d, figure_nbytes(fig_1d) + figure_nbytes(fig_2d)))
+
+
+bookmark_warmer = BookmarkWarmer(warm_bookmark)
+# new, removed and loaded bookmarks change the ranking
+subscribe_default(bookmark_warmer.request)
+
+
+def parse_wavelengths(text) -> List[float]: 
+    """Wavelengths typed as "350, 370" (empty for nothing)."""
+    return [float(part) for part in (text or "").replace(";", ",").split(",") if part.strip()]
+
+
+def comparison_reference(value): 
+    """(batch, name) from the compare_reference dropdown, name is None for the batch mean."""
+    name, batch = [part.strip() for part in value.rsplit("FROM", 1)]
+    return batch, name or None
 
-if DATA_FOLDER_PATH:
-    if os.path.exists(DATA_FOLDER_PATH): 
-        fluorescence_obj = FluorescenceData(
-                        filepath=DATA_FOLDER_PATH, 
-                        scatter_correction=False
-                    )
-        fluorescence_obj_scatter_corr = FluorescenceData(
-                        filepath=DATA_FOLDER_PATH, 
-                        scatter_correction=True
-                    )
 
 app.layout = html.Div(
     [dcc.Location(id="url"), 
      sidebar(), 
      main_content(), 
+     dcc.Store(id="session_id", storage_type="session"), 
      dcc.Store(id="table_store", storage_type="session", data=[]), 
-     dcc.Store(id="wavelength_selection", storage_type="session", data=[])])
+     dcc.Store(id="wavelength_selection", storage_type="session", data=[]), 
+     dcc.Store(id="figure_2d_state", storage_type="memory"), 
+     dcc.Interval(id="data_status_poll", interval=1000)])
+
+
+@app.callback(
+    [Output("data_status", "children"), 
+     Output("data_status_poll", "disabled")], 
+    Input("data_status_poll", "n_intervals"))
+def data_status(n_intervals): 
+    start_loading()
+    if DATA_STATE["status"] == "ready": 
+        return [], True
+    if DATA_STATE["status"] == "failed": 
+        return dbc.Alert(f"Loading the data folder failed: {DATA_STATE['error']}", color="danger"), True
+    return [dbc.Spinner(size="sm"), " Loading data folder ..."], False
+
+
+@app.callback(
+    Output("session_id", "data"), 
+    Input("url", "pathname"), 
+    State("session_id", "data"))
+def assign_session(pathname, session_id): 
+    if session_id: 
+        raise PreventUpdate
+    return uuid.uuid4().hex
+
+
+def search_catalogue(session_id, query, field, limit=50): 
+    """Matches from the archive index followed by matches among the session's uploads."""
+    matches = fluorescence_obj.catalogue.search(query, field, limit)
+    overlay = session_store.get(session_id)
+    if overlay is not None and len(matches) < limit: 
+        values = overlay.Name + " FROM " + overlay.Batch if field == "label" else overlay.Batch.drop_duplicates()
+        matches += values[values.str.contains(query.strip(), case=False, regex=False)].tolist()[:limit - len(matches)]
+    return matches
+
+
+def dynamic_options(search_value, value, session_id, field): 
+    if not search_value: 
+        raise PreventUpdate
+    options = search_catalogue(session_id, search_value, field)
+    # the selected value has to stay among the options
+    if value and value not in options: 
+        options = [value] + options
+    return options
+
+
+@app.callback(
+    Output("dropdown_batch", "options"), 
+    Input("dropdown_batch", "search_value"), 
+    [State("dropdown_batch", "value"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True)
+def search_batches(search_value, value, session_id): 
+    return dynamic_options(search_value, value, session_id, "batch")
+
+
+@app.callback(
+    Output("dropdown_sample_search", "options"), 
+    Input("dropdown_sample_search", "search_value"), 
+    [State("dropdown_sample_search", "value"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True)
+def search_samples(search_value, value, session_id): 
+    return dynamic_options(search_value, value, session_id, "label")
 
 
 @app.callback(
     Output(component_id="dropdown_sample", component_property="options"), 
     Input(component_id="dropdown_batch", component_property="value"), 
+    State("session_id", "data"), 
     prevent_initial_call=True)
-def show_samples(val): 
+def show_samples(val, session_id): 
     if val is not None: 
-        return list(fluorescence_obj.df.loc[
-            lambda x: x.Batch == val, "Name"
-        ])
+        return session_data(session_id).catalogue.samples(val)
     else: 
         raise PreventUpdate
 
 
 
 
+def with_summary_rows(rows, session_id): 
+    """Table rows (Batch/Name) completed with the precomputed summary statistics and indices."""
+    if not rows: 
+        return rows
+    keys = pd.DataFrame(rows)[["Batch", "Name"]]
+    summary = session_data(session_id).summary().drop_duplicates(["Batch", "Name"])
+    merged = keys.merge(summary, on=["Batch", "Name"], how="left")
+    return merged.astype(object).where(merged.notna(), None).to_dict("records")
+
+
 @app.callback(
     Output("table", "rowData"),
     [Input('dropdown_sample', 'value'),
      Input('dropdown_sample_search', 'value')],
     [State('table', 'rowData'), 
      State('dropdown_batch', 'value'),
+     State("session_id", "data"), 
      ]
 )
-def creating_table(sample_first_route, sample_second_route, data, batch): 
+def creating_table(sample_first_route, sample_second_route, data, batch, session_id): 
     if not ctx.triggered: 
         raise PreventUpdate
     
@@ -88,21 +341,36 @@ def creating_table(sample_first_route, sample_second_route, data, batch):
             raise PreventUpdate
         
     data.append({"Batch": _batch, "Name": _sample})
-    return data
+    return with_summary_rows(data, session_id)
 
 
 
 @app.callback(
     Output("table", "rowData", allow_duplicate=True),
     [Input('dropdown_bookmark', 'value')],
+    State("session_id", "data"), 
     prevent_initial_call=True
 )
-def creating_table_from_bookmark(bookmark): 
+def creating_table_from_bookmark(bookmark, session_id): 
     if (not ctx.triggered) or (bookmark is None): 
         raise PreventUpdate
     
     _data_bookmark = return_bookmark_data(bookmark)
-    return _data_bookmark
+    if _data_bookmark is None: 
+        raise PreventUpdate
+    return with_summary_rows(_data_bookmark, session_id)
+
+
+@app.callback(
+    Output("table", "columnState"), 
+    Input("show_summary", "value"), 
+    State("table", "columnDefs"), 
+    prevent_initial_call=True
+)
+def toggle_summary_columns(show, column_defs): 
+    return [{"colId": column["field"], 
+             "hide": (not show) and column["field"] in SUMMARY_COLUMNS + INDEX_COLUMNS} 
+            for column in column_defs]
 
 
 @app.callback(Output("main-content", "children"), 
@@ -114,7 +382,9 @@ def render_page_content(pathname, virtualtabledata, wv_data):
     if pathname == "/page-1":
         return table(virtualtabledata)
     elif pathname == "/page-2":
-        return spectrum_page(wv_data)
+        return spectrum_page(wv_data, virtualtabledata)
+    elif pathname == "/page-3":
+        return trend_page()
     else: 
         raise PreventUpdate
 
@@ -139,14 +409,20 @@ def store_data(n_clicks, tabledata):
         [Input(component_id="data_folder_button", component_property="n_clicks"), 
          Input(component_id="upload_button", component_property="n_clicks"), 
          Input(component_id="bookmark_button", component_property="n_clicks")], 
+         State("session_id", "data"), 
          prevent_initial_call=True
 )
 def left_main_content(*unused):
-    if (fluorescence_obj is None ) & (ctx.triggered_id in ["data_folder_button", "upload_button"]): 
+    session_id = unused[-1]
+    obj = session_data(session_id)
+    if (DATA_STATE["status"] == "loading") & (ctx.triggered_id == "data_folder_button"): 
+        return dbc.Alert("The data folder is still loading, try again in a moment.", 
+                        color="info", className="fs-2 text")
+    if obj.df.empty & (ctx.triggered_id == "data_folder_button"): 
         return dbc.Alert("There are no csv files in the folder", 
                         color="warning", className="fs-2 text")
     if ctx.triggered_id == "data_folder_button":
-        return dropdown_content(fluorescence_obj.df)
+        return dropdown_content()
     elif ctx.triggered_id == "upload_button": 
         return upload_content()
     elif ctx.triggered_id == "bookmark_button": 
@@ -156,6 +432,42 @@ def left_main_content(*unused):
 
 
 
+@app.callback(
+    Output("upload_status", "children"), 
+    Input("upload-data", "contents"), 
+    [State("upload-data", "filename"), 
+     State("upload-data", "last_modified"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True
+)
+def upload_files(contents, filenames, last_modified, session_id): 
+    if not contents or not session_id: 
+        raise PreventUpdate
+    overlay = session_store.get(session_id)
+    known = set(session_data(session_id).catalogue.batches())
+    added, skipped = [], []
+    for content, filename, modified in zip(contents, filenames, last_modified): 
+        if filename in known or not filename.endswith(".csv"): 
+            skipped.append(filename)
+            continue
+        _, content_string = content.split(",", 1)
+        dataframe = pd.read_csv(io.StringIO(base64.b64decode(content_string).decode("utf-8")))
+        date = datetime.fromtimestamp(modified)
+        overlay = pd.concat((overlay, fluorescence_obj.read_batch(dataframe, filename, date)), 
+                            ignore_index=True)
+        added.append(filename)
+    try: 
+        session_store.put(session_id, overlay)
+    except MemoryError as e: 
+        return dbc.Alert(str(e), color="danger")
+    # builds the combined view and its catalogue now rather than in the next callback
+    session_data(session_id)
+    message = [html.P(f"Added: {', '.join(added)}" if added else "Nothing was added.")]
+    if skipped: 
+        message.append(html.P(f"Skipped (already present or not csv): {', '.join(skipped)}"))
+    return dbc.Alert(message, color="success" if added else "warning", duration=5000)
+
+
 @app.callback(
     [Output("modal", "is_open"), 
     Output("bookmark_success", "children"), 
@@ -191,7 +503,7 @@ def toggle_modal(open_click, close_click, save_click, bookmark, is_open, tableDa
 )
 def toggle_modal(open_click, close_click, remove_click, bookmarks, is_open, clicks):
     if bookmarks is not None: 
-        remove_bookmarks_json(bookmarks)
+        remove_bookmarks(bookmarks)
         return not is_open, 0, clicks + 1
     elif open_click or close_click or remove_click: 
         return not is_open, 0, no_update
@@ -234,6 +546,7 @@ def toggle_collapse_preprocess(n, is_open):
     Output("oneD", "children"),
     Output("twoD", "children"),
     Output("wavelength_selection", "data"),
+    Output("figure_2d_state", "data"),
     [Input('create_figure', 'n_clicks')],
     [State("table_store", "data"), 
     State("emission_min", "value"), 
@@ -241,51 +554,207 @@ def toggle_collapse_preprocess(n, is_open):
     State("excitation_min", "value"), 
     State("excitation_max", "value"),
     State("wavelength_selection", "data"), 
-    State("preprocessing_type", "value")],
+    State("preprocessing_type", "value"), 
+    State("colorbar_mode", "value"), 
+    State("pipeline_steps", "value"), 
+    State("blank_sample", "value"), 
+    State("scatter_band", "value"), 
+    State("scatter_order", "value"), 
+    State("scatter_width", "value"), 
+    State("scatter_truncate", "value"), 
+    State("scatter_fill", "value"), 
+    State("compare_mode", "value"), 
+    State("compare_reference", "value"), 
+    State("batch_aggregate", "value"), 
+    State("slice_axis", "value"), 
+    State("slice_wavelengths", "value"), 
+    State("session_id", "data")],
     prevent_initial_call=True
 )
 
-def get(click, data, em_min, em_max, ex_min, ex_max, wv_store, pp_type):
-    def check_presence(df):
-        indices = []
-        for row in data:
-            matched_indices = df.index[(df.Batch == row['Batch']) & (df.Name == row['Name'])]
-            indices.extend(matched_indices)
-        return indices
-
+def get(click, data, em_min, em_max, ex_min, ex_max, wv_store, pp_type, colorbar_mode, 
+        pipeline_steps, blank_sample, band, order, width, truncate, fill, compare_mode, compare_reference, 
+        batch_aggregate, slice_axis, slice_wavelengths, session_id):
     if not data: 
         raise PreventUpdate
     
     if click:
-            index_loc = check_presence(fluorescence_obj.df)
-            # Generate the 1D figure
-
-            if pp_type == "Raw": 
-                obj = fluorescence_obj
+            try: 
+                wavelengths = parse_wavelengths(slice_wavelengths)
+            except ValueError: 
+                alert = dbc.Alert("Give the wavelengths as numbers separated by commas.", color="warning")
+                return alert, alert, no_update, no_update
+            request = FigureRequest(select_range=((em_min, em_max), (ex_min, ex_max)), 
+                                    colorbar=colorbar_mode, 
+                                    pipeline_steps=tuple(pipeline_steps or ()), 
+                                    blank_sample=blank_sample, 
+                                    scatter=scatter_params(pp_type, band, order, width, truncate, fill), 
+                                    compare_mode=compare_mode, 
+                                    compare_reference=compare_reference, 
+                                    batch_aggregate=bool(batch_aggregate), 
+                                    slice_axis=slice_axis, 
+                                    wavelengths=tuple(wavelengths))
+            generation = DATA_STATE["generation"]
+            obj = session_data(session_id)
+            index_loc = obj.catalogue.lookup(data)
+            # figures of the shared archive only, uploads differ per session
+            key = figure_key(generation, index_loc, request) if session_store.get(session_id) is None else None
+            cached = figure_cache.get(key) if key is not None else None
+            if cached is None: 
+                try: 
+                    fig_1d, fig_2d = build_figures(obj, data, index_loc, request)
+                except ValueError as e: 
+                    alert = dbc.Alert(str(e), color="warning")
+                    return alert, alert, no_update, no_update
+                if key is not None: 
+                    figure_cache.put(key, CachedFigures(fig_1d, fig_2d, figure_nbytes(fig_1d) + figure_nbytes(fig_2d)))
             else: 
-                obj = fluorescence_obj_scatter_corr
+                fig_1d, fig_2d = cached.fig_1d, cached.fig_2d
 
+            return dcc.Graph(figure=fig_1d, style={"width": "100%", "height": "100%"}),\
+                  dcc.Graph(id="graph_2d", figure=fig_2d, style={"width": "100%", "height": "100%"}), \
+                  [em_min, em_max, ex_min, ex_max], \
+                  {"index_loc": [int(i) for i in index_loc], 
+                   "select_range": [[em_min, em_max], [ex_min, ex_max]], 
+                   "scatter": request.scatter, 
+                   "pipeline_steps": pipeline_steps, 
+                   "blank_sample": blank_sample, 
+                   "resolution": fig_2d.layout.meta["resolution"]}
+        
+    else: 
+        raise PreventUpdate
 
-            fig_1d = obj.get_spectrum(
-                index_loc=index_loc, 
-                select_range=([em_min, em_max], [ex_min, ex_max]))
 
-            fig_2d = obj.get_2d_spectra_plotly_multiple(
-                index_loc=index_loc,
-                select_range=([em_min, em_max], [ex_min, ex_max]))
-            
-            for traces in fig_1d.data: 
-                traces['name'] = '<br>'.join(textwrap.wrap(traces['name'], 25))
+@app.callback(
+    Output("decomposition", "children"), 
+    Input("decompose_button", "n_clicks"), 
+    [State("table_store", "data"), 
+     State("decomposition_method", "value"), 
+     State("decomposition_components", "value"), 
+     State("decomposition_batches", "value"), 
+     State("emission_min", "value"), 
+     State("emission_max", "value"), 
+     State("excitation_min", "value"), 
+     State("excitation_max", "value"), 
+     State("preprocessing_type", "value"), 
+     State("pipeline_steps", "value"), 
+     State("blank_sample", "value"), 
+     State("scatter_band", "value"), 
+     State("scatter_order", "value"), 
+     State("scatter_width", "value"), 
+     State("scatter_truncate", "value"), 
+     State("scatter_fill", "value"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True
+)
+def decomposition(click, data, method, n_components, whole_batches, em_min, em_max, ex_min, ex_max, 
+                  pp_type, pipeline_steps, blank_sample, band, order, width, truncate, fill, session_id): 
+    if not click or not data: 
+        raise PreventUpdate
+    obj = session_data(session_id)
+    index_loc = obj.catalogue.lookup(data)
+    if whole_batches: 
+        # every sample of the selected batches measured on the same grid
+        selected = obj.select(index_loc=index_loc)
+        index_loc = obj.catalogue.rows(selected.Batch.unique(), grid_ids=selected.GridId.unique())
+    scatter = scatter_params(pp_type, band, order, width, truncate, fill)
+    try: 
+        pipeline = build_pipeline(obj, index_loc, pipeline_steps, blank_sample, scatter)
+        fig_scores, fig_loadings = obj.get_decomposition_plotly(
+            index_loc=index_loc, 
+            method=method, 
+            n_components=int(n_components or 3), 
+            select_range=([em_min, em_max], [ex_min, ex_max]), 
+            pipeline=pipeline, 
+            scatter=scatter)
+    except (ValueError, np.linalg.LinAlgError) as e: 
+        return dbc.Alert(str(e), color="warning")
+    return dbc.Row([dbc.Col(dcc.Graph(figure=fig_scores, style={"height": "100%"}), width=4), 
+                    dbc.Col(dcc.Graph(figure=fig_loadings, style={"height": "100%"}), width=8)], 
+                   style={"height": "100%"})
 
-            return dcc.Graph(figure=fig_1d, style={"width": "100%", "height": "100%"}),\
-                  dcc.Graph(figure=fig_2d, style={"width": "100%", "height": "100%"}), \
-                  [em_min, em_max, ex_min, ex_max]
-        
+
+@app.callback(
+    [Output("trend", "children"), 
+     Output("trend_state", "data")], 
+    Input("trend_button", "n_clicks"), 
+    [State("trend_value", "value"), 
+     State("trend_excitation", "value"), 
+     State("trend_emission", "value"), 
+     State("trend_table_only", "value"), 
+     State("table_store", "data"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True
+)
+def plot_trend(click, value, excitation, emission, table_only, data, session_id): 
+    if not click: 
+        raise PreventUpdate
+    state = {"value": value, "excitation": excitation, "emission": emission, 
+             "batches": sorted({row["Batch"] for row in data or []}) if table_only else None}
+    try: 
+        fig = session_data(session_id).get_trend_plotly(**state)
+    except ValueError as e: 
+        return dbc.Alert(str(e), color="warning"), None
+    return dcc.Graph(id="trend_graph", figure=fig, style={"height": "100%"}), state
+
+
+@app.callback(
+    Output("trend_graph", "figure"), 
+    Input("trend_graph", "relayoutData"), 
+    [State("trend_state", "data"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True
+)
+def downsample_trend_on_zoom(relayout, state, session_id): 
+    """Downsamples again within the zoomed date range (or the full range on reset)."""
+    if not relayout or not state: 
+        raise PreventUpdate
+    if "xaxis.range[0]" in relayout: 
+        date_range = (relayout["xaxis.range[0]"], relayout["xaxis.range[1]"])
+    elif "xaxis.autorange" in relayout: 
+        date_range = None
     else: 
         raise PreventUpdate
+    fig = session_data(session_id).get_trend_plotly(**state, date_range=date_range)
+    patched = Patch()
+    for key in ("x", "y", "text"): 
+        patched["data"][0][key] = fig.data[0][key]
+    patched["layout"]["title"]["text"] = fig.layout.title.text
+    return patched
+
+
+@app.callback(
+    Output("graph_2d", "figure"), 
+    Input("graph_2d", "relayoutData"), 
+    [State("figure_2d_state", "data"), 
+     State("session_id", "data")], 
+    prevent_initial_call=True
+)
+def full_resolution_on_zoom(relayout, state, session_id): 
+    """Swaps the binned preview of a zoomed subplot for the full resolution data."""
+    if not relayout or not state or state["resolution"] == 1: 
+        raise PreventUpdate
+    axes = {key.split(".")[0][5:] for key in relayout 
+            if key.startswith(("xaxis", "yaxis")) and ".range[" in key}
+    if not axes: 
+        raise PreventUpdate
+    obj = session_data(session_id)
+    pipeline = build_pipeline(obj, state["index_loc"], state["pipeline_steps"], state["blank_sample"], 
+                              state["scatter"])
+    patched = Patch()
+    for axis in axes: 
+        trace = int(axis or 1) - 1
+        df = obj.scatter_corrected(obj.select(index_loc=[state["index_loc"][trace]]), state["scatter"])
+        data, ex_em_dict = obj._stack(obj.preprocess(df, pipeline), state["select_range"])
+        patched["data"][trace]["z"] = data[0]
+        patched["data"][trace]["x"] = ex_em_dict["Emission"]
+    return patched
     
 
 def main(): 
+    # With the reloader only the serving child process (WERKZEUG_RUN_MAIN) loads data
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true": 
+        start_loading()
     app.run(debug=True, port=4000)
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+import os
+import time
+import logging
+import pathlib
+import sqlite3
+import threading
+from contextlib import closing
+from fluorescence_visualization_dash.utils.io import load_json_file
+
+BOOKMARK_PATH = pathlib.Path(__file__).parents[1]/"cache/bookmarks.json"
+BOOKMARK_DB_PATH = pathlib.Path(__file__).parents[1]/"cache/bookmarks.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    created REAL NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0,
+    last_used REAL
+);
+CREATE TABLE IF NOT EXISTS bookmark_rows (
+    bookmark_id INTEGER NOT NULL REFERENCES bookmarks(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    batch TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (bookmark_id, position)
+);
+"""
+
+
+class BookmarkStore: 
+    """
+    Bookmarks (saved table selections) in a SQLite database in WAL mode. 
+    Every operation is its own transaction, so concurrent users can not lose writes. 
+    A legacy bookmarks.json next to the database is migrated on first use. 
+    Loading a bookmark (record_use) is counted, most_used ranks them for BookmarkWarmer.
+    """
+    def __init__(self, 
+                 db_path: Union[str, os.PathLike], 
+                 legacy_json_path: Optional[Union[str, os.PathLike]] = None) -> None: 
+        
+        self.db_path = pathlib.Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._listeners: List[Callable[[], Any]] = []
+        with closing(self._connect()) as conn: 
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = [column for _, column, *_ in conn.execute("PRAGMA table_info(bookmarks)")]
+            with conn: 
+                # databases created before the usage counts
+                if "uses" not in columns: 
+                    conn.execute("ALTER TABLE bookmarks ADD COLUMN uses INTEGER NOT NULL DEFAULT 0")
+                if "last_used" not in columns: 
+                    conn.execute("ALTER TABLE bookmarks ADD COLUMN last_used REAL")
+        if legacy_json_path is not None: 
+            self.__migrate_json(pathlib.Path(legacy_json_path))
+
+
+    def _connect(self) -> sqlite3.Connection: 
+        # One short lived connection per call: dash serves callbacks from several threads.
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+
+    def __migrate_json(self, json_path: pathlib.Path) -> None: 
+        if not json_path.exists(): 
+            return
+        data = load_json_file(json_path)
+        migrated = sum(self.add(name, rows) for name, rows in data.items())
+        os.replace(json_path, json_path.with_suffix(".json.migrated"))
+        logging.info(f"{migrated} bookmarks migrated from {json_path.name}.")
+
+
+    def subscribe(self, listener: Callable[[], Any]) -> None: 
+        """listener is called after a bookmark was added, removed or loaded (record_use)."""
+        self._listeners.append(listener)
+
+
+    def __notify(self) -> None: 
+        for listener in self._listeners: 
+            listener()
+
+
+    def names(self) -> List[str]: 
+        with closing(self._connect()) as conn: 
+            return [name for (name,) in conn.execute("SELECT name FROM bookmarks ORDER BY created, id")]
+
+
+    def get(self, name: str) -> Optional[List[Dict]]: 
+        """Rows of the bookmark in their saved order or None if it does not exist."""
+        with closing(self._connect()) as conn: 
+            found = conn.execute("SELECT id FROM bookmarks WHERE name = ?", (name,)).fetchone()
+            if found is None: 
+                return None
+            rows = conn.execute("SELECT batch, name FROM bookmark_rows "
+                                "WHERE bookmark_id = ? ORDER BY position", found)
+            return [{"Batch": batch, "Name": sample} for batch, sample in rows]
+
+
+    def add(self, name: str, rows: Iterable[Dict]) -> bool: 
+        """Saves the bookmark. Returns False if the name is already taken."""
+        with closing(self._connect()) as conn: 
+            try: 
+                with conn: 
+                    cursor = conn.execute("INSERT INTO bookmarks (name, created) VALUES (?, ?)", 
+                                          (name, time.time()))
+                    conn.executemany("INSERT INTO bookmark_rows (bookmark_id, position, batch, name) "
+                                     "VALUES (?, ?, ?, ?)", 
+                                     [(cursor.lastrowid, position, row["Batch"], row["Name"]) 
+                                      for position, row in enumerate(rows)])
+            except sqlite3.IntegrityError: 
+                return False
+        self.__notify()
+        return True
+
+
+    def remove(self, names: Iterable[str]) -> int: 
+        """Deletes the bookmarks and returns how many existed."""
+        with closing(self._connect()) as conn: 
+            with conn: 
+                cursor = conn.executemany("DELETE FROM bookmarks WHERE name = ?", 
+                                          [(name,) for name in names])
+        if cursor.rowcount: 
+            self.__notify()
+        return cursor.rowcount
+
+
+    def record_use(self, name: str) -> None: 
+        with closing(self._connect()) as conn: 
+            with conn: 
+                cursor = conn.execute("UPDATE bookmarks SET uses = uses + 1, last_used = ? WHERE name = ?", 
+                                      (time.time(), name))
+        if cursor.rowcount: 
+            self.__notify()
+
+
+    def most_used(self, n: int) -> List[str]: 
+        """Names of the n bookmarks loaded most often (ties: most recently used), unused ones left out."""
+        with closing(self._connect()) as conn: 
+            return [name for (name,) in conn.execute("SELECT name FROM bookmarks WHERE uses > 0 "
+                                                     "ORDER BY uses DESC, last_used DESC LIMIT ?", (n,))]
+
+
+_default_store: Optional[BookmarkStore] = None
+_default_listeners: List[Callable[[], Any]] = []
+_default_lock = threading.Lock()
+
+
+def default_store() -> BookmarkStore: 
+    """
+    The app's store at BOOKMARK_DB_PATH, created on first use rather than at import 
+    since opening it creates or migrates the database.
+    """
+    global _default_store
+    with _default_lock: 
+        if _default_store is None: 
+            _default_store = BookmarkStore(BOOKMARK_DB_PATH, legacy_json_path=BOOKMARK_PATH)
+            for listener in _default_listeners: 
+                _default_store.subscribe(listener)
+        return _default_store
+
+
+def subscribe_default(listener: Callable[[], Any]) -> None: 
+    """BookmarkStore.subscribe on default_store without opening the database yet."""
+    with _default_lock: 
+        if _default_store is None: 
+            _default_listeners.append(listener)
+        else: 
+            _default_store.subscribe(listener)
+
+
+class BookmarkWarmer: 
+    """
+    Background job precomputing what opening the most used bookmarks needs, so the first 
+    request is a cache hit. warm is called with the rows of every bookmark and does the work 
+    (the app builds and caches the default figures), store returns the BookmarkStore. request() starts a run 
+    after delay seconds, requests arriving in the meantime or while it runs are coalesced into a single (re)run.
+    """
+    def __init__(self, 
+                 warm: Callable[[List[Dict]], Any], 
+                 store: Callable[[], BookmarkStore] = default_store, 
+                 top_n: int = 5, 
+                 delay: float = 1.0) -> None: 
+        
+        self.store = store
+        self.warm = warm
+        self.top_n = top_n
+        self.delay = delay
+        self._pending = False
+        self._running = False
+        self._lock = threading.Lock()
+
+
+    def request(self) -> None: 
+        with self._lock: 
+            self._pending = True
+            if self._running: 
+                return
+            self._running = True
+        threading.Thread(target=self.__run, name="bookmark-warmer", daemon=True).start()
+
+
+    def __run(self) -> None: 
+        while True: 
+            # debounces bursts of requests, e.g. a user stepping through bookmarks
+            time.sleep(self.delay)
+            with self._lock: 
+                if not self._pending: 
+                    self._running = False
+                    return
+                self._pending = False
+            try: 
+                self.__warm_most_used()
+            except Exception: 
+                # e.g. a locked database, the next request tries again
+                logging.exception("Pre-warming the bookmarks failed")
+
+
+    def __warm_most_used(self) -> None: 
+        store = self.store()
+        for name in store.most_used(self.top_n): 
+            rows = store.get(name)
+            if not rows: 
+                continue
+            try: 
+                self.warm(rows)
+            except Exception: 
+                logging.exception(f"Pre-warming bookmark {name} failed")
@@ -1,12 +1,150 @@
+import os
 import click
-from fluorescence_visualization_dash.utils.utils import save_json_file
+from fluorescence_visualization_dash.utils.io import save_json_file, load_json_file
+
+# numpy/pandas/plotly are imported inside the commands, set_data_path has to start instantly.
+
 
 @click.command()
 @click.argument('directory', required=False, type=click.Path(exists=True, file_okay=False, dir_okay=True))
 def data_path(directory):
     if directory:
         save_json_file("config.json", 
-                       {"data_path": directory})
+                       {**load_json_file("config.json"), "data_path": directory})
         click.echo(f"Directory set to: {directory}")
     else:
-        click.echo("No directory provided. Only upload will be possible.")
\ No newline at end of file
+        click.echo("No directory provided. Only upload will be possible.")
+
+
+_worker_data = None
+
+
+def _init_worker(directory, storage, scatter_engine): 
+    global _worker_data
+    import pathlib
+    from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData, SCATTER_DISK_CACHE_BYTES
+    from fluorescence_visualization_dash.preprocessing.preprocessing import DiskArrayCache
+    # Holds only the rows of the chunk being exported, the archive stays in the parent. 
+    # Scatter corrections are shared with the app through the data folder's disk cache.
+    _worker_data = FluorescenceData(None, storage=storage, scatter_engine=scatter_engine)
+    _worker_data.scatter_disk_cache = DiskArrayCache(pathlib.Path(directory)/".scatter_cache", 
+                                                     max_bytes=SCATTER_DISK_CACHE_BYTES)
+
+
+def _export_chunk(chunk_id, rows, grids, select_range, scatter, output, what, fmt): 
+    """Renders/exports one chunk of samples (rows of the catalogue, all on one grid) in a worker process."""
+    import numpy as np
+    from fluorescence_visualization_dash.dataloader.dataloader import GRIDS
+    for excitation, emission in grids.values(): 
+        GRIDS.register(excitation, emission)
+    obj = _worker_data
+    obj.df = rows
+    index_loc = rows.index.tolist()
+    written = []
+    if what in ("figures", "both"): 
+        for kind, fig in [("spectrum", obj.get_spectrum(index_loc=index_loc, select_range=select_range, scatter=scatter)), 
+                          ("eem", obj.get_2d_spectra_plotly_multiple(index_loc=index_loc, select_range=select_range, 
+                                                                    scatter=scatter, resolution=1))]: 
+            path = os.path.join(output, f"{kind}_{chunk_id:04d}.{fmt}")
+            if fmt == "html": 
+                fig.write_html(path, include_plotlyjs="cdn")
+            elif fmt == "json": 
+                fig.write_json(path)
+            else: 
+                fig.write_image(path)    # needs kaleido
+            written.append(path)
+    if what in ("arrays", "both"): 
+        df = obj.scatter_corrected(obj.select(index_loc=index_loc), scatter)
+        data, axes = obj._stack(df, select_range)
+        path = os.path.join(output, f"arrays_{chunk_id:04d}.npz")
+        np.savez_compressed(path, data=data, excitation=axes['Excitation'], emission=axes['Emission'], 
+                            batch=df.Batch.to_numpy(dtype=str), name=df.Name.to_numpy(dtype=str))
+        written.append(path)
+    return written
+
+
+@click.command()
+@click.option("--data-path", "directory", type=click.Path(exists=True, file_okay=False), default=None, 
+              help="Data folder, defaults to the one set with set_data_path.")
+@click.option("--bookmark", default=None, help="Export the samples of this bookmark.")
+@click.option("--sample", "samples", multiple=True, metavar="BATCH::NAME", help="Sample to export (repeatable).")
+@click.option("--batch", "batches", multiple=True, help="Export every sample of this batch (repeatable).")
+@click.option("--emission", nargs=2, type=int, default=(200, 800), show_default=True)
+@click.option("--excitation", nargs=2, type=int, default=(200, 800), show_default=True)
+@click.option("--mode", type=click.Choice(["raw", "preprocessed"]), default="preprocessed", show_default=True, 
+              help="preprocessed applies the default scatter removal.")
+@click.option("--what", type=click.Choice(["figures", "arrays", "both"]), default="figures", show_default=True)
+@click.option("--format", "fmt", type=click.Choice(["html", "json", "png", "svg", "pdf"]), default="html", show_default=True, 
+              help="Figure format, images need kaleido.")
+@click.option("--per-figure", type=click.IntRange(min=1), default=9, show_default=True, help="Samples per figure/array file.")
+@click.option("--workers", type=click.IntRange(min=1), default=os.cpu_count(), show_default=True)
+@click.option("--output", type=click.Path(file_okay=False), default="export", show_default=True)
+@click.option("--storage", type=click.Choice(["float32", "float16", "uint16"]), default=None, 
+              help="Array storage, defaults to the one in config.json (float32).")
+def export(directory, bookmark, samples, batches, emission, excitation, mode, what, fmt, per_figure, workers, output, storage): 
+    """Render figures or export arrays without starting the Dash server."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+    from fluorescence_visualization_dash.dataloader.dataloader import GRIDS
+    from fluorescence_visualization_dash.bookmarks.bookmarks import default_store
+
+    config = load_json_file("config.json")
+    directory = directory or config.get("data_path")
+    if not directory: 
+        raise click.UsageError("No data folder, pass --data-path or run set_data_path first.")
+
+    pairs = [tuple(sample.split("::", 1)) for sample in samples]
+    if bookmark is not None: 
+        rows = default_store().get(bookmark)
+        if rows is None: 
+            raise click.BadParameter(f"No bookmark named {bookmark!r}.", param_hint="--bookmark")
+        pairs.extend((row["Batch"], row["Name"]) for row in rows)
+    if any(len(pair) != 2 for pair in pairs): 
+        raise click.BadParameter("Use BATCH::NAME.", param_hint="--sample")
+
+    obj = FluorescenceData(directory, storage=storage or config.get("storage", "float32"), 
+                           scatter_engine=config.get("scatter_engine", "reference"))
+    rows = obj.catalogue.rows(batches) if batches else []
+    seen = set(rows)
+    rows += [row for row in obj.catalogue.lookup(pairs) if row not in seen]
+    selection = obj.df.loc[rows, ["GridId"]]
+    if selection.empty: 
+        raise click.UsageError("Nothing matches the given bookmark/samples/batches.")
+
+    # Chunks never mix grids, so every chunk can be stacked.
+    chunks = [group.index[i:i + per_figure].tolist() 
+              for _, group in selection.groupby("GridId", sort=False) 
+              for i in range(0, len(group), per_figure)]
+    scatter = {} if mode == "preprocessed" else None
+    select_range = (list(emission), list(excitation))
+    os.makedirs(output, exist_ok=True)
+    click.echo(f"Exporting {len(selection)} samples in {len(chunks)} chunks with {workers} workers.")
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), 
+                             initializer=_init_worker, initargs=(directory, obj.storage, obj.scatter_engine)) as pool: 
+        # every worker receives the rows (arrays included) of its chunk only
+        futures = [pool.submit(_export_chunk, i, obj.df.loc[chunk], GRIDS.export(obj.df.GridId[chunk]), 
+                               select_range, scatter, output, what, fmt) 
+                   for i, chunk in enumerate(chunks)]
+        with click.progressbar(as_completed(futures), length=len(futures), label="Exporting") as bar: 
+            for future in bar: 
+                future.result()
+    click.echo(f"Written to {output}")
+
+
+@click.command()
+@click.option("--data-path", "directory", type=click.Path(exists=True, file_okay=False), default=None, 
+              help="Data folder, defaults to the one set with set_data_path.")
+@click.option("--storage", type=click.Choice(["float32", "float16", "uint16"]), default=None, 
+              help="Array storage, defaults to the one in config.json (float32).")
+def memory_report(directory, storage): 
+    """Load the data folder and print the memory used per component."""
+    from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+
+    config = load_json_file("config.json")
+    directory = directory or config.get("data_path")
+    if not directory: 
+        raise click.UsageError("No data folder, pass --data-path or run set_data_path first.")
+    obj = FluorescenceData(directory, storage=storage or config.get("storage", "float32"))
+    click.echo(f"{len(obj.df)} samples, {obj.storage} storage")
+    click.echo(obj.memory_report().to_string(float_format="{:.2f}".format))
@@ -2,10 +2,8 @@ import dash_bootstrap_components as dbc
 from dash import dcc, html
 from typing import List, Any, Union, Dict
 import dash_ag_grid as dag
-from pathlib import Path
-from fluorescence_visualization_dash.utils.utils import load_json_file, save_json_file
-
-BOOKMARK_PATH = Path(__file__).parents[1]/"cache/bookmarks.json"
+from fluorescence_visualization_dash.bookmarks.bookmarks import default_store
+from fluorescence_visualization_dash.utils.utils import SUMMARY_COLUMNS, INDEX_COLUMNS
 
 SIDEBAR_STYLE = {
     "position": "fixed",
@@ -40,22 +38,28 @@ def sidebar() -> html.Div:
                         [
                             dbc.NavLink("Data", href="/page-1", active="exact"),
                             dbc.NavLink("Spectra", href="/page-2", active="exact"),
+                            dbc.NavLink("Trends", href="/page-3", active="exact"),
                         ],
                         vertical=True,
                         pills=True,
                         className="lead fw-bolder"
                     ),
+                    *make_break(1),
+                    html.Div(id="data_status", className="text-muted"),
                 ],
                 style=SIDEBAR_STYLE,
             )
 
 
-def dropdown_batches(df) -> dbc.Row: 
+# Options of the batch/search dropdowns are filled server-side while typing
+# (see search_batches/search_samples in app.py), only the matches are sent.
+def dropdown_batches() -> dbc.Row: 
     return dbc.Row([
         dbc.Col(
             dcc.Dropdown(
                 id="dropdown_batch", 
-                options=df.Batch.unique()
+                placeholder="Type to search batches", 
+                options=[]
             ),
             width={"size": 10}
         )
@@ -75,34 +79,35 @@ def dropdown_samples() -> dbc.Row:
     ]
     )
 
-def dropdown_search_samples(df) -> dbc.Row: 
+def dropdown_search_samples() -> dbc.Row: 
     return dbc.Row([
         dbc.Col(
             dcc.Dropdown(
                 id="dropdown_sample_search", 
-                options=(df['Name'] + " FROM " + df['Batch']).to_numpy()
+                placeholder="Type a sample or batch name", 
+                options=[]
             ),
             width={"size": 12}
         )
     ]
     )
 
-def dropdown_content(df) -> List: 
+def dropdown_content() -> List: 
     return [
         dbc.Row(dbc.Col(html.P("Select a Batch"), className="lead")),
-        dropdown_batches(df), 
+        dropdown_batches(), 
         *make_break(2), 
         dbc.Row(dbc.Col(html.P("Select sample/samples",className="lead"))),
         dropdown_samples(), 
         *make_break(2), 
         dbc.Row(dbc.Col(html.P("Or you can search for the sample name", 
                        className="lead text fst-italic"))),
-        dropdown_search_samples(df)
+        dropdown_search_samples()
     ]
 
 
-def upload_content() -> dcc.Upload:
-    return dcc.Upload(
+def upload_content() -> List:
+    return [dcc.Upload(
                         id='upload-data',
                         children=html.Div([
                             'Drag and Drop or ',
@@ -118,7 +123,10 @@ def upload_content() -> dcc.Upload:
                             'textAlign': 'center',
                             'margin': '10px'
                         },
-                        multiple=True)
+                        multiple=True), 
+            html.P("Uploaded files are only visible in this browser session and show up under 'Use data folder'.", 
+                   className="text-muted"), 
+            html.Div(id="upload_status")]
 
 
 def remove_bookmarks_div(data): 
@@ -130,7 +138,7 @@ def remove_bookmarks_div(data):
                                             dcc.Dropdown(id="bookmark-name-to-delete", 
                                                          placeholder="Select the bookmark/s", 
                                                          multi=True, 
-                                                         options=list(data.keys()))
+                                                         options=data)
                                         ),
                                         dbc.ModalFooter(
                                             [dbc.Button("Remove", id="remove-bookmark", color="danger", n_clicks=0),
@@ -143,31 +151,27 @@ def remove_bookmarks_div(data):
     ]
 
 
-def remove_bookmarks_json(values: List): 
-    data = load_json_file(BOOKMARK_PATH)
-    for name in data.copy(): 
-        if name in values: 
-            del data[name]
-    save_json_file(BOOKMARK_PATH, data)
+def remove_bookmarks(values: List): 
+    default_store().remove(values)
 
 def load_bookmarks() -> Union[dcc.Dropdown, dbc.Alert]: 
-    data = load_json_file(BOOKMARK_PATH)
+    data = default_store().names()
     if data: 
         return [dcc.Dropdown(
                 id="dropdown_bookmark", 
-                options=list(data.keys())), *remove_bookmarks_div(data)]
+                options=data), *remove_bookmarks_div(data)]
     return dbc.Alert("There are no bookmarks", color="warning", className="fs-2 text"),
      
 def return_bookmark_data(key) -> List: 
-    data = load_json_file(BOOKMARK_PATH)
-    return data[key]
+    data = default_store().get(key)
+    if data is not None: 
+        # ranks the bookmarks for pre-warming
+        default_store().record_use(key)
+    return data
 
 def save_bookmarks(bookmark_name: str, data: Dict) -> dbc.Alert: 
-    existing_data = load_json_file(BOOKMARK_PATH)
-    if bookmark_name in existing_data: 
+    if not default_store().add(bookmark_name, data): 
             return dbc.Alert("A bookmark with same name already exists!", color="warning", duration=3000)    
-    existing_data[bookmark_name] = data
-    save_json_file(BOOKMARK_PATH, existing_data)
     return dbc.Alert("Bookmark saved successfully!", color="success", duration=3000)
 
 
@@ -177,7 +181,10 @@ def create_table(data) ->  html.Div:
             columnDefs=[
 
                 {"headerName": "Batch", "field": "Batch","checkboxSelection": True, "headerCheckboxSelection": True}, 
-                {"headerName": "Name", "field": "Name"}
+                {"headerName": "Name", "field": "Name"}, 
+                *[{"headerName": column, "field": column, "sortable": True, "filter": "agNumberColumnFilter", 
+                   "valueFormatter": {"function": "d3.format('.4~g')(params.value)"}, "hide": True} 
+                  for column in SUMMARY_COLUMNS + INDEX_COLUMNS]
             ],   
             rowData=data,
             virtualRowData=data, 
@@ -221,6 +228,7 @@ def table(data):
                                 dbc.Col([dbc.Button("Delete selected", id="delete_button", color="danger", n_clicks=0),
                                 dbc.Tooltip("Delete the selected rows?", 
                                             target="delete_button")]),
+                                dbc.Col(dbc.Switch(id="show_summary", label="Show statistics", value=False)), 
                                 dbc.Col([dbc.Button("Do you want to bookmark this data?", 
                                         id="bookmark", color="dark", className="float-end")])]), 
                                 create_table(data),
@@ -264,7 +272,23 @@ tab_2d_content = html.Div(
     style={"height": "82vh"}
 )
 
-def collapse_wavelength_selection(wv_data): 
+tab_decomposition_content = html.Div(
+    children=[
+        dbc.Row([
+            dbc.Col(dbc.RadioItems(options=[{"label": "PCA", "value": "pca"}, 
+                                            {"label": "PARAFAC", "value": "parafac"}], 
+                                   value="pca", id="decomposition_method", inline=True), width="auto"), 
+            dbc.Col(dbc.InputGroup([dbc.InputGroupText("Components"), 
+                                    dbc.Input(id="decomposition_components", type="number", 
+                                              min=1, max=10, value=3)], size="sm"), width=3), 
+            dbc.Col(dbc.Switch(id="decomposition_batches", label="Whole batches", value=False), width="auto"), 
+            dbc.Col(dbc.Button("Decompose", id="decompose_button", size="sm"), width="auto"), 
+        ], align="center"), 
+        html.Div(children=[], id="decomposition", style={"height": "78vh"})
+    ]
+)
+
+def collapse_wavelength_selection(wv_data, table_data=None): 
     return html.Div(
         children=[
             dbc.Button("Change wavelength?", size="sm", id="button_collapse"), 
@@ -301,16 +325,78 @@ def collapse_wavelength_selection(wv_data):
                     options=["Raw", "Preprocessed"], 
                     value="Preprocessed", 
                     id="preprocessing_type"
+                ), 
+                html.P("Scatter removal", className="small mt-2 mb-0"), 
+                dcc.Dropdown(id="scatter_band", options=["rayleigh", "raman", "both"], 
+                             value="rayleigh", clearable=False), 
+                dcc.Dropdown(id="scatter_order", options=["first", "second", "both"], 
+                             value="both", clearable=False), 
+                dbc.Input(id="scatter_width", type="number", min=0, max=200, value=25, size="sm"), 
+                dcc.Dropdown(id="scatter_truncate", options=["none", "below", "above", "both"], 
+                             value="below", clearable=False), 
+                dcc.Dropdown(id="scatter_fill", options=["interp", "zeros", "nan"], 
+                             value="interp", clearable=False), 
+                *make_break(1), 
+                dbc.Checklist(
+                    options=[{"label": "Blank subtraction", "value": "blank"}, 
+                             {"label": "Raman units", "value": "raman"}, 
+                             {"label": "Smoothing", "value": "smoothing"}], 
+                    value=[], 
+                    id="pipeline_steps"
+                ), 
+                dcc.Dropdown(
+                    id="blank_sample", 
+                    placeholder="Blank sample", 
+                    options=[f"{row['Name']} FROM {row['Batch']}" for row in table_data or []]
                 )
             ], 
             id="collapse_preprocess", 
-                is_open=False)
+                is_open=False), 
+            *make_break(2), 
+            html.P("Colorbar (2D)", className="small"), 
+            dbc.RadioItems(
+                options=[{"label": "Per sample", "value": "individual"}, 
+                         {"label": "Shared", "value": "shared"}, 
+                         {"label": "Hidden", "value": "hide"}], 
+                value="individual", 
+                id="colorbar_mode"
+            ), 
+            *make_break(1), 
+            html.P("Spectra (1D)", className="small"), 
+            dbc.RadioItems(
+                options=[{"label": "All excitations", "value": "all"}, 
+                         {"label": "At excitation", "value": "excitation"}, 
+                         {"label": "At emission", "value": "emission"}], 
+                value="all", 
+                id="slice_axis"
+            ), 
+            dbc.Input(id="slice_wavelengths", type="text", placeholder="e.g. 350, 370", size="sm"), 
+            *make_break(1), 
+            html.P("Compare (2D)", className="small"), 
+            dbc.RadioItems(
+                options=[{"label": "Off", "value": "none"}, 
+                         {"label": "Difference", "value": "difference"}, 
+                         {"label": "Ratio", "value": "ratio"}, 
+                         {"label": "Z-score", "value": "zscore"}], 
+                value="none", 
+                id="compare_mode"
+            ), 
+            dcc.Dropdown(
+                id="compare_reference", 
+                placeholder="Reference", 
+                # "FROM <batch>" (no sample name) stands for the batch mean
+                options=[{"label": f"Mean of {batch}", "value": f"FROM {batch}"} 
+                         for batch in dict.fromkeys(row['Batch'] for row in table_data or [])] + 
+                        [f"{row['Name']} FROM {row['Batch']}" for row in table_data or []]
+            ), 
+            *make_break(1), 
+            dbc.Switch(id="batch_aggregate", label="Batch mean/median/std", value=False)
         ], 
         className="float-end"
     )
 
 
-def spectrum_page(wv_data) -> List: 
+def spectrum_page(wv_data, table_data=None) -> List: 
     return [
         dbc.Row(
             dbc.Col([dbc.Button("Click here to create the figure", id="create_figure")], 
@@ -320,14 +406,36 @@ def spectrum_page(wv_data) -> List:
         dbc.Row([dbc.Col(html.Div(dbc.Tabs
                 ([
                 dbc.Tab([*make_break(1), tab_1d_content], label="1D spectra", tab_class_name ="flex-grow-1 text-center ", active_tab_class_name ="fw-bold"),
-                dbc.Tab([*make_break(1), tab_2d_content], label="2D spectra", tab_class_name ="flex-grow-1 text-center", active_tab_class_name ="fw-bold")
+                dbc.Tab([*make_break(1), tab_2d_content], label="2D spectra", tab_class_name ="flex-grow-1 text-center", active_tab_class_name ="fw-bold"),
+                dbc.Tab([*make_break(1), tab_decomposition_content], label="Decomposition", tab_class_name ="flex-grow-1 text-center", active_tab_class_name ="fw-bold")
                 ]
                 ,
                 ),style={"height":"90%"}), width=11), 
-                dbc.Col(collapse_wavelength_selection(wv_data), width=1, class_name="float-end")])
+                dbc.Col(collapse_wavelength_selection(wv_data, table_data), width=1, class_name="float-end")])
     ]
 
     
+def trend_page() -> List: 
+    return [
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(id="trend_value", 
+                                 options=["Intensity", *INDEX_COLUMNS, "Max", "Min", "Integral"], 
+                                 value="Intensity", clearable=False), width=2), 
+            dbc.Col(dbc.InputGroup([dbc.InputGroupText("Excitation"), 
+                                    dbc.Input(id="trend_excitation", type="number", min=200, max=800, value=350)]), 
+                    width=2), 
+            dbc.Col(dbc.InputGroup([dbc.InputGroupText("Emission"), 
+                                    dbc.Input(id="trend_emission", type="number", min=200, max=800, value=450)]), 
+                    width=2), 
+            dbc.Col(dbc.Switch(id="trend_table_only", label="Only batches in the table", value=False), width="auto"), 
+            dbc.Col(dbc.Button("Plot", id="trend_button"), width="auto"), 
+        ], align="center"), 
+        *make_break(1), 
+        html.Div(children=[], id="trend", style={"height": "80vh"}), 
+        dcc.Store(id="trend_state", storage_type="memory")
+    ]
+
+
 def main_content() -> html.Div: 
     return html.Div(  
         id="main-content", 
@@ -0,0 +1,138 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import os
+import bisect
+import pathlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+class Catalogue: 
+    """
+    Arrow table of the sample catalogue: every column of FluorescenceData.df except the 
+    arrays, Batch/Name dictionary encoded, plus Row (the index label in df). 
+    Lookups, unique listings and joins against a selection run as Arrow compute kernels.
+    """
+    def __init__(self, table: pa.Table) -> None: 
+        self.table = table
+        self._search_indices: Dict[str, SearchIndex] = {}
+
+    def __len__(self) -> int: 
+        return self.table.num_rows
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "Catalogue": 
+        columns = [column for column in df.columns if df[column].dtype != object or column in ("Batch", "Name")]
+        table = pa.Table.from_pandas(df[columns].assign(Row=df.index.to_numpy()), preserve_index=False)
+        for column in ("Batch", "Name"): 
+            table = table.set_column(table.schema.get_field_index(column), column, 
+                                     pc.dictionary_encode(table[column].cast(pa.string())))
+        return cls(table)
+
+    @classmethod
+    def read(cls, path: Union[str, os.PathLike]) -> "Catalogue": 
+        """Memory maps an Arrow IPC file written by write, no copy of the columns is made."""
+        with pa.memory_map(str(path), "r") as source: 
+            return cls(pa.ipc.open_file(source).read_all())
+
+    def write(self, path: Union[str, os.PathLike]) -> None: 
+        path = pathlib.Path(path)
+        tmp_path = path.with_suffix(".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink: 
+            with pa.ipc.new_file(sink, self.table.schema) as writer: 
+                writer.write_table(self.table)
+        os.replace(tmp_path, path)
+
+    def batches(self) -> List[str]: 
+        return pc.unique(self.table["Batch"]).to_pylist()
+
+    def samples(self, batch: str) -> List[str]: 
+        return self.table.filter(pc.equal(self.table["Batch"], batch))["Name"].to_pylist()
+
+    def labels(self) -> List[str]: 
+        """'Name FROM Batch' of every sample (the search dropdown format)."""
+        return pc.binary_join_element_wise(self.table["Name"].cast(pa.string()), 
+                                           self.table["Batch"].cast(pa.string()), 
+                                           " FROM ").to_pylist()
+
+    def search(self, query: str, field: str = "label", limit: int = 50) -> List[str]: 
+        """
+        Server-side search for the dropdowns: field="label" searches 'Name FROM Batch', 
+        field="batch" the batch names. The index is built on first use.
+        """
+        if field not in self._search_indices: 
+            self._search_indices[field] = SearchIndex(self.labels() if field == "label" else self.batches())
+        return self._search_indices[field].search(query, limit)
+
+    def rows(self, 
+             batch: Optional[Union[str, Iterable[str]]] = None, 
+             grid_ids: Optional[Iterable[int]] = None) -> List: 
+        """Row labels of the samples in batch (one or several), measured on one of grid_ids if given."""
+        table = self.table
+        if batch is not None: 
+            batches = [batch] if isinstance(batch, str) else list(batch)
+            table = table.filter(pc.is_in(table["Batch"].cast(pa.string()), value_set=pa.array(batches, pa.string())))
+        if grid_ids is not None: 
+            grid_ids = pa.array([int(grid_id) for grid_id in grid_ids], pa.int64())
+            table = table.filter(pc.is_in(table["GridId"], value_set=grid_ids))
+        return table["Row"].to_pylist()
+
+    def lookup(self, pairs: Iterable[Union[Dict, Tuple[str, str]]]) -> List: 
+        """
+        Row labels of the (Batch, Name) pairs, or table rows with these keys, in the order 
+        of the selection. Pairs that are not in the catalogue are left out.
+        """
+        pairs = [(pair["Batch"], pair["Name"]) if isinstance(pair, dict) else tuple(pair) for pair in pairs]
+        if not pairs: 
+            return []
+        batches, names = zip(*pairs)
+        wanted = pa.table({"Batch": pa.array(batches, pa.string()), 
+                           "Name": pa.array(names, pa.string()), 
+                           "Position": pa.array(range(len(pairs)), pa.int64())})
+        keys = self.table.select(["Batch", "Name", "Row"])
+        keys = pa.table({"Batch": keys["Batch"].cast(pa.string()), 
+                         "Name": keys["Name"].cast(pa.string()), 
+                         "Row": keys["Row"]})
+        joined = keys.join(wanted, keys=["Batch", "Name"], join_type="inner")
+        return joined.sort_by([("Position", "ascending"), ("Row", "ascending")])["Row"].to_pylist()
+
+
+class SearchIndex: 
+    """
+    Case-insensitive substring search over a list of strings with a trigram index. 
+    Queries shorter than three characters use a prefix search on the sorted strings.
+    """
+    def __init__(self, values: List[str]) -> None: 
+        self.values = list(values)
+        lowered = [value.lower() for value in self.values]
+        self._lowered = lowered
+        self._sorted = sorted(range(len(lowered)), key=lowered.__getitem__)
+        self._sorted_values = [lowered[i] for i in self._sorted]
+        postings: Dict[str, List[int]] = {}
+        for position, value in enumerate(lowered): 
+            for trigram in {value[i:i + 3] for i in range(len(value) - 2)}: 
+                postings.setdefault(trigram, []).append(position)
+        self._postings = {trigram: np.asarray(positions, dtype=np.int64) 
+                          for trigram, positions in postings.items()}
+
+    def search(self, query: str, limit: int = 50) -> List[str]: 
+        """Best matches first: prefix matches, then other substring matches, shorter ones first."""
+        query = query.lower().strip()
+        if not query: 
+            return []
+        if len(query) < 3: 
+            start = bisect.bisect_left(self._sorted_values, query)
+            stop = bisect.bisect_left(self._sorted_values, query + "\uffff")
+            return [self.values[i] for i in self._sorted[start:stop][:limit]]
+        trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+        if not trigrams.issubset(self._postings): 
+            return []
+        postings = sorted((self._postings[trigram] for trigram in trigrams), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]: 
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        # trigrams only narrow down, check the actual substring
+        matches = [i for i in candidates.tolist() if query in self._lowered[i]]
+        matches.sort(key=lambda i: (not self._lowered[i].startswith(query), len(self._lowered[i]), self._lowered[i]))
+        return [self.values[i] for i in matches[:limit]]
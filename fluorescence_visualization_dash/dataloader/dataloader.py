@@ -1,38 +1,150 @@
-from typing import Union, List, Tuple, Optional, Literal
+from typing import Union, List, Tuple, Optional, Literal, Dict
 import os
 import pathlib
 import logging
 import json
+import copy
+import hashlib
+import sys
+import threading
+import warnings
 import pandas as pd
-from tqdm import tqdm
 from datetime import datetime
 import numpy as np
 import numpy.typing as npt
-from fluorescence_visualization_dash.utils.utils import scatter_removal, spectrum, RangeCutTransformer2D
-import math
-from plotly.subplots import make_subplots
+from fluorescence_visualization_dash.utils.utils import spectrum, RangeCutTransformer2D, \
+    PYRAMID_LEVELS, bin_emission, bin_axis, choose_pyramid_level, contour_grid, \
+    SUMMARY_COLUMNS, SUMMARY_DTYPES, summary_statistics, compare_eems, streaming_moments, spectrum_band, \
+    score_scatter, INDEX_COLUMNS, INDEX_DTYPES, index_lookup, eem_indices, lttb, trend_figure, \
+    STORAGE_DTYPES, encode_eem, decode_eem, SCATTER_ENGINES, slice_figure
 import plotly.graph_objects as go
 from itertools import product
+from fluorescence_visualization_dash.preprocessing.preprocessing import PreprocessingPipeline, ArrayCache, DiskArrayCache, digest
+from fluorescence_visualization_dash.dataloader.catalogue import Catalogue
+from fluorescence_visualization_dash.decomposition.decomposition import make_decomposition, PCA2D, Parafac
+
+# Parameters of the former eager correction, used for anything not given explicitly
+SCATTER_DEFAULTS = {"band": "rayleigh", "order": "both", "excision_width": 25, 
+                    "truncate": "below", "fill": "interp"}
+
+# Order of the planes returned by FluorescenceData.batch_aggregate
+AGGREGATES = ("Mean", "Median", "Std", "Count")
+
+# Bounds of the .npy caches in the data folder, least recently used files go first
+SCATTER_DISK_CACHE_BYTES = 2 * 1024**3
+AGGREGATE_DISK_CACHE_BYTES = 256 * 1024**2
+
+
+class GridTable: 
+    """
+    Deduplicated (excitation, emission) wavelength grids, shared by all FluorescenceData 
+    objects of the process. Ids are derived from the wavelengths, so they stay valid across 
+    caches, session uploads and restarts.
+    """
+    def __init__(self) -> None: 
+        self._grids: Dict[int, Tuple[npt.NDArray, npt.NDArray]] = {}
+        self._index_lookups: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def grid_id(excitation: npt.NDArray, emission: npt.NDArray) -> int: 
+        key = hashlib.sha1(np.asarray(excitation, dtype=np.int64).tobytes() + b"|" + 
+                           np.asarray(emission, dtype=np.int64).tobytes()).digest()
+        return int.from_bytes(key[:8], "little") & (2**63 - 1)
+
+    def register(self, excitation: npt.NDArray, emission: npt.NDArray) -> int: 
+        grid_id = self.grid_id(excitation, emission)
+        with self._lock: 
+            self._grids.setdefault(grid_id, (np.asarray(excitation), np.asarray(emission)))
+        return grid_id
+
+    def get(self, grid_id: int) -> dict: 
+        excitation, emission = self._grids[int(grid_id)]
+        return {'Excitation': excitation, 'Emission': emission}
+
+    def index_lookup(self, grid_id: int) -> dict: 
+        """Positions of the EEM indices in this grid (utils.index_lookup), computed once."""
+        grid_id = int(grid_id)
+        if grid_id not in self._index_lookups: 
+            excitation, emission = self._grids[grid_id]
+            self._index_lookups[grid_id] = index_lookup(excitation, emission)
+        return self._index_lookups[grid_id]
+
+    @property
+    def nbytes(self) -> int: 
+        return sum(excitation.nbytes + emission.nbytes for excitation, emission in self._grids.values())
+
+    def export(self, grid_ids) -> Dict[int, Tuple[npt.NDArray, npt.NDArray]]: 
+        return {int(grid_id): self._grids[int(grid_id)] for grid_id in set(grid_ids)}
+
+    def frame(self) -> pd.DataFrame: 
+        """One row per grid, for filtering without looking at the arrays."""
+        return pd.DataFrame([{"GridId": grid_id, 
+                              "NEx": ex.size, "NEm": em.size, 
+                              "ExMin": ex.min(), "ExMax": ex.max(), 
+                              "EmMin": em.min(), "EmMax": em.max()} 
+                             for grid_id, (ex, em) in self._grids.items()])
+
+
+GRIDS = GridTable()
 
 
 class FluorescenceData:
     """
+    Catalogue of EEMs: one row per sample with Batch, Name, Date (datetime64), 
+    GridId (see GRIDS), the (ex, em) array in Data, its Pyramid and summary statistics. 
+    storage="float16"/"uint16" keeps Data compact (see utils.encode_eem for the error 
+    bounds, uint16 adds Scale/Offset columns) and drops the pyramids; select decodes 
+    to float32, so everything downstream is unchanged. scatter_engine picks the 
+    scatter_removal implementation from utils.SCATTER_ENGINES.
     """
     def __init__(self, 
-                 filepath: Union[str, os.PathLike], 
+                 filepath: Optional[Union[str, os.PathLike]], 
                  scatter_correction = False, 
                  cache_filename: str = "rawdata_cache.pickle",
                  rename_filename: str = "rename.json",
                  purge_cache: bool = False,                 
+                 storage: Literal["float32", "float16", "uint16"] = "float32", 
+                 scatter_engine: str = "reference", 
                  ) -> None:
         
-        self.filepath = pathlib.Path(filepath)
+        if storage not in STORAGE_DTYPES: 
+            raise ValueError(f"Unknown storage {storage}, use one of {STORAGE_DTYPES}.")
+        if scatter_engine not in SCATTER_ENGINES: 
+            raise ValueError(f"Unknown scatter engine {scatter_engine}, use one of {list(SCATTER_ENGINES)}.")
+        self.filepath = pathlib.Path(filepath) if filepath is not None else None
+        self.storage = storage
+        self.scatter_engine = scatter_engine
         self.scatter_correction = scatter_correction
+        self.scatter_disk_cache = DiskArrayCache(self.filepath/".scatter_cache" if self.filepath is not None 
+                                                 else pathlib.Path(__file__).parents[1]/"cache/scatter", 
+                                                 max_bytes=SCATTER_DISK_CACHE_BYTES)
+        self.aggregate_disk_cache = DiskArrayCache(self.filepath/".aggregate_cache" if self.filepath is not None 
+                                                   else pathlib.Path(__file__).parents[1]/"cache/aggregate", 
+                                                   max_bytes=AGGREGATE_DISK_CACHE_BYTES)
         self.df = None
+        self._catalogue = None
+        self._pipeline_cache = ArrayCache()
+        self._scatter_cache = ArrayCache()
+        self._comparison_cache = ArrayCache()
+        self._aggregate_cache = ArrayCache(max_bytes=64 * 1024**2)
+        self._model_cache = ArrayCache(max_bytes=128 * 1024**2)
+        self._model_lineage: Dict[str, Tuple[frozenset, str]] = {}
+        self._point_values = None
+        # (mtime_ns, size) of every ingested file, a change re-ingests the file
+        self._file_stats: Dict[str, Tuple[int, int]] = {}
         if self.scatter_correction: 
             self.cache_filename = "corrected_" + cache_filename
         else: 
             self.cache_filename = cache_filename
+        if self.storage != "float32": 
+            # separate cache, switching back to float32 must not read quantized data
+            self.cache_filename = f"{pathlib.Path(self.cache_filename).stem}_{self.storage}.pickle"
+        if self.filepath is None: 
+            # Without a data folder the object only holds uploaded overlays.
+            self._preprocessed_files = self.__empty_catalogue()
+            self._rename_dict = {}
+            return
         self.__purge_cache(purge_cache)
         self._preprocessed_files = self.__load_processed_file_names(self.cache_filename)
         self._rename_dict = self.__load_json_config(rename_filename)
@@ -40,10 +152,15 @@ class FluorescenceData:
 
 
     def __purge_cache(self, purge_cache: bool) -> None:
-        """Delete the cache file if purge_cache is True."""
+        """Delete the cache file (and the scatter correction/aggregate caches) if purge_cache is True."""
         if purge_cache and (self.filepath/self.cache_filename).exists():
             logging.warning("Deleting the cache")
             os.remove(self.filepath/self.cache_filename)
+        if purge_cache and self.catalogue_path.exists(): 
+            os.remove(self.catalogue_path)
+        if purge_cache: 
+            self.scatter_disk_cache.clear()
+            self.aggregate_disk_cache.clear()
 
 
     def __load_json_config(self, filename: str) -> dict:
@@ -62,16 +179,61 @@ class FluorescenceData:
         """
         if (self.filepath/filename).exists():
             try: 
-                self.df = pd.read_pickle(self.filepath/filename)
+                cache = pd.read_pickle(self.filepath/filename)
+                if isinstance(cache, pd.DataFrame): 
+                    # Caches written before the metadata became columns
+                    self.df = self.__normalize_metadata(cache)
+                    self.__save_processed_data()
+                else: 
+                    self.df = cache["catalogue"]
+                    for excitation, emission in cache["grids"].values(): 
+                        GRIDS.register(excitation, emission)
+                    self._file_stats = cache.get("files", {})
+                if "Pyramid" not in self.df: 
+                    # Caches written before the pyramid existed
+                    self.df["Pyramid"] = pd.Series([self.build_pyramid(data, GRIDS.get(grid_id)['Emission']) 
+                                                    for data, grid_id in zip(self.df.Data, self.df.GridId)], 
+                                                   index=self.df.index, dtype="object")
+                    self.__save_processed_data()
+                if not set(SUMMARY_COLUMNS + INDEX_COLUMNS).issubset(self.df.columns): 
+                    stats = self.with_summary(self.decoded(self.df))[SUMMARY_COLUMNS + INDEX_COLUMNS]
+                    self.df = self.df.drop(columns=SUMMARY_COLUMNS + INDEX_COLUMNS, errors="ignore").join(stats)
+                    self.__save_processed_data()
+                if self.catalogue_path.exists(): 
+                    catalogue = Catalogue.read(self.catalogue_path)
+                    if catalogue.table["Row"].to_pylist() == self.df.index.tolist(): 
+                        self._catalogue = (self.df, catalogue)
                 return self.df.Batch.tolist()
             except Exception as e: 
                 raise e
+        return self.__empty_catalogue()
+
+
+    @staticmethod
+    def __normalize_metadata(df: pd.DataFrame) -> pd.DataFrame: 
+        """Replaces the per-row Metadata dicts by Date and GridId columns."""
+        grid_ids = [GRIDS.register(metadata['Excitation'], metadata['Emission']) for metadata in df.Metadata]
+        dates = pd.to_datetime([metadata['Date'] for metadata in df.Metadata])
+        columns = df.columns.tolist()
+        position = columns.index("Metadata")
+        df = df.assign(Date=np.asarray(dates, dtype="datetime64[ns]"), 
+                       GridId=np.asarray(grid_ids, dtype=np.int64)).drop(columns="Metadata")
+        return df[columns[:position] + ["Date", "GridId"] + columns[position + 1:]]
+
+
+    def __empty_catalogue(self) -> List: 
+        """
+        Starts an empty catalogue
+        """
         self.df = pd.DataFrame({
                                     "Batch": pd.Series(dtype="str"), 
                                     "Name": pd.Series(dtype="str"), 
-                                    "Metadata": pd.Series(dtype="object"),
-                                    "Data": pd.Series(dtype="object")
-                                   
+                                    "Date": pd.Series(dtype="datetime64[ns]"), 
+                                    "GridId": pd.Series(dtype="int64"), 
+                                    "Data": pd.Series(dtype="object"), 
+                                    "Pyramid": pd.Series(dtype="object"), 
+                                    **{column: pd.Series(dtype=dtype) for column, dtype in SUMMARY_DTYPES.items()}, 
+                                    **{column: pd.Series(dtype=dtype) for column, dtype in INDEX_DTYPES.items()}, 
                                 })
         return list()
     
@@ -80,48 +242,175 @@ class FluorescenceData:
         """
         Saves the files to existing/non-existing cache
         """
-        pd.to_pickle(self.df ,
+        pd.to_pickle({"catalogue": self.df, 
+                      "grids": GRIDS.export(self.df.GridId), 
+                      "files": self._file_stats}, 
                      self.filepath/self.cache_filename)
+        self.catalogue.write(self.catalogue_path)
+
+
+    @property
+    def catalogue_path(self) -> pathlib.Path: 
+        return self.filepath/(pathlib.Path(self.cache_filename).stem + ".arrow")
+
+
+    @property
+    def catalogue(self) -> Catalogue: 
+        """Arrow catalogue of df, rebuilt only when df was replaced."""
+        if self._catalogue is None or self._catalogue[0] is not self.df: 
+            self._catalogue = (self.df, Catalogue.from_frame(self.df))
+        return self._catalogue[1]
         
 
     def __load_data(self) -> None: 
         filenames = list(self.filepath.glob("*.csv"))
         logging.info(f"{len(filenames)} files are found.")
-        newfiles = set(filenames) - set(map(lambda x: self.filepath/x, self._preprocessed_files))
-        logging.info(f"{len(newfiles)} new files are found.")
-        new_data = []
+        stats = {file.name: (file.stat().st_mtime_ns, file.stat().st_size) for file in filenames}
+        ingested = set(self._preprocessed_files)
+        # caches written before the file stats were kept are taken as up to date
+        untracked = {name: stats[name] for name in ingested & stats.keys() if name not in self._file_stats}
+        self._file_stats.update(untracked)
+        modified = {name for name in ingested & stats.keys() if self._file_stats[name] != stats[name]}
+        newfiles = [file for file in filenames if file.name not in ingested or file.name in modified]
+        logging.info(f"{len(newfiles) - len(modified)} new and {len(modified)} modified files are found.")
         if newfiles: 
-            for file in tqdm(sorted(newfiles, key=os.path.getmtime), desc="Processing files"):
-                dataframe_temp = pd.read_csv(file)    # TO DO: Consider using polars for efficiency 
-                unique_samples = set([col.split("_EX_")[0] for col in dataframe_temp.columns if "_EX_" in col])  # sadly this doesnt presever the order
-                temp_dict = self._rename_dict[file.name] if file.name in self._rename_dict else {}
-                date = datetime.fromtimestamp(os.path.getmtime(file))
-                for sample in unique_samples: 
-                    metadata = {}
-                    metadata['Date'] = date
-                    (indiv_data, excitation_wl, emission_wl) = self.indiv_dataframe(dataframe_temp, file.name, sample)
-                    metadata['Excitation'] = excitation_wl
-                    metadata['Emission'] = emission_wl
-                    if sample in temp_dict: 
-                        new_data.append([file.name, temp_dict[sample], metadata, indiv_data])
-                    else: 
-                        new_data.append([file.name, sample, metadata, indiv_data])
-
-            self.df = pd.concat((self.df, 
-                                    (pd.DataFrame(new_data, 
-                                                columns=['Batch', 'Name', 'Metadata', 'Data'])
-                                    .astype({
-                                            "Batch": "str",
-                                            "Name": "str",
-                                            "Metadata": "object", 
-                                            "Data": "object", 
-                                            
-                                        }))),
-                                ignore_index=True
-                                )
-           
+            from tqdm import tqdm
+            new_data = [self.read_batch(pd.read_csv(file), 
+                                        file.name, 
+                                        datetime.fromtimestamp(os.path.getmtime(file)))
+                        for file in tqdm(sorted(newfiles, key=os.path.getmtime), desc="Processing files")]
+            self.df = pd.concat((self.df.drop(index=self.catalogue.rows(modified)), *new_data), ignore_index=True)
+            self._file_stats.update({file.name: stats[file.name] for file in newfiles})
+        if newfiles or untracked: 
             self.__save_processed_data()  
 
+
+    def read_batch(self, 
+                   dataframe: pd.DataFrame, 
+                   batch: str, 
+                   date: datetime) -> pd.DataFrame: 
+        """
+        Parses one exported csv (one batch) into catalogue rows.
+        Used for the data folder as well as for uploaded files.
+        """
+        new_data = []
+        unique_samples = set([col.split("_EX_")[0] for col in dataframe.columns if "_EX_" in col])  # sadly this doesnt presever the order
+        temp_dict = self._rename_dict[batch] if batch in self._rename_dict else {}
+        for sample in unique_samples: 
+            (indiv_data, excitation_wl, emission_wl) = self.indiv_dataframe(dataframe, batch, sample)
+            grid_id = GRIDS.register(excitation_wl, emission_wl)
+            pyramid = self.build_pyramid(indiv_data, emission_wl)
+            if sample in temp_dict: 
+                new_data.append([batch, temp_dict[sample], date, grid_id, indiv_data, pyramid])
+            else: 
+                new_data.append([batch, sample, date, grid_id, indiv_data, pyramid])
+
+        return self.__with_storage(self.with_summary(pd.DataFrame(new_data, 
+                                                                  columns=['Batch', 'Name', 'Date', 'GridId', 'Data', 'Pyramid'])
+                                                     .astype({
+                                                            "Batch": "str",
+                                                            "Name": "str",
+                                                            "Date": "datetime64[ns]", 
+                                                            "GridId": "int64", 
+                                                            "Data": "object", 
+                                                            "Pyramid": "object", 
+                                                        })))
+
+
+    def __with_storage(self, df: pd.DataFrame) -> pd.DataFrame: 
+        """Encodes freshly read float32 rows for self.storage."""
+        if self.storage == "float32" or df.empty: 
+            return df
+        encoded = [encode_eem(data, self.storage) for data in df.Data]
+        df = df.assign(Data=pd.Series([array for array, _, _ in encoded], index=df.index, dtype="object"), 
+                       Pyramid=pd.Series(None, index=df.index, dtype="object"))
+        if self.storage == "uint16": 
+            df = df.assign(Scale=np.array([scale for _, scale, _ in encoded], dtype=np.float64), 
+                           Offset=np.array([offset for _, _, offset in encoded], dtype=np.float64))
+        return df
+
+
+    @staticmethod
+    def _scale_offset(df: pd.DataFrame) -> Tuple[npt.NDArray, npt.NDArray]: 
+        """Quantization parameters of the rows (NaN for rows not stored as uint16)."""
+        if "Scale" not in df: 
+            return np.full(len(df), np.nan), np.full(len(df), np.nan)
+        return df.Scale.to_numpy(), df.Offset.to_numpy()
+
+
+    def decoded(self, df: pd.DataFrame) -> pd.DataFrame: 
+        """The rows with Data as float32 whatever the storage, float32 rows are not copied."""
+        if all(data.dtype == np.float32 for data in df.Data): 
+            return df
+        decoded = [decode_eem(data, scale, offset) for data, scale, offset in zip(df.Data, *self._scale_offset(df))]
+        df = df.assign(Data=pd.Series(decoded, index=df.index, dtype="object"))
+        if "Pyramid" in df and df.Pyramid.isna().any(): 
+            # _stack bins on the fly without pyramids
+            df = df.drop(columns="Pyramid")
+        return df
+
+
+    @staticmethod
+    def with_summary(df: pd.DataFrame) -> pd.DataFrame: 
+        """
+        Adds the summary statistics (SUMMARY_COLUMNS) and EEM indices (INDEX_COLUMNS) of 
+        every row. Samples sharing a grid are stacked and summarized together.
+        """
+        if df.empty: 
+            return df.assign(**{column: pd.Series(dtype=dtype) 
+                                for column, dtype in {**SUMMARY_DTYPES, **INDEX_DTYPES}.items()})
+        parts = []
+        for grid_id, group in df.groupby("GridId", sort=False): 
+            stacked = np.stack(group.Data.to_numpy(), axis=0)
+            stats = summary_statistics(stacked, 
+                                       **{key.lower(): value for key, value in GRIDS.get(grid_id).items()})
+            stats.update(eem_indices(stacked, GRIDS.index_lookup(grid_id)))
+            parts.append(pd.DataFrame(stats, index=group.index))
+        return df.drop(columns=SUMMARY_COLUMNS + INDEX_COLUMNS, errors="ignore").join(pd.concat(parts))
+
+
+    def summary(self, query: Optional[str] = None, sort_by: Optional[str] = None, ascending: bool = False) -> pd.DataFrame: 
+        """
+        Batch, Name, summary statistics and EEM indices without touching the arrays, 
+        e.g. summary("Max > 900", sort_by="Max") or summary("FI > 1.8", sort_by="HIX").
+        """
+        df = self.df[['Batch', 'Name', *SUMMARY_COLUMNS, *INDEX_COLUMNS]]
+        if query is not None: 
+            df = df.query(query)
+        if sort_by is not None: 
+            df = df.sort_values(sort_by, ascending=ascending)
+        return df
+
+
+    @staticmethod
+    def build_pyramid(data: npt.NDArray, emission: npt.NDArray) -> dict: 
+        """
+        Emission-binned copies of one sample for zoomed-out previews. 
+        Level 1 is the data itself and is not stored again.
+        """
+        return {level: bin_emission(data, emission, level)[0] for level in PYRAMID_LEVELS[1:]}
+
+
+    def with_overlay(self, overlay: Optional[pd.DataFrame]) -> "FluorescenceData": 
+        """
+        Returns a shallow copy whose catalogue is the shared archive followed by 
+        the session's own rows. The arrays themselves are not copied.
+        """
+        if overlay is None or overlay.empty: 
+            return self
+        view = copy.copy(self)
+        view.df = pd.concat((self.df, overlay), ignore_index=True)
+        return view
+
+
+    def view_nbytes(self) -> int: 
+        """
+        Bytes a with_overlay view holds on its own: the combined catalogue frame and its 
+        Arrow catalogue. The arrays and the caches are shared with the archive.
+        """
+        return int(self.df.memory_usage(deep=False).sum()) + self.catalogue.table.nbytes
+
+
     def indiv_dataframe(self, 
                         dataframe: pd.DataFrame, 
                         file: str, 
@@ -140,44 +429,272 @@ class FluorescenceData:
                         axis="index")
               )
         if self.scatter_correction: 
-            df = scatter_removal(df, excision_width=25, truncate="below")
+            df = SCATTER_ENGINES[self.scatter_engine](df, **SCATTER_DEFAULTS)
 
         return (df.to_numpy(dtype=np.float32).T, 
                 df.columns.to_numpy(),   # ex
                 df.index.to_numpy())   # em
     
 
-    def get_spectrum(self, 
-                     batch: Optional[str] = None, 
-                     name: Optional[str] = None, 
-                     index_loc: Optional[List[int]] = None, 
-                     select_range: Optional[Tuple] = ([200, 800], [200, 800])
-                ) -> go.Figure:
-        
+    def select(self, 
+               batch: Optional[str] = None, 
+               name: Optional[str] = None, 
+               index_loc: Optional[List[int]] = None) -> pd.DataFrame: 
+        """
+        Rows of the catalogue by index or by Batch/Name. Everything if nothing is given.
+        """
         if index_loc is not None: 
-            df = self.df.loc[index_loc]
+            return self.decoded(self.df.loc[index_loc])
 
         elif (batch is not None) and (name is not None): 
-            df = self.df.loc[lambda x: (x.Batch == batch) & (x.Name == name)]
+            return self.decoded(self.df.loc[self.catalogue.lookup([(batch, name)])])
         
-        else: 
-            df = self.df
+        return self.decoded(self.df)
+
+
+    def axes(self, df: pd.DataFrame) -> dict: 
+        """
+        Excitation/Emission wavelengths of the selected samples, which have to share one grid.
+        """
+        grid_ids = df.GridId.unique()
+        if len(grid_ids) != 1: 
+            raise ValueError("The selected samples are not measured on the same wavelengths.")
+        return GRIDS.get(grid_ids[0])
+
+
+    def where(self, 
+              date_from: Optional[Union[str, datetime]] = None, 
+              date_to: Optional[Union[str, datetime]] = None, 
+              grid_id: Optional[int] = None) -> pd.Index: 
+        """Index of the samples measured within [date_from, date_to] and/or on one grid."""
+        mask = np.ones(len(self.df), dtype=bool)
+        if date_from is not None: 
+            mask &= (self.df.Date >= pd.Timestamp(date_from)).to_numpy()
+        if date_to is not None: 
+            mask &= (self.df.Date <= pd.Timestamp(date_to)).to_numpy()
+        if grid_id is not None: 
+            mask &= (self.df.GridId == grid_id).to_numpy()
+        return self.df.index[mask]
+
+
+    def scatter_corrected(self, 
+                          df: pd.DataFrame, 
+                          params: Optional[dict] = None) -> pd.DataFrame: 
+        """
+        Returns the rows with scatter removed from Data (see utils.scatter_removal for params). 
+        Only the requested samples are corrected, results are memoized in memory and on disk 
+        per (sample, band, order, excision_width, truncate, fill).
+        """
+        if params is None: 
+            return df
+        params = {**SCATTER_DEFAULTS, **params}
+        # the engines agree (utils.crosscheck), the key only changes so a new engine starts clean
+        key_params = params if self.scatter_engine == "reference" else {**params, "engine": self.scatter_engine}
+        axes = self.axes(df)
+        results = []
+        for data in df.Data: 
+            key = hashlib.sha1((digest(data) + json.dumps(key_params, sort_keys=True)).encode()).hexdigest()
+            result = self._scatter_cache.get(key)
+            if result is None: 
+                result = self.scatter_disk_cache.get(key)
+            if result is None: 
+                result = (SCATTER_ENGINES[self.scatter_engine](
+                              pd.DataFrame(data.T, index=axes['Emission'], columns=axes['Excitation']), **params)
+                          .to_numpy(dtype=np.float32).T)
+                self.scatter_disk_cache.put(key, result)
+            self._scatter_cache.put(key, result)
+            results.append(result)
+        return df.drop(columns="Pyramid", errors="ignore").assign(Data=pd.Series(results, index=df.index, dtype="object"))
+
+
+    def __batch_signature(self, rows: pd.DataFrame) -> str: 
+        """
+        Content hash of the ingested rows: the files in the data folder are read only once, 
+        so their mtime would say nothing about what is aggregated.
+        """
+        scale, offset = self._scale_offset(rows)
+        return hashlib.sha1("".join(digest(data) for data in rows.Data).encode() 
+                            + scale.tobytes() + offset.tobytes()).hexdigest()
+
+
+    @classmethod
+    def __reduce_batch(cls, 
+                       rows: pd.DataFrame, 
+                       chunk_size: int) -> npt.NDArray: 
+        """
+        Reduces the batch straight from rows.Data: the moments stream over chunks of 
+        chunk_size decoded samples, the median over blocks of excitation rows of all 
+        samples, so at most about chunk_size samples are decoded at once.
+        """
+        n_samples, shape = len(rows), rows.Data.iloc[0].shape
+        samples = list(zip(rows.Data, *cls._scale_offset(rows)))
+        mean, std, count = streaming_moments(np.stack([decode_eem(data, scale, offset) 
+                                                       for data, scale, offset in samples[i:i + chunk_size]]) 
+                                             for i in range(0, n_samples, chunk_size))
+        # The median does not stream, it is taken over blocks of excitation rows instead.
+        median = np.empty(shape, dtype=np.float32)
+        block = max(1, chunk_size * shape[0] // n_samples)
+        with warnings.catch_warnings(): 
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for j in range(0, shape[0], block): 
+                median[j:j + block] = np.nanmedian(np.stack([decode_eem(data[j:j + block], scale, offset) 
+                                                             for data, scale, offset in samples]), axis=0)
+        return np.stack([mean, median, std, count], axis=0)
+
 
+    def batch_aggregate(self, 
+                        batch: str, 
+                        grid_id: Optional[int] = None, 
+                        chunk_size: int = 64) -> Tuple[npt.NDArray, dict]: 
+        """
+        Mean, median, std and count (of non-NaN values) EEMs over the samples of one batch, 
+        as a (4, ex, em) stack in AGGREGATES order, and the wavelengths. Only samples on 
+        grid_id (default: the batch's most common grid) are used. Results are cached in 
+        memory and on disk until the batch's rows change.
+        """
+        rows = self.catalogue.rows(batch)
+        if not rows: 
+            raise ValueError(f"Batch {batch} is not loaded.")
+        if grid_id is None: 
+            grid_id = self.df.GridId.loc[rows].mode().iloc[0]
+        rows = self.df.loc[self.catalogue.rows(batch, grid_ids=[grid_id])]
+        key = hashlib.sha1(f"{batch}|{grid_id}|{self.storage}|{self.__batch_signature(rows)}".encode()).hexdigest()
+        result = self._aggregate_cache.get(key)
+        if result is None: 
+            result = self.aggregate_disk_cache.get(key)
+        if result is None: 
+            result = self.__reduce_batch(rows, chunk_size)
+            self.aggregate_disk_cache.put(key, result)
+        self._aggregate_cache.put(key, result)
+        return result, GRIDS.get(grid_id)
+
+
+    def _cut_aggregate(self, 
+                       batch: str, 
+                       select_range: Tuple) -> Tuple[npt.NDArray, dict]: 
+        stacked, ex_em_dict = self.batch_aggregate(batch)
+        rg_transform = RangeCutTransformer2D(select_range, ex_em_dict)
+        return rg_transform.fit_transform(stacked), rg_transform.final_state
+
+
+    def get_batch_aggregate_plotly(self, 
+                                   batches: List[str], 
+                                   select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                                   statistics: Tuple[str, ...] = ("Mean", "Median", "Std"), 
+                                   colorbar: Literal["individual", "shared", "hide"] = "individual" 
+                                   ) -> go.Figure: 
+        """
+        Contour plot of the chosen AGGREGATES of every batch, one row per batch.
+        """
+        planes, titles = [], []
+        for batch in batches: 
+            stacked, ex_em_dict = self._cut_aggregate(batch, select_range)
+            n_samples = int(np.nanmax(stacked[AGGREGATES.index("Count")], initial=0))
+            for statistic in statistics: 
+                planes.append(stacked[AGGREGATES.index(statistic)])
+                titles.append(f"{statistic} {batch} (n={n_samples})")
+        fig = contour_grid(np.stack(planes, axis=0), 
+                           ex_em_dict['Excitation'], 
+                           ex_em_dict['Emission'], 
+                           titles=titles, 
+                           colorbar=colorbar, 
+                           cols=len(statistics))
+        fig.update_layout(uirevision=True, 
+                          meta={"resolution": 1})
+        return fig
+
+
+    def get_batch_band_plotly(self, 
+                              batches: List[str], 
+                              select_range: Optional[Tuple] = ([200, 800], [200, 800])) -> go.Figure: 
+        """
+        Mean ± std emission spectrum of every batch, one band per excitation wavelength.
+        """
+        means, stds, labels, emission = [], [], [], None
+        for batch in batches: 
+            stacked, ex_em_dict = self._cut_aggregate(batch, select_range)
+            if emission is not None and not np.array_equal(emission, ex_em_dict['Emission']): 
+                raise ValueError("The selected batches are not measured on the same wavelengths.")
+            emission = ex_em_dict['Emission']
+            means.append(stacked[AGGREGATES.index("Mean")])
+            stds.append(stacked[AGGREGATES.index("Std")])
+            labels += [f"{batch} EX {excitation}" for excitation in ex_em_dict['Excitation']]
+        fig = spectrum_band(np.vstack(means), 
+                            np.nan_to_num(np.vstack(stds)), 
+                            labels=labels, 
+                            wavenumbers=ex_em_dict['Emission'])
+        fig.update_xaxes(nticks=10, title='Emission')
+        fig.update_layout(legend_title_text="Batches", 
+                          title='')
+        fig.update_yaxes(title='Intensity')
+        return fig
+
+
+    def preprocess(self, 
+                   df: pd.DataFrame, 
+                   pipeline: Optional[PreprocessingPipeline]) -> pd.DataFrame: 
+        """
+        Returns the rows with Data run through the pipeline. Results are cached per 
+        (pipeline config, sample), only samples not seen with this config are computed, 
+        all of them in one batch. Samples are keyed by content since uploads of 
+        different sessions may share Batch/Name.
+        """
+        if pipeline is None or not pipeline.steps: 
+            return df
+        config = pipeline.config_hash()
+        keys = [(config, digest(data)) for data in df.Data]
+        results = [self._pipeline_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing: 
+            processed = pipeline.fit_transform(np.stack(df.Data.iloc[missing].to_numpy(), axis=0))
+            for i, result in zip(missing, processed): 
+                results[i] = result
+                self._pipeline_cache.put(keys[i], result)
+        # The pyramid belongs to the unprocessed data, _stack bins on the fly instead.
+        return df.drop(columns="Pyramid", errors="ignore").assign(Data=pd.Series(results, index=df.index, dtype="object"))
+
+
+    def _stack(self, 
+               df: pd.DataFrame, 
+               select_range: Tuple, 
+               level: int = 1) -> Tuple[npt.NDArray, dict]: 
+        """
+        Stacks the selected samples as (n, ex, em) and cuts them to select_range. 
+        level > 1 uses the emission-binned pyramid instead of the full data.
+        """
+        ex_em_dict = self.axes(df)
         try: 
-            data_stacked = np.stack(df.Data.to_numpy(), axis=0) 
-            ex_em_dict = df.iloc[0]['Metadata'].copy()
-            del ex_em_dict['Date']
+            if level == 1: 
+                data_stacked = np.stack(df.Data.to_numpy(), axis=0) 
+            elif "Pyramid" not in df: 
+                data_stacked, ex_em_dict['Emission'] = bin_emission(np.stack(df.Data.to_numpy(), axis=0), 
+                                                                    ex_em_dict['Emission'], level)
+            else: 
+                data_stacked = np.stack([pyramid[level] for pyramid in df.Pyramid], axis=0)
+                ex_em_dict['Emission'] = bin_axis(ex_em_dict['Emission'], level)
             
             rg_transform = RangeCutTransformer2D(select_range, 
-                                                 ex_em_dict,
-                                                 True)
+                                                 ex_em_dict)
             data_stacked = rg_transform.fit_transform(data_stacked)
             ex_em_dict['Emission'] = rg_transform.final_state['Emission']
             ex_em_dict['Excitation'] = rg_transform.final_state['Excitation']
 
         except ValueError: 
             raise ValueError("Make sure the data is complete.")
+        return data_stacked, ex_em_dict
+
+
+    def get_spectrum(self, 
+                     batch: Optional[str] = None, 
+                     name: Optional[str] = None, 
+                     index_loc: Optional[List[int]] = None, 
+                     select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                     pipeline: Optional[PreprocessingPipeline] = None, 
+                     scatter: Optional[dict] = None
+                ) -> go.Figure:
         
+        df = self.preprocess(self.scatter_corrected(self.select(batch, name, index_loc), scatter), pipeline)
+        data_stacked, ex_em_dict = self._stack(df, select_range)
 
         fig = spectrum(
             np.vstack(data_stacked), 
@@ -192,7 +709,70 @@ class FluorescenceData:
         )
         fig.update_yaxes(title='Intensity')
         return fig
-    
+
+
+    def slice(self, 
+              index_loc: List[int], 
+              excitation: Optional[List[float]] = None, 
+              emission: Optional[List[float]] = None, 
+              select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+              pipeline: Optional[PreprocessingPipeline] = None, 
+              scatter: Optional[dict] = None, 
+              tolerance: float = 5) -> pd.DataFrame: 
+        """
+        Emission spectra at the excitation wavelengths, or excitation spectra at the emission 
+        wavelengths (give one of both), of the samples in index_loc. One row per sample and 
+        wavelength: Batch, Name, Wavelength (the nearest one on the sample's grid), Axis (the 
+        other wavelengths, cut to select_range like RangeCutTransformer2D) and Intensity. 
+        Without pipeline/scatter Intensity is a strided view of the stored array, compact 
+        storage only decodes the slice. Samples do not need to share a grid, unless a pipeline 
+        is given. ValueError if a grid has no wavelength within tolerance of a requested one.
+        """
+        if (excitation is None) == (emission is None): 
+            raise ValueError("Give either excitation or emission wavelengths.")
+        by_excitation = excitation is not None
+        wavelengths = excitation if by_excitation else emission
+        df = self.df.loc[index_loc]
+        if pipeline is not None or scatter is not None: 
+            # scatter_corrected needs one grid per call
+            df = pd.concat([self.preprocess(self.scatter_corrected(self.decoded(group), scatter), pipeline) 
+                            for _, group in df.groupby("GridId", sort=False)]).loc[index_loc]
+        rows = []
+        for (_, row), scale, offset in zip(df.iterrows(), *self._scale_offset(df)): 
+            axes = GRIDS.get(row.GridId)
+            fixed, other = ((axes['Excitation'], axes['Emission']) if by_excitation 
+                            else (axes['Emission'], axes['Excitation']))
+            start, stop = np.argmin(np.abs(other.reshape(-1, 1) - select_range[0 if by_excitation else 1]), axis=0) + [0, 1]
+            positions = [int(np.argmin(np.abs(fixed - wavelength))) for wavelength in wavelengths]
+            for wavelength, position in zip(wavelengths, positions): 
+                if abs(fixed[position] - wavelength) > tolerance: 
+                    raise ValueError(f"{'Excitation' if by_excitation else 'Emission'} {wavelength:g} nm is not "
+                                     f"measured for {row.Name} ({row.Batch}), the grid covers "
+                                     f"{fixed.min():g} to {fixed.max():g} nm.")
+            for position in dict.fromkeys(positions): 
+                data = row.Data[position, start:stop] if by_excitation else row.Data[start:stop, position]
+                rows.append([row.Batch, row.Name, fixed[position], other[start:stop], 
+                             decode_eem(data, scale, offset)])
+        return pd.DataFrame(rows, columns=["Batch", "Name", "Wavelength", "Axis", "Intensity"])
+
+
+    def get_slice_plotly(self, 
+                         index_loc: List[int], 
+                         excitation: Optional[List[float]] = None, 
+                         emission: Optional[List[float]] = None, 
+                         select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                         pipeline: Optional[PreprocessingPipeline] = None, 
+                         scatter: Optional[dict] = None) -> go.Figure: 
+        """get_spectrum restricted to a few wavelengths, one line per sample and wavelength (see slice)."""
+        slices = self.slice(index_loc, excitation, emission, select_range, pipeline, scatter)
+        fixed, other = ("Excitation", "Emission") if excitation is not None else ("Emission", "Excitation")
+        labels = (slices.Name + " " + slices.Batch + f" ({fixed[:2]} " + slices.Wavelength.astype(str) + ")").tolist()
+        fig = slice_figure(slices.Axis.tolist(), slices.Intensity.tolist(), labels)
+        fig.update_xaxes(nticks=10, title=other)
+        fig.update_layout(legend_title_text="Samples", title='')
+        fig.update_yaxes(title='Intensity')
+        return fig
+
 
 
     def get_2d_spectra_plotly_multiple(self, 
@@ -200,76 +780,282 @@ class FluorescenceData:
                     name: Optional[str] = None, 
                     index_loc: Optional[List[int]] = None, 
                     select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
-                    colorbar: Literal["individual", "hide"] = "individual"
+                    colorbar: Literal["individual", "shared", "hide"] = "individual", 
+                    resolution: Union[Literal["auto"], int] = "auto", 
+                    width_px: int = 1200, 
+                    pipeline: Optional[PreprocessingPipeline] = None, 
+                    scatter: Optional[dict] = None
                     ) -> go.Figure:
-        
-        if index_loc is not None:
-            df = self.df.loc[index_loc]
+        """
+        Contour plot per sample, three per row. With resolution="auto" the emission 
+        resolution is taken from the pyramid so that a subplot (width_px/3 wide) gets 
+        about one point per pixel, resolution=1 always uses the full data. 
+        colorbar="shared" puts all samples on one color scale. 
+        scatter (scatter_removal parameters) and pipeline preprocess the samples first.
+        """
+        df = self.preprocess(self.scatter_corrected(self.select(batch, name, index_loc), scatter), pipeline)
+        n_samples = df.shape[0]
+        if resolution == "auto": 
+            data_full, _ = self._stack(df.iloc[:1], select_range)
+            resolution = choose_pyramid_level(*data_full.shape[1:], 
+                                              n_samples=n_samples, 
+                                              subplot_px=width_px / 3 * 0.83)
+        data_stacked, ex_em_dict = self._stack(df, select_range, level=resolution)
 
-        elif (batch is not None) and (name is not None): 
-            df = self.df.loc[lambda x: (x.Batch == batch) & (x.Name == name)]
-        
+        fig = contour_grid(data_stacked, 
+                           ex_em_dict['Excitation'], 
+                           ex_em_dict['Emission'], 
+                           titles=df.Name.tolist(), 
+                           colorbar=colorbar)
+        fig.update_layout(uirevision=True, 
+                          meta={"resolution": resolution})
+        return fig
+    
+
+    def reference(self, 
+                  selection: pd.DataFrame, 
+                  batch: str, 
+                  name: Optional[str] = None) -> pd.DataFrame: 
+        """
+        Rows to compare the selection with: one sample, or (name=None) every sample 
+        of the batch measured on the selection's grid.
+        """
+        if name is not None: 
+            df = self.select(batch, name)
         else: 
-            df = self.df
+            df = self.df.loc[self.catalogue.rows(batch, grid_ids=selection.GridId.unique())]
+        if df.empty: 
+            raise ValueError(f"No reference sample found for {name or 'the mean'} of {batch}.")
+        return self.decoded(df)
 
-        try:
-            data_stacked = np.stack(df.Data.to_numpy(), axis=0)
-            ex_em_dict = self.df.iloc[0]['Metadata'].copy()
-            del ex_em_dict['Date']
-            
-            rg_transform = RangeCutTransformer2D(select_range, 
-                                                ex_em_dict,
-                                                True)
-            data_stacked = rg_transform.fit_transform(data_stacked)
-            ex_em_dict['Emission'] = rg_transform.final_state['Emission']
-            ex_em_dict['Excitation'] = rg_transform.final_state['Excitation']
 
-        except ValueError:
-            raise ValueError("Make sure the data is complete.")
+    def compare(self, 
+                index_loc: List[int], 
+                reference: Tuple[str, Optional[str]], 
+                mode: Literal["difference", "ratio", "zscore"] = "difference", 
+                select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                pipeline: Optional[PreprocessingPipeline] = None, 
+                scatter: Optional[dict] = None) -> Tuple[npt.NDArray, dict]: 
+        """
+        Difference, ratio or z-score EEMs (see utils.compare_eems) of the selected samples 
+        against reference=(batch, name), or against the batch mean with reference=(batch, None). 
+        The whole selection is compared in one broadcast on the range-cut stack, results 
+        are cached per (reference, selection, window, preprocessing).
+        """
+        selection = self.select(index_loc=index_loc)
+        reference_df = self.reference(selection, *reference)
+        self.axes(pd.concat((selection[["GridId"]], reference_df[["GridId"]])))
+        key = hashlib.sha1(json.dumps([mode, 
+                                       [digest(data) for data in selection.Data], 
+                                       [digest(data) for data in reference_df.Data], 
+                                       select_range, 
+                                       pipeline.config_hash() if pipeline is not None else None, 
+                                       scatter], 
+                                      sort_keys=True, default=str).encode()).hexdigest()
+        # the cut axes only depend on the grid, no need to preprocess for them
+        _, ex_em_dict = self._stack(selection.iloc[:1], select_range)
+        result = self._comparison_cache.get(key)
+        if result is None: 
+            data, _ = self._stack(self.preprocess(self.scatter_corrected(selection, scatter), pipeline), select_range)
+            reference_data, _ = self._stack(self.preprocess(self.scatter_corrected(reference_df, scatter), pipeline), 
+                                            select_range)
+            result = compare_eems(data, reference_data, mode)
+            self._comparison_cache.put(key, result)
+        return result, ex_em_dict
 
-        n_samples = df.shape[0]
-        rows = math.ceil(n_samples/3)
-        fig = make_subplots(rows=rows, cols=3, subplot_titles=df.Name.tolist(), 
-                            horizontal_spacing=0.17)
-        coloraxis = dict()
-        colorscale= "Cividis"
-        for i in range(n_samples):
-            z_data = data_stacked[i]
-            row, col = (i // 3) + 1, (i % 3) + 1 
-            contour = go.Contour(
-                z=z_data,
-                x=ex_em_dict['Emission'],
-                y=ex_em_dict['Excitation'],
-                colorscale=colorscale, 
-                colorbar=dict(title='Intensity'),
-                showscale=False if colorbar=="hide" else True,
-                coloraxis= None if colorbar=="hide" else f'coloraxis{i + 1}' 
-            )
-
-            fig.add_trace(contour, row=row, col=col)
-        fig.update_xaxes(nticks=10, title_text='Emission')
-        fig.update_yaxes(title_text='Excitation')
-        fig.update_layout(
-            title_text="",
-            showlegend=False
-        )
-        if colorbar != "hide": 
-            for i in range(n_samples): 
-                if i == 0: 
-                    coloraxis['coloraxis1'] = dict(colorscale=colorscale, 
-                                            colorbar_x=fig._layout['xaxis']['domain'][1]+0.01, 
-                                            colorbar_y=np.mean(fig._layout['yaxis']['domain'])+0.01, 
-                                            colorbar_len=1/rows - 0.07)
-                else: 
-                    coloraxis[f"coloraxis{i+1}"] = dict(colorscale=colorscale,
-                                                    colorbar_x=fig._layout[f"xaxis{i+1}"]['domain'][1]+0.01, 
-                                                    colorbar_y=np.mean(fig._layout[f"yaxis{i+1}"]['domain'])+0.01, 
-                                                    colorbar_len=1/rows - 0.07)
 
-            fig.update_layout(**coloraxis)
+    def get_2d_comparison_plotly(self, 
+                                 index_loc: List[int], 
+                                 reference: Tuple[str, Optional[str]], 
+                                 mode: Literal["difference", "ratio", "zscore"] = "difference", 
+                                 select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                                 colorbar: Literal["individual", "shared", "hide"] = "individual", 
+                                 pipeline: Optional[PreprocessingPipeline] = None, 
+                                 scatter: Optional[dict] = None) -> go.Figure: 
+        """
+        Contour plot per sample of its comparison with the reference (see compare), 
+        on a diverging color scale centered at "no change".
+        """
+        data, ex_em_dict = self.compare(index_loc, reference, mode, select_range, pipeline, scatter)
+        batch, name = reference
+        against = f"{name} {batch}" if name is not None else f"mean of {batch}"
+        symbol = {"difference": "-", "ratio": "/", "zscore": "z vs"}[mode]
+        fig = contour_grid(data, 
+                           ex_em_dict['Excitation'], 
+                           ex_em_dict['Emission'], 
+                           titles=[f"{sample} {symbol} {against}" for sample in self.select(index_loc=index_loc).Name], 
+                           colorbar=colorbar, 
+                           colorscale="RdBu_r", 
+                           cmid=1 if mode == "ratio" else 0)
+        fig.update_layout(uirevision=True, 
+                          meta={"resolution": 1})
         return fig
     
 
+    def decompose(self, 
+                  index_loc: List[int], 
+                  method: Literal["pca", "parafac"] = "pca", 
+                  n_components: int = 3, 
+                  select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                  pipeline: Optional[PreprocessingPipeline] = None, 
+                  scatter: Optional[dict] = None) -> Tuple[Union[PCA2D, Parafac], npt.NDArray, dict]: 
+        """
+        Fits a PCA or PARAFAC model (see decomposition) on the selected samples and returns it 
+        with their scores and the wavelengths. Models are cached per selection; if an earlier 
+        model with the same settings covered a subset of the selection (e.g. before new files 
+        arrived), only the new samples are added to it with partial_fit.
+        """
+        df = self.preprocess(self.scatter_corrected(self.select(index_loc=index_loc), scatter), pipeline)
+        data, ex_em_dict = self._stack(df, select_range)
+        digests = [digest(sample) for sample in data]
+        lineage = hashlib.sha1(json.dumps([method, n_components, select_range, int(df.GridId.iloc[0]), 
+                                           pipeline.config_hash() if pipeline is not None else None, 
+                                           scatter], sort_keys=True, default=str).encode()).hexdigest()
+        key = hashlib.sha1((lineage + "".join(sorted(digests))).encode()).hexdigest()
+        model = self._model_cache.get(key)
+        if model is None: 
+            previous_digests, previous_key = self._model_lineage.get(lineage, (frozenset(), None))
+            previous = self._model_cache.get(previous_key) if previous_key is not None else None
+            new = [i for i, sample_digest in enumerate(digests) if sample_digest not in previous_digests]
+            if previous is not None and previous_digests.issubset(digests) and new: 
+                model = copy.deepcopy(previous).partial_fit(data[new])
+            else: 
+                model = make_decomposition(method, n_components).fit(data)
+            self._model_cache.put(key, model)
+            self._model_lineage[lineage] = (frozenset(digests), key)
+        return model, model.transform(data), ex_em_dict
+
+
+    def get_decomposition_plotly(self, 
+                                 index_loc: List[int], 
+                                 method: Literal["pca", "parafac"] = "pca", 
+                                 n_components: int = 3, 
+                                 select_range: Optional[Tuple] = ([200, 800], [200, 800]), 
+                                 pipeline: Optional[PreprocessingPipeline] = None, 
+                                 scatter: Optional[dict] = None) -> Tuple[go.Figure, go.Figure]: 
+        """
+        Score plot (first two components, colored by batch) and the loadings of every 
+        component as contours.
+        """
+        model, scores, ex_em_dict = self.decompose(index_loc, method, n_components, select_range, pipeline, scatter)
+        df = self.select(index_loc=index_loc)
+        if method == "pca": 
+            titles = [f"PC{i + 1} ({ratio:.1%})" for i, ratio in enumerate(model.explained_variance_ratio_)]
+        else: 
+            titles = [f"Component {i + 1}" for i in range(scores.shape[1])]
+        fig_scores = score_scatter(scores, 
+                                   labels=(df.Name + " " + df.Batch).tolist(), 
+                                   groups=df.Batch.tolist(), 
+                                   axis_titles=titles)
+        fig_scores.update_layout(legend_title_text="Batches", title="")
+        fig_loadings = contour_grid(model.component_eems(), 
+                                    ex_em_dict['Excitation'], 
+                                    ex_em_dict['Emission'], 
+                                    titles=titles, 
+                                    colorscale="RdBu_r" if method == "pca" else "Cividis", 
+                                    cmid=0 if method == "pca" else None)
+        return fig_scores, fig_loadings
+    
+
+    def point_values(self, excitation: int, emission: int, tolerance: float = 5) -> pd.Series: 
+        """
+        Intensity at the grid point nearest to (excitation, emission) of every sample, NaN if 
+        the grid has no wavelength within tolerance. Kept until df is replaced.
+        """
+        if self._point_values is None or self._point_values[0] is not self.df: 
+            self._point_values = (self.df, {})
+        cache = self._point_values[1]
+        if (excitation, emission) not in cache: 
+            values = pd.Series(np.nan, index=self.df.index, dtype="float32")
+            for grid_id, group in self.df.groupby("GridId", sort=False): 
+                axes = GRIDS.get(grid_id)
+                row = int(np.argmin(np.abs(axes['Excitation'] - excitation)))
+                column = int(np.argmin(np.abs(axes['Emission'] - emission)))
+                if (abs(axes['Excitation'][row] - excitation) <= tolerance and 
+                    abs(axes['Emission'][column] - emission) <= tolerance): 
+                    values[group.index] = np.fromiter((decode_eem(data[row, column, None], scale, offset)[0] 
+                                                       for data, scale, offset in zip(group.Data, *self._scale_offset(group))), 
+                                                      dtype=np.float32, count=len(group))
+            cache[(excitation, emission)] = values
+        return cache[(excitation, emission)]
+
+
+    def trend(self, 
+              value: str = "Max", 
+              excitation: Optional[int] = None, 
+              emission: Optional[int] = None, 
+              batches: Optional[List[str]] = None) -> pd.DataFrame: 
+        """
+        Date, Batch, Name and Value of every sample sorted by date. value is a summary or 
+        index column (SUMMARY_COLUMNS, INDEX_COLUMNS), or "Intensity" at (excitation, emission). 
+        Only precomputed columns and single grid points are read, never whole EEMs.
+        """
+        df = self.df[["Date", "Batch", "Name"]]
+        if value == "Intensity": 
+            if excitation is None or emission is None: 
+                raise ValueError("Intensity needs an excitation and an emission wavelength.")
+            df = df.assign(Value=self.point_values(excitation, emission))
+        elif value in SUMMARY_COLUMNS + INDEX_COLUMNS: 
+            df = df.assign(Value=self.df[value])
+        else: 
+            raise ValueError(f"Unknown trend value {value}.")
+        if batches: 
+            df = df.loc[self.catalogue.rows(batches)]
+        return df.sort_values("Date", kind="stable")
+
+
+    def get_trend_plotly(self, 
+                         value: str = "Max", 
+                         excitation: Optional[int] = None, 
+                         emission: Optional[int] = None, 
+                         batches: Optional[List[str]] = None, 
+                         date_range: Optional[Tuple] = None, 
+                         max_points: int = 2000) -> go.Figure: 
+        """
+        Trend of value (see trend) against the acquisition date. The points within date_range 
+        are downsampled to max_points with LTTB, so zooming in shows more detail.
+        """
+        df = self.trend(value, excitation, emission, batches)
+        if date_range is not None: 
+            df = df[(df.Date >= pd.Timestamp(date_range[0])) & (df.Date <= pd.Timestamp(date_range[1]))]
+        kept = lttb(df.Date.to_numpy().astype(np.int64), df.Value.to_numpy(dtype=np.float64), max_points)
+        df_kept = df.iloc[kept]
+        title = f"Intensity at EX {excitation} / EM {emission}" if value == "Intensity" else value
+        return trend_figure(df_kept.Date.to_numpy(), 
+                            df_kept.Value.to_numpy(), 
+                            (df_kept.Name + " " + df_kept.Batch).to_numpy(), 
+                            title=title, 
+                            n_total=int(df.Value.notna().sum()))
+
+
+    def memory_report(self) -> pd.DataFrame: 
+        """
+        Bytes held per component: EEM arrays, pyramids, the ndarray headers, the metadata 
+        columns, the Arrow catalogue, the wavelength grids and every cache, with the size 
+        per 1000 samples. Shared parts (grids, caches of an overlay view) are counted fully.
+        """
+        pyramids = [level for pyramid in self.df.Pyramid if isinstance(pyramid, dict) for level in pyramid.values()] \
+            if "Pyramid" in self.df else []
+        components = {
+            "arrays": sum(data.nbytes for data in self.df.Data), 
+            "pyramids": sum(level.nbytes for level in pyramids), 
+            "array headers": sum(sys.getsizeof(array) - (array.nbytes if array.base is None else 0) 
+                                 for array in [*self.df.Data, *pyramids]), 
+            "metadata": int(self.df.drop(columns=["Data", "Pyramid"], errors="ignore").memory_usage(deep=True).sum()), 
+            "catalogue": self._catalogue[1].table.nbytes if self._catalogue is not None else 0, 
+            "grids": GRIDS.nbytes, 
+            "pipeline cache": self._pipeline_cache.nbytes, 
+            "scatter cache": self._scatter_cache.nbytes, 
+            "comparison cache": self._comparison_cache.nbytes, 
+            "aggregate cache": self._aggregate_cache.nbytes, 
+            "model cache": self._model_cache.nbytes, 
+        }
+        report = pd.DataFrame({"Bytes": pd.Series(components, dtype="int64")}).rename_axis("Component")
+        report.loc["total"] = report.Bytes.sum()
+        return report.assign(MiB=report.Bytes / 1024**2, 
+                             MiBPer1000Samples=report.Bytes / 1024**2 / max(len(self.df), 1) * 1000)
+
+
     @property
     def flattened_df(self): 
         return self.get_1d_dataframe()
@@ -278,18 +1064,14 @@ class FluorescenceData:
 
     def get_1d_dataframe(self) -> pd.DataFrame: 
         """
-        Returns dataframe for samples with complete data.. the columns are 
+        Returns dataframe for samples on the most common grid.. the columns are 
         Excitation/Emission pairs.
         """
-        def concatenate_data(df): 
-            emission, excitation = [self.df
-                                    .loc[lambda x: x.is_complete].iloc[0]['Metadata'][key] 
-                                    for key in ['Emission', 'Excitation']
-                                    ]
-            columns = [f"{ex}EX/{em}EM" 
-                       for ex, em in product(excitation, emission)]
-            
-            return pd.concat([df.reset_index(drop=True), 
-                            pd.DataFrame(data=self.to_numpy_array(one_dim=True), 
-                                        columns=columns)], axis=1)
+        df = self.decoded(self.df.loc[lambda x: x.GridId == x.GridId.mode().iloc[0]])
+        axes = GRIDS.get(df.GridId.iloc[0])
+        columns = [f"{ex}EX/{em}EM" 
+                   for ex, em in product(axes['Excitation'], axes['Emission'])]
         
+        return pd.concat([df[['Batch', 'Name']].reset_index(drop=True), 
+                          pd.DataFrame(data=np.stack(df.Data.to_numpy(), axis=0).reshape(len(df), -1), 
+                                       columns=columns)], axis=1)
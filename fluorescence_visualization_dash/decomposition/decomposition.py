@@ -0,0 +1,275 @@
+from typing import Dict, Literal, Self, Tuple
+import warnings
+import numpy as np
+import numpy.typing as npt
+
+# Models work on (n, ex, em) stacks like the preprocessing stages. All heavy steps are
+# matrix products on unfoldings of the stack, so they run multi-threaded in BLAS.
+
+
+def randomized_svd(X: npt.NDArray, 
+                   n_components: int, 
+                   n_oversamples: int = 10, 
+                   n_iter: int = 4, 
+                   random_state: int = 0) -> Tuple[npt.NDArray, npt.NDArray, npt.NDArray]: 
+    """
+    Truncated SVD by random projection with power iterations (Halko et al.).
+    Signs are fixed so that the largest loading of every component is positive.
+    """
+    rng = np.random.default_rng(random_state)
+    n_random = min(n_components + n_oversamples, *X.shape)
+    Q = X @ rng.standard_normal((X.shape[1], n_random)).astype(X.dtype)
+    for _ in range(n_iter): 
+        Q, _ = np.linalg.qr(Q)
+        Q, _ = np.linalg.qr(X.T @ Q)
+        Q = X @ Q
+    Q, _ = np.linalg.qr(Q)
+    U, S, Vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+    U, S, Vt = (Q @ U)[:, :n_components], S[:n_components], Vt[:n_components]
+    signs = np.sign(Vt[np.arange(len(Vt)), np.argmax(np.abs(Vt), axis=1)])
+    signs[signs == 0] = 1
+    return U * signs, S, Vt * signs[:, None]
+
+
+def _khatri_rao(A: npt.NDArray, B: npt.NDArray) -> npt.NDArray: 
+    """Column-wise Kronecker product, rows ordered as A's index times len(B) plus B's index."""
+    return (A[:, None, :] * B[None, :, :]).reshape(-1, A.shape[1])
+
+
+class PCA2D(): 
+    """
+    PCA of (n, ex, em) stacks, every EEM flattened to one row. NaNs (excised scatter)
+    are replaced by the pixel mean. fit uses a randomized SVD, partial_fit the incremental
+    update of Ross et al. (as IncrementalPCA in scikit-learn), so new samples are added
+    without refitting the earlier ones.
+    """
+    def __init__(self, n_components: int = 3, random_state: int = 0) -> None: 
+        self.n_components = n_components
+        self.random_state = random_state
+        self.shape_ = None
+        self.mean_ = None
+        self.components_ = None
+        self.singular_values_ = None
+        self.n_samples_seen_ = 0
+        self._m2 = None
+
+    def get_params(self) -> Dict: 
+        return {"method": "pca", "n_components": self.n_components, "random_state": self.random_state}
+
+    def _flatten(self, X: npt.NDArray, fill: npt.NDArray) -> npt.NDArray: 
+        flat = np.asarray(X, dtype=np.float32).reshape(len(X), -1)
+        return np.where(np.isnan(flat), fill, flat)
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        self.shape_ = X.shape[1:]
+        flat = np.asarray(X, dtype=np.float32).reshape(len(X), -1)
+        with warnings.catch_warnings(): 
+            warnings.simplefilter("ignore", RuntimeWarning)
+            fill = np.nan_to_num(np.nanmean(flat, axis=0))
+        flat = self._flatten(X, fill)
+        self.mean_ = flat.mean(axis=0)
+        centered = flat - self.mean_
+        _, S, Vt = randomized_svd(centered, min(self.n_components, *centered.shape), 
+                                  random_state=self.random_state)
+        self.components_, self.singular_values_ = Vt, S
+        self.n_samples_seen_ = len(X)
+        self._m2 = (centered ** 2).sum(axis=0)
+        return self
+
+    def partial_fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        if self.components_ is None: 
+            return self.fit(X)
+        flat = self._flatten(X, self.mean_)
+        n_seen, n_new = self.n_samples_seen_, len(flat)
+        new_mean = flat.mean(axis=0)
+        total = n_seen + n_new
+        correction = np.sqrt(n_seen * n_new / total) * (self.mean_ - new_mean)
+        stacked = np.vstack([self.singular_values_[:, None] * self.components_, 
+                             flat - new_mean, 
+                             correction[None]])
+        _, S, Vt = randomized_svd(stacked, min(self.n_components, *stacked.shape), 
+                                  random_state=self.random_state)
+        self._m2 = self._m2 + ((flat - new_mean) ** 2).sum(axis=0) + \
+                   (self.mean_ - new_mean) ** 2 * n_seen * n_new / total
+        self.mean_ = (n_seen * self.mean_ + n_new * new_mean) / total
+        self.components_, self.singular_values_ = Vt, S
+        self.n_samples_seen_ = total
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        return (self._flatten(X, self.mean_) - self.mean_) @ self.components_.T
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+    @property
+    def explained_variance_ratio_(self) -> npt.NDArray: 
+        return self.singular_values_ ** 2 / self._m2.sum()
+
+    def component_eems(self) -> npt.NDArray: 
+        """Loadings as (n_components, ex, em)."""
+        return self.components_.reshape(len(self.components_), *self.shape_)
+
+    @property
+    def nbytes(self) -> int: 
+        return sum(array.nbytes for array in (self.mean_, self.components_, self._m2) if array is not None)
+
+
+class Parafac(): 
+    """
+    PARAFAC (CP) model X[i] ~ B diag(A[i]) C.T of (n, ex, em) stacks with scores A, 
+    excitation loadings B and emission loadings C, fitted by alternating least squares.
+    Every update is one MTTKRP (a matrix product on an unfolding) and an (r, r) solve.
+    NaNs are imputed from the model after every sweep, non_negative clips the factors at 0.
+    partial_fit adds samples by a recursive update of the loadings: the contributions of
+    earlier samples are kept as fitted instead of refitting the whole archive.
+    """
+    def __init__(self, 
+                 rank: int = 3, 
+                 n_iter_max: int = 200, 
+                 tol: float = 1e-6, 
+                 non_negative: bool = True, 
+                 random_state: int = 0) -> None: 
+        self.rank = rank
+        self.n_iter_max = n_iter_max
+        self.tol = tol
+        self.non_negative = non_negative
+        self.random_state = random_state
+        self.excitation_loadings_ = None
+        self.emission_loadings_ = None
+        self.fill_ = None
+        self.explained_ = None
+        self.n_iter_ = 0
+        self.n_samples_seen_ = 0
+        self._P_B = None
+        self._P_C = None
+        self._G = None
+
+    def get_params(self) -> Dict: 
+        return {"method": "parafac", "rank": self.rank, "n_iter_max": self.n_iter_max, "tol": self.tol, 
+                "non_negative": self.non_negative, "random_state": self.random_state}
+
+    def _clip(self, factor: npt.NDArray) -> npt.NDArray: 
+        return np.maximum(factor, 0) if self.non_negative else factor
+
+    @staticmethod
+    def _solve(mttkrp: npt.NDArray, gram: npt.NDArray) -> npt.NDArray: 
+        return np.linalg.lstsq(gram, mttkrp.T, rcond=None)[0].T
+
+    @staticmethod
+    def _unfoldings(X: npt.NDArray) -> Tuple[npt.NDArray, npt.NDArray, npt.NDArray]: 
+        n, n_ex, n_em = X.shape
+        return (X.reshape(n, n_ex * n_em), 
+                X.transpose(1, 0, 2).reshape(n_ex, n * n_em), 
+                X.transpose(2, 0, 1).reshape(n_em, n * n_ex))
+
+    def _init_loadings(self, X1: npt.NDArray, X2: npt.NDArray, X3: npt.NDArray) -> Tuple[npt.NDArray, npt.NDArray]: 
+        """Leading eigenvectors of the excitation/emission unfoldings (HOSVD start)."""
+        loadings = []
+        for unfolding in (X2, X3): 
+            _, vectors = np.linalg.eigh(unfolding @ unfolding.T)
+            vectors = vectors[:, ::-1][:, :self.rank]
+            if vectors.shape[1] < self.rank: 
+                rng = np.random.default_rng(self.random_state)
+                vectors = np.hstack([vectors, rng.random((len(vectors), self.rank - vectors.shape[1]))])
+            loadings.append(np.abs(vectors) if self.non_negative else vectors)
+        return loadings[0].astype(X1.dtype), loadings[1].astype(X1.dtype)
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        X = np.array(X, dtype=np.float32)
+        missing = np.isnan(X)
+        with warnings.catch_warnings(): 
+            # pixels without any value (excised scatter) are filled with 0
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.fill_ = np.nan_to_num(np.nanmean(X, axis=0))
+        X[missing] = np.broadcast_to(self.fill_, X.shape)[missing]
+        X1, X2, X3 = self._unfoldings(X)
+        B, C = self._init_loadings(X1, X2, X3)
+        A = self._clip(self._solve(X1 @ _khatri_rao(B, C), (B.T @ B) * (C.T @ C)))
+        norm_x = float(np.sum(X1.astype(np.float64) ** 2)) or 1.0
+        previous_error = np.inf
+        for self.n_iter_ in range(1, self.n_iter_max + 1): 
+            B = self._clip(self._solve(X2 @ _khatri_rao(A, C), (A.T @ A) * (C.T @ C)))
+            C = self._clip(self._solve(X3 @ _khatri_rao(A, B), (A.T @ A) * (B.T @ B)))
+            A = self._clip(self._solve(X1 @ _khatri_rao(B, C), (B.T @ B) * (C.T @ C)))
+            model = A @ _khatri_rao(B, C).T
+            if missing.any(): 
+                X[missing] = model.reshape(X.shape)[missing]
+                X1, X2, X3 = self._unfoldings(X)
+            error = float(np.sum((X1 - model).astype(np.float64) ** 2)) / norm_x
+            if abs(previous_error - error) < self.tol: 
+                break
+            previous_error = error
+        self.explained_ = 1 - error
+        A = self._set_loadings(A, B, C)
+        self._P_B = X2 @ _khatri_rao(A, self.emission_loadings_)
+        self._P_C = X3 @ _khatri_rao(A, self.excitation_loadings_)
+        self._G = A.T @ A
+        self.n_samples_seen_ = len(X)
+        return self
+
+    def _set_loadings(self, A: npt.NDArray, B: npt.NDArray, C: npt.NDArray) -> npt.NDArray:  
+        """
+        Stores unit-norm loadings sorted by the size of the components,  
+        returns the scores rescaled and sorted to match.
+        """
+        B_norm = np.linalg.norm(B, axis=0)
+        C_norm = np.linalg.norm(C, axis=0)
+        B_norm[B_norm == 0] = 1
+        C_norm[C_norm == 0] = 1
+        A = A * (B_norm * C_norm)
+        order = np.argsort(np.linalg.norm(A, axis=0))[::-1]
+        self.excitation_loadings_ = (B / B_norm)[:, order]
+        self.emission_loadings_ = (C / C_norm)[:, order]
+        return A[:, order]
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        """Scores (n, rank) of the samples with the loadings kept fixed."""
+        X = np.array(X, dtype=np.float32)
+        missing = np.isnan(X)
+        X[missing] = np.broadcast_to(self.fill_, X.shape)[missing]
+        B, C = self.excitation_loadings_, self.emission_loadings_
+        return self._clip(self._solve(X.reshape(len(X), -1) @ _khatri_rao(B, C), (B.T @ B) * (C.T @ C)))
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+    def partial_fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        if self.excitation_loadings_ is None: 
+            return self.fit(X)
+        A = self.transform(X)
+        X = np.array(X, dtype=np.float32)
+        missing = np.isnan(X)
+        X[missing] = np.broadcast_to(self.fill_, X.shape)[missing]
+        _, X2, X3 = self._unfoldings(X)
+        B, C = self.excitation_loadings_, self.emission_loadings_
+        self._P_B = self._P_B + X2 @ _khatri_rao(A, C)
+        self._P_C = self._P_C + X3 @ _khatri_rao(A, B)
+        self._G = self._G + A.T @ A
+        B = self._clip(self._solve(self._P_B, self._G * (C.T @ C)))
+        C = self._clip(self._solve(self._P_C, self._G * (B.T @ B)))
+        self.excitation_loadings_ = B / np.where(np.linalg.norm(B, axis=0) == 0, 1, np.linalg.norm(B, axis=0))
+        self.emission_loadings_ = C / np.where(np.linalg.norm(C, axis=0) == 0, 1, np.linalg.norm(C, axis=0))
+        self.n_samples_seen_ += len(X)
+        return self
+
+    def component_eems(self) -> npt.NDArray: 
+        """Outer products of the loadings as (rank, ex, em)."""
+        return np.einsum("jr,kr->rjk", self.excitation_loadings_, self.emission_loadings_)
+
+    @property
+    def nbytes(self) -> int: 
+        return sum(array.nbytes for array in (self.excitation_loadings_, self.emission_loadings_, self.fill_, 
+                                              self._P_B, self._P_C, self._G)
+                   if array is not None)
+
+
+def make_decomposition(method: Literal["pca", "parafac"], 
+                       n_components: int = 3, 
+                       non_negative: bool = True) -> "PCA2D | Parafac": 
+    """Model from the option names used in the UI."""
+    if method == "pca": 
+        return PCA2D(n_components)
+    if method == "parafac": 
+        return Parafac(n_components, non_negative=non_negative)
+    raise ValueError(f"Unknown decomposition {method}, use 'pca' or 'parafac'.")
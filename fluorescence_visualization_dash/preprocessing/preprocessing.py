@@ -0,0 +1,318 @@
+from typing import Any, Dict, Hashable, List, Optional, Self, Tuple, Union
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import numpy.typing as npt
+from fluorescence_visualization_dash.utils.utils import ExcitationEmissionRange
+
+# All stages work on the whole (n, ex, em) stack at once, excitation along the rows
+# and emission along the columns, same as RangeCutTransformer2D.
+
+
+def digest(array: Optional[npt.NDArray]) -> Optional[str]: 
+    """Content hash of an array, used in cache keys."""
+    if array is None: 
+        return None
+    array = np.ascontiguousarray(array)
+    return hashlib.sha1(array.tobytes() + str(array.shape).encode()).hexdigest()
+
+
+def _box_mean(X: npt.NDArray, axis: int, window: int) -> npt.NDArray: 
+    """NaN-aware centred moving average along one axis via cumulative sums."""
+    if window <= 1: 
+        return X
+    half = window // 2
+    valid = ~np.isnan(X)
+    pad = [(0, 0)] * X.ndim
+    pad[axis] = (half + 1, window - half - 1)
+    sums = np.cumsum(np.pad(np.where(valid, X, 0), pad), axis=axis)
+    counts = np.cumsum(np.pad(valid.astype(np.int32), pad), axis=axis)
+    n = X.shape[axis]
+    upper = [slice(None)] * X.ndim
+    lower = [slice(None)] * X.ndim
+    upper[axis] = slice(window, window + n)
+    lower[axis] = slice(0, n)
+    window_sums = sums[tuple(upper)] - sums[tuple(lower)]
+    window_counts = counts[tuple(upper)] - counts[tuple(lower)]
+    with np.errstate(invalid="ignore", divide="ignore"): 
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan).astype(X.dtype)
+
+
+class BlankSubtraction2D(): 
+    """ 
+    Subtracts a blank (usually water) EEM measured on the same grid from every sample.
+    """
+    def __init__(self, blank: npt.NDArray) -> None: 
+        self.blank = np.asarray(blank, dtype=np.float32)
+
+    def get_params(self) -> Dict: 
+        return {"blank": digest(self.blank)}
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        if X.shape[1:] != self.blank.shape: 
+            raise ValueError(f"Blank of shape {self.blank.shape} does not match the samples {X.shape[1:]}.")
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        return X - self.blank[None]
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+
+class InnerFilterCorrection2D(): 
+    """ 
+    Absorbance based (ABA) inner filter correction: F * 10^((A_ex + A_em) / 2). 
+    absorbance_ex/absorbance_em are (n_ex,)/(n_em,) for all samples or (n, n_ex)/(n, n_em) 
+    per sample, measured at the excitation/emission wavelengths of the grid (1 cm cell).
+    """
+    def __init__(self, 
+                 absorbance_ex: npt.NDArray, 
+                 absorbance_em: npt.NDArray, 
+                 path_length: float = 1.0) -> None: 
+        self.absorbance_ex = np.asarray(absorbance_ex, dtype=np.float32)
+        self.absorbance_em = np.asarray(absorbance_em, dtype=np.float32)
+        self.path_length = path_length
+
+    def get_params(self) -> Dict: 
+        return {"absorbance_ex": digest(self.absorbance_ex), 
+                "absorbance_em": digest(self.absorbance_em), 
+                "path_length": self.path_length}
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        a_ex = np.atleast_2d(self.absorbance_ex)[:, :, None]
+        a_em = np.atleast_2d(self.absorbance_em)[:, None, :]
+        return X * np.power(10, (a_ex + a_em) / (2 * self.path_length))
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+
+class RamanNormalization2D(): 
+    """ 
+    Converts intensities to Raman units (R.U.): divides by the area of the water Raman 
+    peak at `excitation` integrated over `emission_range`. The area is taken from the 
+    blank if given, otherwise from every sample itself.
+    """
+    def __init__(self, 
+                 exic_emis: ExcitationEmissionRange, 
+                 blank: Optional[npt.NDArray] = None, 
+                 excitation: int = 350, 
+                 emission_range: Tuple[int, int] = (371, 428)) -> None: 
+        self.exic_emis = exic_emis
+        self.blank = None if blank is None else np.asarray(blank, dtype=np.float32)
+        self.excitation = excitation
+        self.emission_range = emission_range
+        self._row = None
+        self._cols = None
+        self.raman_area_ = None
+
+    def get_params(self) -> Dict: 
+        return {"blank": digest(self.blank), 
+                "excitation": self.excitation, 
+                "emission_range": list(self.emission_range)}
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        ex = np.asarray(self.exic_emis['Excitation'], dtype=float)
+        em = np.asarray(self.exic_emis['Emission'], dtype=float)
+        self._row = int(np.argmin(np.abs(ex - self.excitation)))
+        self._cols = (em >= self.emission_range[0]) & (em <= self.emission_range[1])
+        if not self._cols.any(): 
+            raise ValueError(f"No emission wavelengths within {self.emission_range} for Raman normalization.")
+        if self.blank is not None: 
+            self.raman_area_ = self._area(self.blank[None])
+        return self
+
+    def _area(self, X: np.ndarray) -> np.ndarray: 
+        em = np.asarray(self.exic_emis['Emission'], dtype=float)[self._cols]
+        peak = X[:, self._row, self._cols]
+        # trapezoidal rule
+        return np.sum((peak[:, 1:] + peak[:, :-1]) / 2 * np.diff(em), axis=-1)
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        area = self.raman_area_ if self.raman_area_ is not None else self._area(X)
+        return X / area[:, None, None]
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+
+class Smoothing2D(): 
+    """ 
+    Moving average over (excitation, emission) windows, ignoring NaN (excised scatter).
+    """
+    def __init__(self, window: Tuple[int, int] = (1, 5)) -> None: 
+        self.window = window
+
+    def get_params(self) -> Dict: 
+        return {"window": list(self.window)}
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        return _box_mean(_box_mean(X, 1, self.window[0]), 2, self.window[1])
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        return self.fit(X).transform(X)
+
+
+class PreprocessingPipeline(): 
+    """ 
+    Applies the stages in order. config_hash identifies the configuration, 
+    it is used to cache the results per sample.
+    """
+    def __init__(self, steps: List[Tuple[str, Any]]) -> None: 
+        self.steps = steps
+
+    def config(self) -> List: 
+        return [[name, type(stage).__name__, stage.get_params()] for name, stage in self.steps]
+
+    def config_hash(self) -> str: 
+        return hashlib.sha1(json.dumps(self.config(), sort_keys=True).encode()).hexdigest()
+
+    def fit(self, X: np.ndarray, y: np.ndarray=None) -> Self: 
+        self.fit_transform(X)
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        for _, stage in self.steps: 
+            X = stage.transform(X)
+        return X
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray: 
+        X = X.astype(np.float32)
+        for _, stage in self.steps: 
+            X = stage.fit_transform(X)
+        return X
+
+
+def make_pipeline(steps: List[str], 
+                  exic_emis: ExcitationEmissionRange, 
+                  blank: Optional[npt.NDArray] = None, 
+                  smoothing_window: Tuple[int, int] = (1, 5)) -> PreprocessingPipeline: 
+    """
+    Pipeline from the option names used in the UI, in the canonical order 
+    blank subtraction -> Raman normalization -> smoothing.
+    """
+    pipeline = []
+    if "blank" in steps: 
+        if blank is None: 
+            raise ValueError("Blank subtraction needs a blank sample.")
+        pipeline.append(("blank", BlankSubtraction2D(blank)))
+    if "raman" in steps: 
+        pipeline.append(("raman", RamanNormalization2D(exic_emis, blank=blank)))
+    if "smoothing" in steps: 
+        pipeline.append(("smoothing", Smoothing2D(smoothing_window)))
+    return PreprocessingPipeline(pipeline)
+
+
+class ArrayCache(): 
+    """
+    Thread safe LRU cache of arrays bounded by their total size.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024**2) -> None: 
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data: "OrderedDict[Hashable, npt.NDArray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[npt.NDArray]: 
+        with self._lock: 
+            if key in self._data: 
+                self._data.move_to_end(key)
+                return self._data[key]
+        return None
+
+    def put(self, key: Hashable, value: npt.NDArray) -> None: 
+        with self._lock: 
+            if key in self._data: 
+                self.nbytes -= self._data.pop(key).nbytes
+            self._data[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self._data) > 1: 
+                self.nbytes -= self._data.popitem(last=False)[1].nbytes
+
+    def clear(self) -> None: 
+        with self._lock: 
+            self._data.clear()
+            self.nbytes = 0
+
+
+class DiskArrayCache(): 
+    """
+    Arrays as .npy files in directory, one per key, bounded by their total size. 
+    Reads mark a file as used (os.utime), once max_bytes is exceeded the least recently 
+    used files are deleted down to 80% of it. Files are written then renamed, so several 
+    processes can share the directory.
+    """
+    def __init__(self, directory: Union[str, os.PathLike], max_bytes: int = 1024**3) -> None: 
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        # estimate of the directory size, recounted on every trim (other processes write too)
+        self._nbytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> pathlib.Path: 
+        return self.directory/f"{key}.npy"
+
+    def get(self, key: str) -> Optional[npt.NDArray]: 
+        path = self._path(key)
+        try: 
+            array = np.load(path)
+            # access times are often not kept (noatime/relatime)
+            os.utime(path)
+        except FileNotFoundError: 
+            return None
+        return array
+
+    def put(self, key: str, array: npt.NDArray) -> None: 
+        path = self._path(key)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f: 
+            np.save(f, array)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+        with self._lock: 
+            self._nbytes = self.__trim() if self._nbytes is None else self._nbytes + size
+            if self._nbytes > self.max_bytes: 
+                self._nbytes = self.__trim(int(self.max_bytes * 0.8))
+
+    def __trim(self, max_bytes: Optional[int] = None) -> int: 
+        """Deletes the least recently used files until at most max_bytes are left, returns the total."""
+        files = []
+        for path in self.directory.glob("*.npy"): 
+            try: 
+                stat = path.stat()
+            except FileNotFoundError: 
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if max_bytes is not None: 
+            for _, size, path in sorted(files): 
+                if total <= max_bytes: 
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        return total
+
+    @property
+    def nbytes(self) -> int: 
+        with self._lock: 
+            if self._nbytes is None: 
+                self._nbytes = self.__trim() if self.directory.exists() else 0
+            return self._nbytes
+
+    def clear(self) -> None: 
+        with self._lock: 
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._nbytes = 0
@@ -0,0 +1,237 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+import os
+import re
+import time
+import pickle
+import logging
+import pathlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def payload_nbytes(payload: Any) -> int: 
+    """
+    Rough size of a session payload. Only the numpy arrays are counted since 
+    they dominate the footprint of uploaded EEMs.
+    """
+    if isinstance(payload, dict): 
+        return sum(payload_nbytes(value) for value in payload.values())
+    if isinstance(payload, pd.DataFrame): 
+        # Data and its emission-binned Pyramid copies (None with compact storage)
+        return sum(payload_nbytes(value) for column in ("Data", "Pyramid") if column in payload 
+                   for value in payload[column])
+    if isinstance(payload, np.ndarray): 
+        return payload.nbytes
+    return 0
+
+
+class SessionStore: 
+    """
+    Bounded store for per-session overlays (uploaded data). 
+    Least recently used sessions are spilled to disk once max_bytes is exceeded, 
+    sessions not touched for ttl seconds are dropped from memory and disk. 
+    Spill files are written and read outside the lock, only requests for that 
+    session wait for them. 
+    derived keeps an object built from the payload next to it, counted in max_bytes 
+    and dropped when the session is spilled.
+    """
+    def __init__(self, 
+                 cache_dir: Union[str, os.PathLike], 
+                 max_bytes: int = 512 * 1024**2, 
+                 max_session_bytes: int = 128 * 1024**2, 
+                 ttl: float = 6 * 3600) -> None: 
+        
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_session_bytes = max_session_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._spilled: Dict[str, float] = {}
+        self._derived: Dict[str, Tuple[Any, Any, Any, int]] = {}
+        # sessions whose spill file is being written or read
+        self._in_transit: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        # Spilled files of a previous run can not be matched to a session anymore
+        for path in self.cache_dir.glob("*.pickle"): 
+            os.remove(path)
+
+
+    @property
+    def nbytes(self) -> int: 
+        return (sum(size for _, _, size in self._memory.values()) 
+                + sum(size for _, _, _, size in self._derived.values()))
+
+
+    def _spill_path(self, session_id: str) -> pathlib.Path: 
+        if not SESSION_ID_PATTERN.match(session_id): 
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return self.cache_dir/f"{session_id}.pickle"
+
+
+    @contextmanager
+    def __settled(self, session_id: str) -> Iterator[None]: 
+        """Holds the lock once no spill file of session_id is being written or read."""
+        while True: 
+            self._lock.acquire()
+            event = self._in_transit.get(session_id)
+            if event is None: 
+                break
+            self._lock.release()
+            event.wait()
+        try: 
+            yield
+        finally: 
+            self._lock.release()
+
+
+    def get(self, session_id: Optional[str]) -> Optional[Any]: 
+        """
+        Returns the payload of the session or None. Spilled sessions are reloaded.
+        """
+        if not session_id: 
+            return None
+        with self.__settled(session_id): 
+            self.__expire()
+            now = time.time()
+            if session_id in self._memory: 
+                _, payload, size = self._memory.pop(session_id)
+                self._memory[session_id] = (now, payload, size)
+                return payload
+            if session_id not in self._spilled: 
+                return None
+            del self._spilled[session_id]
+            loaded = self._in_transit[session_id] = threading.Event()
+        victims = []
+        try: 
+            path = self._spill_path(session_id)
+            with open(path, "rb") as f: 
+                payload = pickle.load(f)
+            os.remove(path)
+            with self._lock: 
+                victims = self.__insert(session_id, payload, now)
+        finally: 
+            with self._lock: 
+                del self._in_transit[session_id]
+            loaded.set()
+        self.__spill(victims)
+        return payload
+
+
+    def derived(self, 
+                session_id: Optional[str], 
+                key: Any, 
+                build: Callable[[Any], Any], 
+                nbytes: Callable[[Any], int] = payload_nbytes) -> Any: 
+        """
+        build(payload), built once per payload and key (compared by identity, e.g. the archive 
+        the uploads are laid over). Without a payload build(None) is returned as it is. 
+        nbytes(value) is what the value holds on its own, it counts towards max_bytes.
+        """
+        payload = self.get(session_id)
+        if payload is None: 
+            return build(None)
+        with self._lock: 
+            cached = self._derived.get(session_id)
+        if cached is not None and cached[0] is key and cached[1] is payload: 
+            return cached[2]
+        value = build(payload)
+        size = nbytes(value)
+        victims = []
+        with self._lock: 
+            if session_id in self._memory and self._memory[session_id][1] is payload: 
+                self._derived[session_id] = (key, payload, value, size)
+                victims = self.__evict()
+        self.__spill(victims)
+        return value
+
+
+    def put(self, session_id: str, payload: Any) -> None: 
+        """
+        Stores the payload for the session. Raises if one session is too large.
+        """
+        size = payload_nbytes(payload)
+        if size > self.max_session_bytes: 
+            raise MemoryError(f"Session data of {size / 1024**2:.1f} MB exceeds the limit "
+                              f"of {self.max_session_bytes / 1024**2:.1f} MB.")
+        self._spill_path(session_id)
+        with self.__settled(session_id): 
+            self.__expire()
+            self._memory.pop(session_id, None)
+            self._derived.pop(session_id, None)
+            if self._spilled.pop(session_id, None) is not None: 
+                os.remove(self._spill_path(session_id))
+            victims = self.__insert(session_id, payload, time.time(), size)
+        self.__spill(victims)
+
+
+    def discard(self, session_id: str) -> None: 
+        with self.__settled(session_id): 
+            self._memory.pop(session_id, None)
+            self._derived.pop(session_id, None)
+            if self._spilled.pop(session_id, None) is not None: 
+                os.remove(self._spill_path(session_id))
+
+
+    def __insert(self, 
+                 session_id: str, 
+                 payload: Any, 
+                 last_access: float, 
+                 size: Optional[int] = None) -> List[Tuple[str, float, Any, threading.Event]]: 
+        """Adds the payload (lock held) and returns what __evict takes out."""
+        if size is None: 
+            size = payload_nbytes(payload)
+        self._memory[session_id] = (last_access, payload, size)
+        return self.__evict()
+
+
+    def __evict(self) -> List[Tuple[str, float, Any, threading.Event]]: 
+        """
+        Takes the least recently used sessions out of memory (lock held) until max_bytes 
+        is met. They are returned for __spill, marked in transit.
+        """
+        victims = []
+        # always keep the most recently used one
+        while self.nbytes > self.max_bytes and len(self._memory) > 1: 
+            old_id, (old_access, old_payload, _) = self._memory.popitem(last=False)
+            self._derived.pop(old_id, None)
+            event = self._in_transit[old_id] = threading.Event()
+            victims.append((old_id, old_access, old_payload, event))
+        return victims
+
+
+    def __spill(self, victims: List[Tuple[str, float, Any, threading.Event]]) -> None: 
+        """Writes the sessions taken out by __insert to disk, without holding the lock."""
+        for session_id, last_access, payload, event in victims: 
+            try: 
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                with open(self._spill_path(session_id), "wb") as f: 
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception: 
+                logging.exception(f"Spilling session {session_id} failed, its uploads are dropped.")
+                with self._lock: 
+                    del self._in_transit[session_id]
+            else: 
+                with self._lock: 
+                    self._spilled[session_id] = last_access
+                    del self._in_transit[session_id]
+                logging.info(f"Session {session_id} spilled to disk.")
+            finally: 
+                event.set()
+
+
+    def __expire(self) -> None: 
+        deadline = time.time() - self.ttl
+        for session_id in [k for k, (t, _, _) in self._memory.items() if t < deadline]: 
+            del self._memory[session_id]
+            self._derived.pop(session_id, None)
+        for session_id in [k for k, t in self._spilled.items() if t < deadline]: 
+            del self._spilled[session_id]
+            path = self._spill_path(session_id)
+            if path.exists(): 
+                os.remove(path)
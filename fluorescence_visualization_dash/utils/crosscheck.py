@@ -0,0 +1,226 @@
+"""
+Cross-checks of the optimized numeric paths against their reference implementations.
+
+Every check runs both sides on the same inputs (randomized synthetic EEMs and parsed Cary 
+csv fixtures, built in tests/conftest.py) and reports the cases, the time each side took and 
+what disagrees beyond the check's tolerance. tests/test_crosscheck.py runs them, 
+`pytest -m timing` also compares the speed.
+"""
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Tuple
+import time
+import itertools
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from fluorescence_visualization_dash.utils.utils import SCATTER_ENGINES, PYRAMID_LEVELS, contour_grid, \
+    streaming_moments, encode_eem, decode_eem
+
+if TYPE_CHECKING: 
+    import plotly.graph_objects as go
+    from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+
+
+class Result(NamedTuple): 
+    cases: int
+    reference_ms: float
+    optimized_ms: float
+    mismatches: List[str]
+
+
+def timed(function: Callable, *args, **kwargs) -> Tuple[Any, float]: 
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def mismatch(reference: npt.NDArray, optimized: npt.NDArray, rtol: float = 1e-6, atol: float = 1e-6) -> str: 
+    """Empty if the arrays agree (NaN in the same places), otherwise what differs."""
+    reference, optimized = np.asarray(reference, dtype=float), np.asarray(optimized, dtype=float)
+    if reference.shape != optimized.shape: 
+        return f"shape {reference.shape} != {optimized.shape}"
+    if not np.array_equal(np.isnan(reference), np.isnan(optimized)): 
+        return "NaN positions differ"
+    if not np.allclose(reference, optimized, rtol=rtol, atol=atol, equal_nan=True): 
+        return f"max abs error {np.nanmax(np.abs(reference - optimized)):.3g}"
+    return ""
+
+
+def check_scatter(rng: np.random.Generator, eems: List[pd.DataFrame], engine: str = "vectorized") -> Result: 
+    """SCATTER_ENGINES[engine] against scatter_removal, values and emission/excitation labels."""
+    reference_engine, optimized_engine = SCATTER_ENGINES["reference"], SCATTER_ENGINES[engine]
+    combinations = list(itertools.product(["rayleigh", "raman", "both"], ["first", "second", "both"], 
+                                          [None, "below", "above", "both"], ["interp", "zeros", None]))
+    cases, reference_ms, optimized_ms, mismatches = 0, 0.0, 0.0, []
+    for i, eem in enumerate(eems): 
+        for k in rng.choice(len(combinations), size=4, replace=False): 
+            band, order, truncate, fill = combinations[k]
+            params = dict(band=band, order=order, excision_width=float(rng.choice([0, 20, 50])), 
+                          fill=fill, truncate=truncate)
+            reference, ms_reference = timed(reference_engine, eem, **params)
+            optimized, ms_optimized = timed(optimized_engine, eem, **params)
+            cases, reference_ms, optimized_ms = cases + 1, reference_ms + ms_reference, optimized_ms + ms_optimized
+            error = mismatch(reference.to_numpy(dtype=float), optimized.to_numpy(dtype=float))
+            if not (np.array_equal(reference.index, optimized.index) and np.array_equal(reference.columns, optimized.columns)): 
+                error = "axis labels differ"
+            if error: 
+                mismatches.append(f"eem {i} {params}: {error}")
+    return Result(cases, reference_ms, optimized_ms, mismatches)
+
+
+def mask_cut(data: npt.NDArray, 
+             excitation: npt.NDArray, 
+             emission: npt.NDArray, 
+             select_range: Tuple) -> Tuple[npt.NDArray, Dict[str, npt.NDArray]]: 
+    """
+    Plain boolean-mask cut of one (ex, em) sample: everything between the wavelengths 
+    closest to the range limits (the first one on ties), both included.
+    """
+    def nearest(axis, value): 
+        return min(axis, key=lambda wavelength: abs(wavelength - value))
+
+    (em_low, em_high), (ex_low, ex_high) = select_range
+    ex_mask = (excitation >= nearest(excitation, ex_low)) & (excitation <= nearest(excitation, ex_high))
+    em_mask = (emission >= nearest(emission, em_low)) & (emission <= nearest(emission, em_high))
+    return data[ex_mask][:, em_mask], {"Excitation": excitation[ex_mask], "Emission": emission[em_mask]}
+
+
+def mean_bins(data: npt.NDArray, emission: npt.NDArray, factor: int) -> Tuple[npt.NDArray, npt.NDArray]: 
+    """Plain per-bin nanmean of `factor` neighbouring emission wavelengths of one sample."""
+    groups = [slice(start, start + factor) for start in range(0, emission.size, factor)]
+    with np.errstate(invalid="ignore"), np.testing.suppress_warnings() as suppressed: 
+        suppressed.filter(RuntimeWarning)
+        binned = np.stack([np.nanmean(data[:, group].astype(np.float64), axis=1) for group in groups], axis=1)
+    return binned, np.array([emission[group].astype(float).mean() for group in groups])
+
+
+def check_stack(rng: np.random.Generator, fluorescence: "FluorescenceData") -> Result: 
+    """
+    FluorescenceData._stack (RangeCutTransformer2D, bin_emission and the stored pyramid 
+    levels) against mask_cut of every sample, after mean_bins for levels above 1.
+    """
+    df = fluorescence.select()
+    axes = fluorescence.axes(df)
+    excitation, emission = np.asarray(axes["Excitation"]), np.asarray(axes["Emission"])
+    cases, reference_ms, optimized_ms, mismatches = 0, 0.0, 0.0, []
+    for _ in range(4): 
+        em_range = sorted(rng.uniform(emission[0] - 20, emission[-1] + 20, size=2))
+        ex_range = sorted(rng.uniform(excitation[0] - 20, excitation[-1] + 20, size=2))
+        select_range = (em_range, ex_range)
+        for level in PYRAMID_LEVELS: 
+            start = time.perf_counter()
+            cut = []
+            for data in df.Data: 
+                binned, binned_emission = (data, emission) if level == 1 else mean_bins(data, emission, level)
+                cut.append(mask_cut(binned, excitation, binned_emission, select_range))
+            reference, labels = np.stack([values for values, _ in cut]), cut[0][1]
+            ms_reference = (time.perf_counter() - start) * 1000
+            (optimized, optimized_axes), ms_optimized = timed(fluorescence._stack, df, select_range, level)
+            cases, reference_ms, optimized_ms = cases + 1, reference_ms + ms_reference, optimized_ms + ms_optimized
+            error = mismatch(reference, optimized, rtol=1e-5)
+            if any(mismatch(labels[axis], optimized_axes[axis], rtol=0, atol=0) for axis in ("Excitation", "Emission")): 
+                error = "axis labels differ"
+            if error: 
+                mismatches.append(f"level {level} {np.round(select_range, 1).tolist()}: {error}")
+    return Result(cases, reference_ms, optimized_ms, mismatches)
+
+
+def contour_grid_reference(data: npt.NDArray, 
+                           excitation: npt.NDArray, 
+                           emission: npt.NDArray, 
+                           titles: List[str], 
+                           colorbar: str = "individual") -> "go.Figure": 
+    """The make_subplots/add_trace builder contour_grid replaced."""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    n_samples = data.shape[0]
+    rows = max(-(-n_samples // 3), 1)
+    fig = make_subplots(rows=rows, cols=3, subplot_titles=titles, horizontal_spacing=0.17)
+    for i in range(n_samples): 
+        fig.add_trace(go.Contour(z=data[i], x=emission, y=excitation, colorscale="Cividis", 
+                                 colorbar=dict(title='Intensity'), showscale=colorbar != "hide", 
+                                 coloraxis=None if colorbar == "hide" else f'coloraxis{i + 1}'), 
+                      row=(i // 3) + 1, col=(i % 3) + 1)
+    fig.update_xaxes(nticks=10, title_text='Emission')
+    fig.update_yaxes(title_text='Excitation')
+    fig.update_layout(title_text="", showlegend=False)
+    return fig
+
+
+def check_contour_grid(rng: np.random.Generator, eems: List[pd.DataFrame]) -> Result: 
+    """contour_grid against the make_subplots builder: traces, their axes, domains and titles."""
+    cases, reference_ms, optimized_ms, mismatches = 0, 0.0, 0.0, []
+    for n_samples in (1, 4, 7): 
+        eem = eems[int(rng.integers(len(eems)))]
+        data = np.stack([eem.to_numpy().T * rng.uniform(0.5, 2) for _ in range(n_samples)])
+        titles = [f"sample {i}" for i in range(n_samples)]
+        arguments = (data, eem.columns.to_numpy(), eem.index.to_numpy(), titles)
+        reference, ms_reference = timed(contour_grid_reference, *arguments)
+        optimized, ms_optimized = timed(contour_grid, *arguments)
+        cases, reference_ms, optimized_ms = cases + 1, reference_ms + ms_reference, optimized_ms + ms_optimized
+        for i, (expected, actual) in enumerate(zip(reference.data, optimized.data)): 
+            errors = [mismatch(getattr(expected, field), getattr(actual, field), rtol=0, atol=0) for field in ("z", "x", "y")]
+            suffix = "" if i == 0 else str(i + 1)
+            expected_domains = (reference.layout[f"xaxis{suffix}"].domain, reference.layout[f"yaxis{suffix}"].domain)
+            actual_domains = (optimized.layout[f"xaxis{suffix}"].domain, optimized.layout[f"yaxis{suffix}"].domain)
+            errors.append(mismatch(expected_domains, actual_domains, rtol=0, atol=1e-9) and "domains differ")
+            if (expected.xaxis, expected.yaxis) != (actual.xaxis, actual.yaxis): 
+                errors.append("trace axes differ")
+            if any(errors): 
+                mismatches.append(f"{n_samples} samples, subplot {i}: {'; '.join(error for error in errors if error)}")
+        if len(reference.data) != len(optimized.data) or \
+           [a.text for a in reference.layout.annotations] != [a.text for a in optimized.layout.annotations]: 
+            mismatches.append(f"{n_samples} samples: traces or titles differ")
+    return Result(cases, reference_ms, optimized_ms, mismatches)
+
+
+def check_streaming_moments(rng: np.random.Generator, eems: List[pd.DataFrame]) -> Result: 
+    """Chunked streaming_moments against np.nanmean/np.nanstd(ddof=1) of the whole stack."""
+    cases, reference_ms, optimized_ms, mismatches = 0, 0.0, 0.0, []
+    eem = eems[0].to_numpy().T
+    for n_samples, chunk_size in ((1, 1), (10, 3), (50, 16)): 
+        data = eem[None] * rng.uniform(0.5, 2, size=(n_samples, 1, 1)) + rng.normal(0, 5, (n_samples,) + eem.shape)
+        data[rng.random(data.shape) < 0.05] = np.nan
+
+        def reference_moments(): 
+            with np.errstate(invalid="ignore", divide="ignore"), np.testing.suppress_warnings() as suppressed: 
+                suppressed.filter(RuntimeWarning)
+                return np.nanmean(data, axis=0), np.nanstd(data, axis=0, ddof=1), (~np.isnan(data)).sum(axis=0)
+
+        reference, ms_reference = timed(reference_moments)
+        optimized, ms_optimized = timed(streaming_moments, (data[i:i + chunk_size] for i in range(0, n_samples, chunk_size)))
+        cases, reference_ms, optimized_ms = cases + 1, reference_ms + ms_reference, optimized_ms + ms_optimized
+        for name, expected, actual in zip(("mean", "std", "count"), reference, optimized): 
+            # single values give NaN std in both, float32 results
+            error = mismatch(np.where(np.isinf(expected), np.nan, expected), actual, rtol=1e-5, atol=1e-4)
+            if error: 
+                mismatches.append(f"{n_samples} samples by {chunk_size}, {name}: {error}")
+    return Result(cases, reference_ms, optimized_ms, mismatches)
+
+
+def check_storage(rng: np.random.Generator, eems: List[pd.DataFrame]) -> Result: 
+    """encode_eem/decode_eem round trips within the error bounds documented in encode_eem."""
+    cases, reference_ms, optimized_ms, mismatches = 0, 0.0, 0.0, []
+    for i, eem in enumerate(eems): 
+        data = eem.to_numpy().T.astype(np.float32)
+        for storage in ("float16", "uint16"): 
+            (encoded, scale, offset), ms_optimized = timed(encode_eem, data, storage)
+            decoded = decode_eem(encoded, scale, offset)
+            if storage == "float16": 
+                atol, rtol = 3e-8, 2.0**-11
+            else: 
+                atol, rtol = scale / 2 + np.finfo(np.float32).eps * np.nanmax(np.abs(data)), 0
+            cases, optimized_ms = cases + 1, optimized_ms + ms_optimized
+            error = mismatch(data, decoded, rtol=rtol, atol=atol)
+            if error: 
+                mismatches.append(f"eem {i} {storage}: {error}")
+    return Result(cases, reference_ms, optimized_ms, mismatches)
+
+
+CHECKS: Dict[str, Callable[..., Result]] = {
+    "scatter_removal": check_scatter, 
+    "range cut/pyramid": check_stack, 
+    "contour_grid": check_contour_grid, 
+    "streaming_moments": check_streaming_moments, 
+    "eem storage": check_storage, 
+}
@@ -0,0 +1,62 @@
+"""
+Import time budget of the entry points, measured with `python -X importtime`.
+
+    python -m fluorescence_visualization_dash.utils.importtime
+
+Every module is imported in a fresh interpreter `repeat` times and the fastest run 
+is compared against its budget, which keeps the numbers reproducible on a busy machine. 
+Exits with 1 if a budget is exceeded or a module that should be lazy was imported.
+"""
+from typing import Dict, List, NamedTuple, Tuple
+import re
+import sys
+import subprocess
+
+
+class Budget(NamedTuple): 
+    milliseconds: float
+    forbidden: Tuple[str, ...] = ()
+
+
+BUDGETS: Dict[str, Budget] = {
+    # set_data_path only writes a json file
+    "fluorescence_visualization_dash.cli": Budget(150, ("numpy", "pandas", "scipy", "plotly", "dash", "tqdm")), 
+    # scipy is only needed for scatter correction, tqdm only while ingesting files
+    "fluorescence_visualization_dash.app": Budget(2000, ("scipy", "tqdm")), 
+}
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure(module: str) -> Tuple[float, List[str]]: 
+    """Cumulative import time in ms and all modules imported along the way."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], 
+                            capture_output=True, text=True, check=True)
+    cumulative, imported = 0.0, []
+    for line in result.stderr.splitlines(): 
+        match = LINE.match(line)
+        if match is None: 
+            continue
+        imported.append(match.group(4))
+        if match.group(4) == module: 
+            cumulative = int(match.group(2)) / 1000
+    return cumulative, imported
+
+
+def check(budgets: Dict[str, Budget] = BUDGETS, repeat: int = 5) -> bool: 
+    ok = True
+    for module, budget in budgets.items(): 
+        runs = [measure(module) for _ in range(repeat)]
+        best = min(ms for ms, _ in runs)
+        leaked = sorted({name for name in runs[0][1] 
+                         if name.split(".")[0] in budget.forbidden})
+        passed = (best <= budget.milliseconds) and not leaked
+        ok &= passed
+        print(f"{'ok ' if passed else 'FAIL'} {module}: {best:.0f} ms (budget {budget.milliseconds:.0f} ms)")
+        if leaked: 
+            print(f"     should not import: {', '.join(leaked)}")
+    return ok
+
+
+if __name__ == "__main__": 
+    sys.exit(0 if check() else 1)
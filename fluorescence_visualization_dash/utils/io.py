@@ -0,0 +1,23 @@
+import json 
+import pathlib
+from typing import Union, Any, Dict
+from pathlib import Path
+
+# Kept free of numpy/pandas/plotly so that the cli starts instantly.
+
+
+def load_json_file(file_path: Union[pathlib.Path, str]) -> Union[Any, Dict]: 
+    """Helper function to load the json file
+    """
+    if Path(file_path).exists(): 
+        with open(file_path, "r") as f: 
+            return json.load(f)
+    return {}
+
+
+def save_json_file(file_path: Union[pathlib.Path, str], data: Any) -> None: 
+    """ Helper method to save as a json file"""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(file_path, "w") as f: 
+        json.dump(data, f)
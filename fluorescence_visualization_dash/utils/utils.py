@@ -1,34 +1,26 @@
-import json 
-import pathlib
-from typing import Union, Any, Dict, TypedDict, List, Self
+from typing import Union, Any, Dict, TypedDict, List, Self, Tuple, Optional, Literal, Iterable, TYPE_CHECKING
+import math
+import logging
+import warnings
 import numpy as np
-import plotly.graph_objects as go 
 import pandas as pd
-import plotly_express as px
 import numpy.typing as npt
-import scipy
-from pathlib import Path
 
-def load_json_file(file_path: Union[pathlib.Path, str]) -> Union[Any, Dict]: 
-    """Helper function to load the json file
-    """
-    if Path(file_path).exists(): 
-        with open(file_path, "r") as f: 
-            return json.load(f)
-    return {}
-
-
-def save_json_file(file_path: pathlib.Path, data: Any) -> None: 
-    """ Helper method to save as a json file"""
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "w") as f: 
-        json.dump(data, f)
+if TYPE_CHECKING: 
+    # plotly and scipy are imported where they are used, they dominate import time
+    import plotly.graph_objects as go 
 
 
 class ExcitationEmissionRange(TypedDict): 
     Excitation: List
     Emission: List
 
+def _wavelength_axis(values) -> np.ndarray: 
+    """Wavelengths as int, unless some are fractional (emission bin centres of the pyramid)."""
+    values = np.asarray(values, dtype=float)
+    return values.astype(int) if np.all(values == np.round(values)) else values
+
+
 class RangeCutTransformer2D():
     """ 
     column_range_modes : ([emi, emi],[exic, exic])
@@ -40,8 +32,8 @@ class RangeCutTransformer2D():
         
         self.columns_range_modes = columns_range_modes
         self.exic_emis = exic_emis
-        self._initial_state = {'Excitation': np.array([int(i) for i in self.exic_emis['Excitation']]), 
-                              'Emission': np.array([int(i) for i in self.exic_emis['Emission']])}
+        self._initial_state = {'Excitation': _wavelength_axis(self.exic_emis['Excitation']), 
+                              'Emission': _wavelength_axis(self.exic_emis['Emission'])}
         self._em = None
         self._ex = None
         self.final_state = {}
@@ -72,10 +64,214 @@ class RangeCutTransformer2D():
 
 
 
+PYRAMID_LEVELS = (1, 2, 4, 8)
+
+
+def bin_emission(data: npt.NDArray, 
+                 emission: npt.NDArray, 
+                 factor: int) -> Tuple[npt.NDArray, npt.NDArray]: 
+    """
+    Averages `factor` neighbouring emission wavelengths (last axis). 
+    A trailing incomplete bin is averaged over what is there. 
+    Returns the binned data and the bin centres (see bin_axis).
+    """
+    if factor == 1: 
+        return data, emission
+    n_em = data.shape[-1]
+    n_bins = math.ceil(n_em / factor)
+    pad = n_bins * factor - n_em
+    padded = np.pad(data.astype(np.float32), [(0, 0)] * (data.ndim - 1) + [(0, pad)], 
+                    constant_values=np.nan)
+    binned = padded.reshape(*data.shape[:-1], n_bins, factor)
+    counts = np.sum(~np.isnan(binned), axis=-1)
+    sums = np.nansum(binned, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"): 
+        binned = np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+    return binned, bin_axis(emission, factor)
+
+
+def bin_axis(emission: npt.NDArray, factor: int) -> npt.NDArray: 
+    """Centres of the emission bins used by bin_emission."""
+    if factor == 1: 
+        return emission
+    n_bins = math.ceil(emission.size / factor)
+    centres = np.pad(emission.astype(float), (0, n_bins * factor - emission.size), 
+                     constant_values=np.nan).reshape(n_bins, factor)
+    return np.nanmean(centres, axis=-1)
+
+
+def choose_pyramid_level(n_ex: int, 
+                         n_em: int, 
+                         n_samples: int, 
+                         subplot_px: float, 
+                         max_values: int = 2_000_000) -> int: 
+    """
+    Picks the finest pyramid level with at most one emission point per subplot pixel 
+    that keeps the whole grid below max_values contour values.
+    """
+    for level in PYRAMID_LEVELS: 
+        n_binned = math.ceil(n_em / level)
+        if (n_binned <= subplot_px) and (n_samples * n_ex * n_binned <= max_values): 
+            return level
+    return PYRAMID_LEVELS[-1]
+
+
+# Storage of the EEM arrays, see encode_eem
+STORAGE_DTYPES = ("float32", "float16", "uint16")
+UINT16_NAN = np.iinfo(np.uint16).max
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def encode_eem(data: npt.NDArray, 
+               storage: Literal["float32", "float16", "uint16"] = "float32") -> Tuple[npt.NDArray, float, float]: 
+    """
+    Compact copy of a float32 EEM, returns (array, scale, offset). Error bounds: 
+    float16 - relative error <= 2**-11 (4.9e-4) for 6.1e-5 <= |x| <= 65504, absolute 
+    error <= 3e-8 below that; a sample with larger values is kept as float32 (logged). 
+    uint16 - x = offset + q * scale with scale = (max - min) / 65534 per sample, absolute 
+    error <= scale / 2 (1/131068 of the sample's range) plus float32 rounding; 65535 marks NaN. 
+    scale and offset are NaN unless storage is uint16.
+    """
+    if storage == "float32": 
+        return data.astype(np.float32, copy=False), np.nan, np.nan
+    if storage == "float16": 
+        if np.nanmax(np.abs(data), initial=0) > FLOAT16_MAX: 
+            logging.warning("Intensities above 65504 do not fit float16, the sample is kept as float32 "
+                            "(uint16 storage fits any range).")
+            return data.astype(np.float32, copy=False), np.nan, np.nan
+        return data.astype(np.float16), np.nan, np.nan
+    if storage != "uint16": 
+        raise ValueError(f"Unknown storage {storage}, use one of {STORAGE_DTYPES}.")
+    nan_mask = np.isnan(data)
+    if nan_mask.all(): 
+        return np.full(data.shape, UINT16_NAN, dtype=np.uint16), 1.0, 0.0
+    offset = float(np.nanmin(data))
+    scale = (float(np.nanmax(data)) - offset) / (UINT16_NAN - 1) or 1.0
+    quantized = np.rint((np.where(nan_mask, offset, data) - offset) / scale)
+    return np.where(nan_mask, UINT16_NAN, quantized).astype(np.uint16), scale, offset
+
+
+def decode_eem(data: npt.NDArray, scale: float = np.nan, offset: float = np.nan) -> npt.NDArray: 
+    """float32 EEM from encode_eem's output (float32 arrays are returned as they are)."""
+    if data.dtype == np.uint16: 
+        decoded = (data.astype(np.float64) * scale + offset).astype(np.float32)
+        decoded[data == UINT16_NAN] = np.nan
+        return decoded
+    return data.astype(np.float32, copy=False)
+
+
+SUMMARY_DTYPES = {"Max": "float32", "Min": "float32", "Integral": "float32", 
+                  "PeakEx": "int64", "PeakEm": "int64", "NaNCount": "int64", "NEx": "int64", "NEm": "int64"}
+SUMMARY_COLUMNS = list(SUMMARY_DTYPES)
+
+
+def summary_statistics(data: npt.NDArray, 
+                       excitation: npt.NDArray, 
+                       emission: npt.NDArray) -> Dict[str, npt.NDArray]: 
+    """
+    Per-sample statistics of a (n, ex, em) stack in one vectorized pass: 
+    max/min, integral over the grid (trapezoidal, NaN counted as 0), 
+    excitation/emission of the maximum, number of NaN and the grid shape.
+    """
+    n = data.shape[0]
+    nan_mask = np.isnan(data)
+    nan_count = nan_mask.reshape(n, -1).sum(axis=1)
+    filled = np.where(nan_mask, -np.inf, data).reshape(n, -1)
+    peak = np.argmax(filled, axis=1)
+    peak_ex, peak_em = np.unravel_index(peak, data.shape[1:])
+    all_nan = nan_count == data[0].size
+    zeroed = np.where(nan_mask, 0, data).astype(np.float64)
+    dex, dem = np.diff(np.asarray(excitation, dtype=float)), np.diff(np.asarray(emission, dtype=float))
+    over_em = np.sum((zeroed[..., 1:] + zeroed[..., :-1]) / 2 * dem, axis=-1) if dem.size else zeroed[..., 0]
+    integral = np.sum((over_em[:, 1:] + over_em[:, :-1]) / 2 * dex, axis=-1) if dex.size else over_em[:, 0]
+    with np.errstate(invalid="ignore"): 
+        return {
+            "Max": np.where(all_nan, np.nan, filled[np.arange(n), peak]).astype(np.float32), 
+            "Min": np.where(all_nan, np.nan, 
+                            np.nanmin(np.where(all_nan[:, None, None], 0, data).reshape(n, -1), axis=1)).astype(np.float32), 
+            "Integral": integral.astype(np.float32), 
+            "PeakEx": np.asarray(excitation)[peak_ex], 
+            "PeakEm": np.asarray(emission)[peak_em], 
+            "NaNCount": nan_count, 
+            "NEx": np.full(n, data.shape[1]), 
+            "NEm": np.full(n, data.shape[2]), 
+        }
+
+
+# Standard EEM indices. Peaks after Coble (1996, 2007): maximum at the excitation 
+# within the emission window. HIX after Ohno (2002), FI after Cory & McKnight (2005), 
+# BIX after Huguet et al. (2009). Wavelengths in nm.
+EEM_PEAKS = {"B": (275, (305, 315)), "T": (275, (335, 345)), "A": (260, (380, 460)), 
+             "M": (312, (380, 420)), "C": (350, (420, 480))}
+INDEX_DTYPES = {**{f"Peak{peak}": "float32" for peak in EEM_PEAKS}, 
+                "HIX": "float32", "FI": "float32", "BIX": "float32"}
+INDEX_COLUMNS = list(INDEX_DTYPES)
+
+
+def index_lookup(excitation: npt.NDArray, 
+                 emission: npt.NDArray, 
+                 tolerance: float = 5) -> Dict[str, Any]: 
+    """
+    Row and column positions of every index in one wavelength grid, computed once per grid 
+    (see GridTable.index_lookup). Wavelengths further than tolerance from the grid, or 
+    windows without any emission wavelength, give None and the index is NaN.
+    """
+    excitation = np.asarray(excitation, dtype=float)
+    emission = np.asarray(emission, dtype=float)
+
+    def row(wavelength): 
+        i = int(np.argmin(np.abs(excitation - wavelength)))
+        return i if abs(excitation[i] - wavelength) <= tolerance else None
+
+    def column(wavelength): 
+        i = int(np.argmin(np.abs(emission - wavelength)))
+        return i if abs(emission[i] - wavelength) <= tolerance else None
+
+    def window(low, high): 
+        columns = np.flatnonzero((emission >= low) & (emission <= high))
+        return columns if columns.size else None
+
+    lookup = {f"Peak{peak}": (row(ex), window(*em_range)) for peak, (ex, em_range) in EEM_PEAKS.items()}
+    lookup["HIX"] = (row(254), window(435, 480), window(300, 345))
+    lookup["FI"] = (row(370), column(470), column(520))
+    lookup["BIX"] = (row(310), column(380), column(430))
+    return lookup
+
+
+def eem_indices(data: npt.NDArray, lookup: Dict[str, Any]) -> Dict[str, npt.NDArray]: 
+    """
+    INDEX_COLUMNS of every sample of a (n, ex, em) stack on one grid, vectorized over the 
+    samples with the positions from index_lookup. NaN where the grid does not cover an index.
+    """
+    n = data.shape[0]
+    missing = np.full(n, np.nan, dtype=np.float32)
+    result = {}
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"): 
+        # all-NaN windows (excised scatter) and zero denominators give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for peak in EEM_PEAKS: 
+            row, columns = lookup[f"Peak{peak}"]
+            result[f"Peak{peak}"] = missing if row is None or columns is None else np.nanmax(data[:, row, columns], axis=1)
+        row, high, low = lookup["HIX"]
+        if row is None or high is None or low is None: 
+            result["HIX"] = missing
+        else: 
+            high_sum = np.nansum(data[:, row, high], axis=1)
+            result["HIX"] = high_sum / (high_sum + np.nansum(data[:, row, low], axis=1))
+        for name in ("FI", "BIX"): 
+            row, numerator, denominator = lookup[name]
+            result[name] = (missing if None in (row, numerator, denominator) 
+                            else data[:, row, numerator] / data[:, row, denominator])
+    return {name: np.where(np.isfinite(values), values, np.nan).astype(np.float32) 
+            for name, values in result.items()}
+
+
 def spectrum(data: npt.NDArray, 
              labels: Union[npt.NDArray, List], 
              wavenumbers: ExcitationEmissionRange
-             ) -> go.Figure: 
+             ) -> "go.Figure": 
+    import plotly_express as px
+
     df = (
         pd.DataFrame(data, columns=wavenumbers)
         .reset_index(drop=False)
@@ -111,6 +307,285 @@ def spectrum(data: npt.NDArray,
     return fig
     
 
+def figure_nbytes(fig: "go.Figure") -> int: 
+    """Size of the arrays held by the traces of a figure, for size bounded caches."""
+    return sum(value.nbytes for trace in fig.data for value in trace.to_plotly_json().values() 
+               if isinstance(value, np.ndarray))
+
+
+def slice_figure(axes: List[npt.NDArray], 
+                 intensities: List[npt.NDArray], 
+                 labels: List[str]) -> "go.Figure": 
+    """One line per spectrum, each with its own wavelength axis (see FluorescenceData.slice)."""
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    colors = qualitative.Set1 + qualitative.Set2 + qualitative.Set3
+    fig = go.Figure(data=[go.Scatter(x=x, y=y, mode="lines", name=label, line=dict(color=colors[i % len(colors)])) 
+                          for i, (x, y, label) in enumerate(zip(axes, intensities, labels))])
+    fig.update_layout(
+        {"xaxis": dict(mirror=True, 
+                       ticks="outside", 
+                       nticks=20, 
+                       showgrid=False), 
+        "yaxis": dict(showgrid=False)
+        }, 
+    )
+    return fig
+
+
+def spectrum_band(mean: npt.NDArray, 
+                  std: npt.NDArray, 
+                  labels: List[str], 
+                  wavenumbers: npt.NDArray) -> "go.Figure": 
+    """
+    One mean line with a shaded mean ± std band per row of mean (rows, wavenumbers).
+    """
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative, hex_to_rgb
+
+    colors = qualitative.Set1 + qualitative.Set2 + qualitative.Dark2
+    traces = []
+    for i, (label, row_mean, row_std) in enumerate(zip(labels, mean, std)): 
+        color = colors[i % len(colors)]
+        rgb = hex_to_rgb(color) if color.startswith("#") else color[4:-1].split(",")
+        band = dict(x=wavenumbers, mode="lines", line=dict(width=0), legendgroup=label, 
+                    showlegend=False, hoverinfo="skip")
+        traces += [go.Scatter(y=row_mean + row_std, **band), 
+                   go.Scatter(y=row_mean - row_std, fill="tonexty", 
+                              fillcolor="rgba({}, {}, {}, 0.2)".format(*rgb), **band), 
+                   go.Scatter(x=wavenumbers, y=row_mean, mode="lines", name=label, legendgroup=label, 
+                              line=dict(color=color))]
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        {"xaxis": dict(mirror=True, 
+                       ticks="outside", 
+                       nticks=20, 
+                       showgrid=False), 
+        "yaxis": dict(showgrid=False)
+        }, 
+    )
+    return fig
+
+
+def score_scatter(scores: npt.NDArray, 
+                  labels: List[str], 
+                  groups: List[str], 
+                  components: Tuple[int, int] = (0, 1), 
+                  axis_titles: Optional[List[str]] = None) -> "go.Figure": 
+    """
+    Scores of two components against each other, one WebGL trace per group (batch).
+    """
+    import plotly.graph_objects as go
+
+    x, y = components
+    if axis_titles is None: 
+        axis_titles = [f"Component {i + 1}" for i in range(scores.shape[1])]
+    groups = np.asarray(groups)
+    labels = np.asarray(labels)
+    traces = [go.Scattergl(x=scores[groups == group, x], 
+                           y=scores[groups == group, y] if scores.shape[1] > y else np.zeros((groups == group).sum()), 
+                           mode="markers", name=str(group), text=labels[groups == group], 
+                           hovertemplate="%{text}<br>%{x:.3g}, %{y:.3g}<extra></extra>") 
+              for group in dict.fromkeys(groups)]
+    fig = go.Figure(data=traces)
+    fig.update_xaxes(title=axis_titles[x])
+    fig.update_yaxes(title=axis_titles[y] if len(axis_titles) > y else "")
+    return fig
+
+
+def lttb(x: npt.NDArray, y: npt.NDArray, n_out: int) -> npt.NDArray: 
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling 
+    (Steinarsson, 2013): the first and last point and, per bucket, the point spanning the 
+    largest triangle with the previously kept point and the mean of the next bucket. 
+    x has to be sorted, points with NaN y are dropped.
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    n = valid.size
+    if n_out >= n or n_out < 3: 
+        return valid
+    x = np.asarray(x, dtype=np.float64)[valid]
+    y = np.asarray(y, dtype=np.float64)[valid]
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2): 
+        start, stop = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[stop:max(next_stop, stop + 1)].mean()
+        next_y = y[stop:max(next_stop, stop + 1)].mean()
+        area = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return valid[np.unique(kept)]
+
+
+def trend_figure(dates: npt.NDArray, 
+                 values: npt.NDArray, 
+                 labels: npt.NDArray, 
+                 title: str, 
+                 n_total: int) -> "go.Figure": 
+    """Values against acquisition date as a single WebGL trace."""
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=[go.Scattergl(x=dates, y=values, text=labels, mode="lines+markers", 
+                                       marker=dict(size=4), line=dict(width=1), 
+                                       hovertemplate="%{text}<br>%{x}<br>%{y:.4g}<extra></extra>")])
+    shown = f" (showing {len(values)} of {n_total})" if len(values) < n_total else ""
+    fig.update_layout(title=title + shown, uirevision=True)
+    fig.update_xaxes(title="Date")
+    fig.update_yaxes(title=title)
+    return fig
+
+
+def streaming_moments(chunks: Iterable[npt.NDArray]) -> Tuple[npt.NDArray, npt.NDArray, npt.NDArray]: 
+    """
+    Per-pixel mean, std (ddof=1) and count of the non-NaN values of a sequence of 
+    (k, ex, em) chunks. Chunks are merged one at a time with the parallel form of 
+    Welford's algorithm (Chan et al.), so only one chunk has to be in memory.
+    """
+    count = mean = m2 = None
+    for chunk in chunks: 
+        chunk = np.asarray(chunk, dtype=np.float64)
+        chunk_count = (~np.isnan(chunk)).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"): 
+            chunk_mean = np.where(chunk_count > 0, np.nansum(chunk, axis=0) / chunk_count, 0)
+        chunk_m2 = np.nansum((chunk - chunk_mean) ** 2, axis=0)
+        if count is None: 
+            count, mean, m2 = chunk_count, chunk_mean, chunk_m2
+            continue
+        total = count + chunk_count
+        delta = chunk_mean - mean
+        with np.errstate(divide="ignore", invalid="ignore"): 
+            weight = np.where(total > 0, chunk_count / total, 0)
+        mean = mean + delta * weight
+        m2 = m2 + chunk_m2 + delta ** 2 * count * weight
+        count = total
+    if count is None: 
+        raise ValueError("No data to reduce.")
+    with np.errstate(divide="ignore", invalid="ignore"): 
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+    return (np.where(count > 0, mean, np.nan).astype(np.float32), 
+            std.astype(np.float32), 
+            count.astype(np.float32))
+
+
+def subplot_domains(n_plots: int, 
+                    cols: int = 3, 
+                    horizontal_spacing: float = 0.17, 
+                    vertical_spacing: Optional[float] = None) -> List[Tuple[List[float], List[float]]]: 
+    """
+    (x domain, y domain) of every subplot, filled row by row from the top. 
+    Same grid as plotly's make_subplots with subplot titles, without building a figure for it.
+    """
+    rows = max(math.ceil(n_plots / cols), 1)
+    if vertical_spacing is None: 
+        # make_subplots leaves 0.5 / rows between rows that have subplot titles
+        vertical_spacing = 0.5 / rows
+    width = (1 - horizontal_spacing * (cols - 1)) / cols
+    height = (1 - vertical_spacing * (rows - 1)) / rows
+    domains = []
+    for i in range(n_plots): 
+        row, col = divmod(i, cols)
+        x0 = col * (width + horizontal_spacing)
+        y0 = (rows - 1 - row) * (height + vertical_spacing)
+        domains.append(([x0, x0 + width], [y0, y0 + height]))
+    return domains
+
+
+def contour_grid(data: npt.NDArray, 
+                 excitation: npt.NDArray, 
+                 emission: npt.NDArray, 
+                 titles: List[str], 
+                 colorbar: Literal["individual", "shared", "hide"] = "individual", 
+                 colorscale: str = "Cividis", 
+                 cols: int = 3, 
+                 cmid: Optional[float] = None) -> "go.Figure": 
+    """
+    One contour subplot per sample of the (n, ex, em) stack. 
+    The whole layout (domains, titles, color axes) is built in one pass. 
+    colorbar="shared" uses a single color axis spanning the global min/max. 
+    cmid centers the color scale(s), e.g. at 0 for differences.
+    """
+    import plotly.graph_objects as go
+
+    n_samples = data.shape[0]
+    rows = max(math.ceil(n_samples / cols), 1)
+    domains = subplot_domains(n_samples, cols)
+    layout = {"title_text": "", "showlegend": False, "annotations": []}
+    traces = []
+    for i, (x_domain, y_domain) in enumerate(domains): 
+        suffix = "" if i == 0 else str(i + 1)
+        layout[f"xaxis{suffix}"] = dict(domain=x_domain, anchor=f"y{suffix}", nticks=10, title_text="Emission")
+        layout[f"yaxis{suffix}"] = dict(domain=y_domain, anchor=f"x{suffix}", title_text="Excitation")
+        layout["annotations"].append(dict(text=titles[i], x=np.mean(x_domain), y=y_domain[1], 
+                                          xref="paper", yref="paper", xanchor="center", yanchor="bottom", 
+                                          showarrow=False, font=dict(size=16)))
+        if colorbar == "individual": 
+            layout[f"coloraxis{i + 1}"] = dict(colorscale=colorscale, 
+                                               colorbar=dict(x=x_domain[1] + 0.01, 
+                                                             y=np.mean(y_domain) + 0.01, 
+                                                             len=1/rows - 0.07), 
+                                               cmid=cmid)
+        traces.append(go.Contour(
+            z=data[i],
+            x=emission,
+            y=excitation,
+            colorscale=colorscale, 
+            zmid=cmid, 
+            colorbar=dict(title='Intensity'),
+            showscale=colorbar != "hide",
+            coloraxis={"individual": f"coloraxis{i + 1}", "shared": "coloraxis", "hide": None}[colorbar], 
+            xaxis=f"x{suffix}", 
+            yaxis=f"y{suffix}"
+        ))
+    if colorbar == "shared" and n_samples: 
+        cmin, cmax = float(np.nanmin(data)), float(np.nanmax(data))
+        if cmid is not None: 
+            # cmid is ignored next to cmin/cmax, center the range instead
+            half = max(abs(cmax - cmid), abs(cmid - cmin))
+            cmin, cmax = cmid - half, cmid + half
+        layout["coloraxis"] = dict(colorscale=colorscale, 
+                                   cmin=cmin, 
+                                   cmax=cmax, 
+                                   colorbar=dict(title="Intensity"))
+    return go.Figure(data=traces, layout=layout)
+
+
+COMPARISON_MODES = ("difference", "ratio", "zscore")
+
+
+def compare_eems(data: npt.NDArray, 
+                 reference: npt.NDArray, 
+                 mode: Literal["difference", "ratio", "zscore"] = "difference") -> npt.NDArray: 
+    """
+    Compares every sample of the (n, ex, em) stack with the reference stack (m, ex, em) 
+    in one broadcast. difference and ratio are taken against the reference mean, zscore 
+    divides the difference by the reference std and needs at least 2 reference samples. 
+    Divisions by zero give NaN.
+    """
+    if mode not in COMPARISON_MODES: 
+        raise ValueError(f"Unknown comparison mode {mode}, use one of {COMPARISON_MODES}.")
+    if mode == "zscore" and len(reference) < 2: 
+        raise ValueError("A z-score needs a reference of at least 2 samples (a batch mean), "
+                         "use difference or ratio to compare with a single sample.")
+    with warnings.catch_warnings(): 
+        # all-NaN pixels (excised scatter) are expected here
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(reference, axis=0) if len(reference) > 1 else reference[0]
+        if mode == "difference": 
+            return data - mean
+        with np.errstate(divide="ignore", invalid="ignore"): 
+            if mode == "ratio": 
+                result = data / mean
+            else: 
+                result = (data - mean) / np.nanstd(reference, axis=0)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
 # TO DO: This code needs major refractoring. Way too slow. 
 # We will need to vectorize this some day. 
 def scatter_removal(
@@ -119,6 +594,7 @@ def scatter_removal(
     """
     Author: X from Github
     """
+    from scipy.interpolate import griddata
    
     fl = eem_df.to_numpy()
     em = eem_df.index.values.astype(float).astype(int)
@@ -203,7 +679,7 @@ def scatter_removal(
         points = np.transpose(points)
         values = fl[values_to_keep]
 
-        fl_interp = scipy.interpolate.griddata(
+        fl_interp = griddata(
             points, values, (grid_ex, grid_em), fill_value=0
         )
         # Replace excised values with interpolated values.
@@ -214,6 +690,72 @@ def scatter_removal(
     return eem_df
 
 
+# band, order and peak position polynomial (in excitation) as in _scatter_bands
+SCATTER_BANDS = (("rayleigh", "first", (0, 1.0000, 0)), 
+                 ("raman", "first", (0.0006, 0.8711, 18.7770)), 
+                 ("rayleigh", "second", (0, 2.0000, 0)), 
+                 ("raman", "second", (-0.0001, 2.4085, -47.2965)))
+
+
+def scatter_mask(excitation: npt.NDArray, 
+                 emission: npt.NDArray, 
+                 band: str = 'rayleigh', 
+                 order: str = "both", 
+                 excision_width: float = 50, 
+                 truncate: Optional[str] = None) -> npt.NDArray: 
+    """
+    (em, ex) mask of the values scatter_removal excises, all bands broadcast at once.
+    """
+    band, order = band.lower(), order.lower()
+    bands = [(band_order, coefficients) for band_name, band_order, coefficients in SCATTER_BANDS 
+             if (band not in ("rayleigh", "raman") or band_name == band) 
+             and (order not in ("first", "second") or band_order == order)]
+    ex = np.asarray(excitation).astype(float).astype(int)
+    em = np.asarray(emission).astype(float).astype(int)
+    if not bands: 
+        return np.zeros((em.size, ex.size), dtype=bool)
+    r = excision_width / 2
+    peaks = np.stack([np.polyval(np.poly1d(coefficients), ex) for _, coefficients in bands])[:, None, :]
+    below = np.array([np.inf if band_order == "first" and truncate in ("below", "both") else r 
+                      for band_order, _ in bands])[:, None, None]
+    above = np.array([np.inf if band_order == "second" and truncate in ("above", "both") else r 
+                      for band_order, _ in bands])[:, None, None]
+    grid_em = em[None, :, None]
+    return ((grid_em > peaks - below) & (grid_em < peaks + above)).any(axis=0)
+
+
+def scatter_removal_vectorized(
+    eem_df, band='rayleigh', order="both", excision_width=50, fill='interp', truncate=None
+):
+    """
+    Same result as scatter_removal, with the mask built for all bands in one broadcast 
+    (scatter_mask) instead of per band with pandas. 
+    Checked against the reference by utils.crosscheck.
+    """
+    from scipy.interpolate import griddata
+
+    em = eem_df.index.values.astype(float).astype(int)
+    ex = eem_df.columns.to_numpy().astype(float).astype(int)
+    excise = scatter_mask(ex, em, band, order, excision_width, truncate)
+    fl = np.array(eem_df.to_numpy())
+    if fill == None: 
+        fl = fl.astype("float64") if not np.issubdtype(fl.dtype, np.floating) else fl
+        fl[excise] = np.nan
+    elif fill == "zeros": 
+        fl[excise] = 0
+    elif excise.any(): 
+        grid_ex, grid_em = np.meshgrid(ex, em)
+        keep = ~excise
+        points = np.column_stack([grid_ex[keep], grid_em[keep]])
+        # on the whole grid as in scatter_removal: the simplex found for a point on a shared 
+        # edge depends on the previous query, which decides whether a NaN vertex is used
+        fl[excise] = griddata(points, fl[keep], (grid_ex, grid_em), fill_value=0)[excise]
+    return pd.DataFrame(data=fl, index=em, columns=ex)
+
+
+SCATTER_ENGINES = {"reference": scatter_removal, "vectorized": scatter_removal_vectorized}
+
+
 def _scatter_bands():
     data = [
         {"band": "Rayleigh", "order": "first", "poly1d": np.poly1d([0, 1.0000, 0])},
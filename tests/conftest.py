@@ -0,0 +1,78 @@
+import io
+import itertools
+from datetime import datetime
+from typing import Callable, List
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+import pytest
+from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+from fluorescence_visualization_dash.preprocessing.preprocessing import DiskArrayCache
+
+
+def synthetic_eems(rng: np.random.Generator, n: int) -> List[pd.DataFrame]: 
+    """Random grids, peaks, scatter lines, noise and a few NaN, emission along the rows."""
+    eems = []
+    for _ in range(n): 
+        ex = np.arange(rng.choice([220, 240, 250]), rng.choice([400, 450, 500]) + 1, rng.choice([2, 5, 10]))
+        em = np.arange(rng.choice([250, 260, 280]), rng.choice([550, 600]) + 1, rng.choice([1, 2, 4]))
+        grid_ex, grid_em = np.meshgrid(ex, em)
+        data = sum(rng.uniform(10, 500) * np.exp(-(grid_em - rng.uniform(300, 500))**2 / rng.uniform(500, 3000)
+                                                 - (grid_ex - rng.uniform(240, 400))**2 / rng.uniform(500, 3000))
+                   for _ in range(rng.integers(1, 4)))
+        data = data + rng.uniform(200, 2000) * np.exp(-(grid_em - grid_ex)**2 / 20) + rng.normal(0, 1, grid_em.shape)
+        data[rng.random(grid_em.shape) < 0.002] = np.nan
+        eems.append(pd.DataFrame(data.astype(np.float32), index=em, columns=ex))
+    return eems
+
+
+def fixture_csv(rng: np.random.Generator, samples: List[str], ex: npt.NDArray, em: npt.NDArray) -> str: 
+    """One batch in the exported Cary format: a column pair (wavelength, intensity) per excitation."""
+    header, units, columns = [], [], []
+    for sample, wavelength in itertools.product(samples, ex): 
+        header += [f"{sample}_EX_{wavelength:.2f}", ""]
+        units += ["Wavelength (nm)", "Intensity (a.u.)"]
+        intensity = (rng.uniform(50, 300) * np.exp(-(em - 420)**2 / 2000 - (wavelength - 330)**2 / 1500)
+                     + 500 * np.exp(-(em - wavelength)**2 / 20) + rng.normal(0, 1, em.size))
+        columns += [[f"{value:.2f}" for value in em], [f"{value:.4f}" for value in intensity]]
+    lines = [",".join(header), ",".join(units)] + [",".join(row) for row in zip(*columns)]
+    return "\n".join(lines) + "\n"
+
+
+def fixture_data(rng: np.random.Generator, n_samples: int) -> FluorescenceData: 
+    """FluorescenceData holding two parsed fixture batches (fixture0.csv, fixture1.csv), on the same grid."""
+    fluorescence = FluorescenceData(None)
+    ex, em = np.arange(250, 451, 5), np.arange(260, 601, 1)
+    batches = [fluorescence.read_batch(pd.read_csv(io.StringIO(fixture_csv(rng, [f"S{b}_{k}" for k in range(n_samples)], 
+                                                                            ex, em))), 
+                                       f"fixture{b}.csv", datetime(2024, 1, 1 + b))
+               for b in range(2)]
+    fluorescence.df = pd.concat(batches, ignore_index=True)
+    return fluorescence
+
+
+@pytest.fixture
+def make_csv() -> Callable[..., str]: 
+    return fixture_csv
+
+
+@pytest.fixture
+def make_eems() -> Callable[..., List[pd.DataFrame]]: 
+    return synthetic_eems
+
+
+@pytest.fixture
+def make_fluorescence(tmp_path) -> Callable[..., FluorescenceData]: 
+    """fixture_data with its disk caches in tmp_path."""
+    def make(rng: np.random.Generator, n_samples: int) -> FluorescenceData: 
+        fluorescence = fixture_data(rng, n_samples)
+        fluorescence.scatter_disk_cache = DiskArrayCache(tmp_path/"scatter")
+        fluorescence.aggregate_disk_cache = DiskArrayCache(tmp_path/"aggregates")
+        return fluorescence
+    return make
+
+
+@pytest.fixture
+def fluorescence(make_fluorescence) -> FluorescenceData: 
+    """Two batches of 3 samples."""
+    return make_fluorescence(np.random.default_rng(0), 3)
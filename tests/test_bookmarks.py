@@ -0,0 +1,70 @@
+import json
+import sqlite3
+import threading
+from fluorescence_visualization_dash.bookmarks.bookmarks import BookmarkStore, BookmarkWarmer
+
+
+def test_loading_a_bookmark_warms_it(tmp_path): 
+    store = BookmarkStore(tmp_path/"bookmarks.sqlite3")
+    store.add("first", [{"Batch": "batch0.csv", "Name": "S0"}])
+    warmed, done = [], threading.Event()
+    warmer = BookmarkWarmer(lambda rows: (warmed.append(rows), done.set()), store=lambda: store, delay=0.05)
+    store.subscribe(warmer.request)
+    assert not done.wait(0.2)  # never loaded, not ranked
+    store.record_use("first")
+    assert done.wait(5)
+    assert warmed == [[{"Batch": "batch0.csv", "Name": "S0"}]]
+
+
+def test_warmer_survives_a_failing_store(tmp_path): 
+    store = BookmarkStore(tmp_path/"bookmarks.sqlite3")
+    store.add("first", [{"Batch": "batch0.csv", "Name": "S0"}])
+    store.record_use("first")
+    attempts, done = [], threading.Event()
+
+    def flaky_store() -> BookmarkStore: 
+        attempts.append(1)
+        if len(attempts) == 1: 
+            raise sqlite3.OperationalError("database is locked")
+        return store
+
+    warmer = BookmarkWarmer(lambda rows: done.set(), store=flaky_store, delay=0.05)
+    warmer.request()
+    assert not done.wait(0.3)
+    warmer.request()
+    assert done.wait(5)
+
+
+def test_legacy_json_is_migrated_once(tmp_path): 
+    legacy = tmp_path/"bookmarks.json"
+    legacy.write_text(json.dumps({"first": [{"Batch": "b0.csv", "Name": "S1"}, {"Batch": "b0.csv", "Name": "S0"}], 
+                                  "second": [{"Batch": "b1.csv", "Name": "S2"}]}))
+    store = BookmarkStore(tmp_path/"bookmarks.sqlite3", legacy_json_path=legacy)
+    assert store.names() == ["first", "second"]
+    # rows keep their saved order
+    assert store.get("first") == [{"Batch": "b0.csv", "Name": "S1"}, {"Batch": "b0.csv", "Name": "S0"}]
+    assert not legacy.exists() and (tmp_path/"bookmarks.json.migrated").exists()
+    reopened = BookmarkStore(tmp_path/"bookmarks.sqlite3", legacy_json_path=legacy)
+    assert reopened.names() == ["first", "second"]
+
+
+def test_names_are_unique_and_removal_cascades(tmp_path): 
+    store = BookmarkStore(tmp_path/"bookmarks.sqlite3")
+    assert store.add("first", [{"Batch": "b0.csv", "Name": "S0"}])
+    assert not store.add("first", [{"Batch": "b1.csv", "Name": "S1"}])
+    assert store.remove(["first", "missing"]) == 1
+    assert store.get("first") is None
+    assert store.add("first", [])
+    assert store.get("first") == []
+
+
+def test_most_used_ranks_by_uses_then_recency(tmp_path): 
+    store = BookmarkStore(tmp_path/"bookmarks.sqlite3")
+    for name in ("a", "b", "c", "unused"): 
+        store.add(name, [{"Batch": "b0.csv", "Name": name}])
+    for name in ("a", "b", "b", "c", "a"): 
+        store.record_use(name)
+    store.record_use("missing")
+    # a and b both have 2 uses, a was used last
+    assert store.most_used(5) == ["a", "b", "c"]
+    assert store.most_used(1) == ["a"]
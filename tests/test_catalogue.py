@@ -0,0 +1,48 @@
+import pandas as pd
+from fluorescence_visualization_dash.dataloader.catalogue import Catalogue, SearchIndex
+
+
+def catalogue() -> Catalogue: 
+    return Catalogue.from_frame(pd.DataFrame({"Batch": ["b0", "b0", "b1", "b1", "b2"], 
+                                              "Name": ["s0", "s1", "s0", "s2", "s0"], 
+                                              "GridId": [1, 2, 1, 1, 1]}, 
+                                             index=[10, 11, 12, 13, 14]))
+
+
+def test_rows_by_batch_and_grid(): 
+    rows = catalogue().rows
+    assert rows() == [10, 11, 12, 13, 14]
+    assert rows("b0") == [10, 11]
+    assert rows(["b0", "b2"], grid_ids=[1]) == [10, 14]
+    assert rows("b0", grid_ids=[3]) == []
+
+
+def test_lookup_keeps_the_selection_order(): 
+    assert catalogue().lookup([("b1", "s2"), ("b0", "s0"), ("missing", "s0"), {"Batch": "b2", "Name": "s0"}]) == [13, 10, 14]
+
+
+SAMPLES = ["Lake_North_01", "lake_south_02", "River_01", "Blank", "Tap water", "lakeside"]
+
+
+def test_search_trigrams_match_substrings_prefix_first(): 
+    index = SearchIndex(SAMPLES)
+    assert index.search("LAKE") == ["lakeside", "Lake_North_01", "lake_south_02"]
+    assert index.search("_01") == ["River_01", "Lake_North_01"]
+    assert index.search("south") == ["lake_south_02"]
+    # every trigram occurs, the substring does not
+    assert index.search("lake_01") == []
+    assert index.search("xyz") == []
+    assert index.search("lake", limit=1) == ["lakeside"]
+
+
+def test_search_short_queries_are_prefixes(): 
+    index = SearchIndex(SAMPLES)
+    assert index.search("la") == ["Lake_North_01", "lake_south_02", "lakeside"]
+    assert index.search("t") == ["Tap water"]
+    assert index.search("01") == []
+    assert index.search("  ") == []
+
+
+def test_catalogue_search_fields(): 
+    assert catalogue().search("s0") == ["s0 FROM b0", "s0 FROM b1", "s0 FROM b2"]
+    assert catalogue().search("b1", field="batch") == ["b1"]
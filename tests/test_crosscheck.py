@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fluorescence_visualization_dash.utils.crosscheck import CHECKS, Result, check_stack
+
+SEEDS = (0, 1, 2)
+SAMPLES = 6
+
+
+@pytest.fixture(params=SEEDS, ids=lambda seed: f"seed{seed}")
+def run_check(request, make_eems, make_fluorescence): 
+    """Runs a check of CHECKS on the synthetic and fixture EEMs of one seed."""
+    rng = np.random.default_rng(request.param)
+    fluorescence = make_fluorescence(rng, SAMPLES // 2)
+    axes = fluorescence.axes(fluorescence.df)
+    fixture_eems = [pd.DataFrame(data.T, index=axes["Emission"], columns=axes["Excitation"]) 
+                    for data in fluorescence.select().Data]
+    eems = make_eems(rng, SAMPLES) + fixture_eems[:SAMPLES]
+
+    def run(name: str) -> Result: 
+        function = CHECKS[name]
+        return function(rng, fluorescence) if function is check_stack else function(rng, eems)
+    return run
+
+
+@pytest.mark.parametrize("name", list(CHECKS))
+def test_optimized_path_matches_reference(run_check, name): 
+    result = run_check(name)
+    assert result.cases
+    assert not result.mismatches, "\n".join(result.mismatches)
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize("name", [name for name in CHECKS if name != "eem storage"])
+def test_optimized_path_is_faster(run_check, name): 
+    result = run_check(name)
+    print(f"{name}: {result.reference_ms / result.optimized_ms:.1f}x "
+          f"({result.reference_ms:.0f} ms -> {result.optimized_ms:.0f} ms)")
+    assert result.optimized_ms < result.reference_ms
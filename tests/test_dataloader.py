@@ -0,0 +1,114 @@
+import io
+import os
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData, GridTable, GRIDS
+
+
+def test_batch_aggregate_follows_ingested_rows(tmp_path, fluorescence): 
+    # the batch's file stays in the data folder, untouched
+    fluorescence.filepath = tmp_path
+    (tmp_path/"fixture0.csv").touch()
+    first, _ = fluorescence.batch_aggregate("fixture0.csv")
+    rows = fluorescence.df.Batch == "fixture0.csv"
+    # re-ingesting a modified file replaces the rows, the cached aggregate must not be reused
+    fluorescence.df.loc[rows, "Data"] = pd.Series([data * 2 for data in fluorescence.df.Data[rows]], 
+                                                  index=fluorescence.df.index[rows], dtype="object")
+    second, _ = fluorescence.batch_aggregate("fixture0.csv")
+    np.testing.assert_allclose(second[0], first[0] * 2, rtol=1e-6)
+    assert len(list(fluorescence.aggregate_disk_cache.directory.glob("*.npy"))) == 2
+    assert not list(fluorescence.aggregate_disk_cache.directory.glob("*.tmp"))
+
+
+def test_float16_storage_keeps_out_of_range_samples_as_float32(caplog, make_csv): 
+    ex, em = np.arange(250, 301, 5), np.arange(260, 401)
+    batch = pd.read_csv(io.StringIO(make_csv(np.random.default_rng(0), ["low", "high"], ex, em)))
+    for column in batch.columns[batch.columns.str.startswith("high_EX_")]: 
+        intensity = batch.columns[batch.columns.get_loc(column) + 1]
+        batch.loc[1:, intensity] = (batch.loc[1:, intensity].astype(float) * 1e5).astype(str)
+    fluorescence = FluorescenceData(None, storage="float16")
+    rows = fluorescence.read_batch(batch, "fixture.csv", datetime(2024, 1, 1)).set_index("Name")
+    assert rows.Data["low"].dtype == np.float16
+    assert rows.Data["high"].dtype == np.float32
+    assert np.nanmax(rows.Data["high"]) > 65504
+    assert "float16" in caplog.text
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 64])
+def test_batch_aggregate_matches_numpy(fluorescence, chunk_size): 
+    stack = np.stack(fluorescence.select(index_loc=fluorescence.catalogue.rows("fixture0.csv")).Data)
+    aggregate, _ = fluorescence.batch_aggregate("fixture0.csv", chunk_size=chunk_size)
+    expected = [np.nanmean(stack, axis=0), np.nanmedian(stack, axis=0), np.nanstd(stack, axis=0, ddof=1), 
+                (~np.isnan(stack)).sum(axis=0)]
+    for plane, values in zip(aggregate, expected): 
+        np.testing.assert_allclose(plane, values, rtol=1e-5, atol=1e-4)
+
+
+def test_modified_files_are_reingested(tmp_path, make_csv, caplog): 
+    ex, em = np.arange(250, 301, 5), np.arange(260, 401)
+    (tmp_path/"kept.csv").write_text(make_csv(np.random.default_rng(0), ["a"], ex, em))
+    (tmp_path/"edited.csv").write_text(make_csv(np.random.default_rng(1), ["b", "c"], ex, em))
+    first = FluorescenceData(tmp_path)
+    kept = first.df.Data[first.catalogue.lookup([("kept.csv", "a")])[0]]
+
+    (tmp_path/"edited.csv").write_text(make_csv(np.random.default_rng(2), ["b", "c", "d"], ex, em))
+    os.utime(tmp_path/"edited.csv", ns=(0, 10**18))
+    second = FluorescenceData(tmp_path)
+    assert sorted(second.catalogue.samples("edited.csv")) == ["b", "c", "d"]
+    assert len(second.df) == 4
+    np.testing.assert_array_equal(second.df.Data[second.catalogue.lookup([("kept.csv", "a")])[0]], kept)
+    # nothing changed since, the cache is used as it is
+    caplog.set_level(logging.INFO)
+    assert len(FluorescenceData(tmp_path).df) == 4
+    assert "0 new and 0 modified files" in caplog.text
+
+
+def test_slice_snaps_to_the_grid_within_tolerance(fluorescence): 
+    index = fluorescence.df.index[:2].tolist()
+    slices = fluorescence.slice(index, excitation=[352, 358], select_range=([300, 400], [200, 800]))
+    assert slices.Wavelength.tolist() == [350, 360] * 2
+    for axis, intensity in zip(slices.Axis, slices.Intensity): 
+        assert axis[0] == 300 and axis[-1] == 400 and len(intensity) == len(axis)
+    by_emission = fluorescence.slice(index, emission=[421.4])
+    assert by_emission.Wavelength.tolist() == [421, 421]
+    with pytest.raises(ValueError, match="Excitation 470 nm is not measured"): 
+        fluorescence.slice(index, excitation=[350, 470])
+    assert len(fluorescence.slice(index, excitation=[470], tolerance=25)) == 2
+
+
+def test_slice_returns_strided_views_of_the_stored_arrays(fluorescence): 
+    row = fluorescence.df.index[0]
+    stored = fluorescence.df.Data[row]
+    assert stored.dtype == np.float32
+    # excitation 350 nm is row 20 of the (ex, em) array, emission 400 nm is column 140
+    for excitation, emission, expected in (([350], None, stored[20]), (None, [400], stored[:, 140])): 
+        intensity = fluorescence.slice([row], excitation=excitation, emission=emission).Intensity[0]
+        assert intensity.base is not None and np.shares_memory(intensity, stored)
+        np.testing.assert_array_equal(intensity, expected)
+
+
+def test_grid_table_deduplicates_grids_with_stable_ids(): 
+    grids = GridTable()
+    ex, em = np.arange(250, 301, 5), np.arange(260, 401)
+    grid_id = grids.register(ex, em)
+    assert grids.register(ex.astype(float).copy(), em.copy()) == grid_id
+    assert grid_id == GridTable().register(ex, em) == GridTable.grid_id(ex, em)
+    other = grids.register(ex, em[1:])
+    assert other != grid_id and len(grids.frame()) == 2
+    np.testing.assert_array_equal(grids.get(grid_id)["Emission"], em)
+    assert set(grids.export([grid_id, grid_id, other])) == {grid_id, other}
+    assert grids.frame().set_index("GridId").loc[other, ["NEx", "NEm", "EmMin"]].tolist() == [11, 140, 261]
+    with pytest.raises(KeyError): 
+        grids.get(grid_id + 1)
+
+
+def test_catalogue_columns_are_typed(fluorescence): 
+    df = fluorescence.df
+    assert df.Date.dtype == "datetime64[ns]" and df.GridId.dtype == np.int64
+    assert df.GridId.nunique() == 1
+    axes = GRIDS.get(df.GridId.iloc[0])
+    assert df.Data.iloc[0].shape == (axes["Excitation"].size, axes["Emission"].size)
+    assert df.groupby("Batch").Date.first().tolist() == [datetime(2024, 1, 1), datetime(2024, 1, 2)]
@@ -0,0 +1,36 @@
+import numpy as np
+from fluorescence_visualization_dash.decomposition.decomposition import Parafac
+
+
+def low_rank_eems(n: int, rank: int = 2, seed: int = 0) -> np.ndarray: 
+    """Non-negative (n, ex, em) stack built from rank gaussian components."""
+    rng = np.random.default_rng(seed)
+    ex, em = np.arange(40), np.arange(60)
+    B = np.stack([np.exp(-0.5 * ((ex - 10 - 15 * r) / 4) ** 2) for r in range(rank)], axis=1)
+    C = np.stack([np.exp(-0.5 * ((em - 15 - 25 * r) / 6) ** 2) for r in range(rank)], axis=1)
+    A = rng.uniform(0.5, 2, (n, rank))
+    return np.einsum("ir,jr,kr->ijk", A, B, C) + rng.normal(0, 1e-3, (n, ex.size, em.size))
+
+
+def loading_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray: 
+    """Cosine similarity of each column of a with its best match in b."""
+    return np.max(np.abs(a.T @ b), axis=1)
+
+
+def test_partial_fit_matches_full_fit(): 
+    X = low_rank_eems(40)
+    full = Parafac(rank=2).fit(X)
+    incremental = Parafac(rank=2).partial_fit(X[:20])
+    for start in range(20, 40, 5): 
+        incremental.partial_fit(X[start:start + 5])
+    assert incremental.n_samples_seen_ == full.n_samples_seen_ == 40
+    assert loading_similarity(incremental.excitation_loadings_, full.excitation_loadings_).min() > 0.999
+    assert loading_similarity(incremental.emission_loadings_, full.emission_loadings_).min() > 0.999
+    np.testing.assert_allclose(np.sort(incremental.transform(X), axis=1), np.sort(full.transform(X), axis=1), 
+                               rtol=1e-2, atol=1e-2)
+
+
+def test_partial_fit_on_an_unfitted_model_is_a_fit(): 
+    X = low_rank_eems(10, seed=1)
+    np.testing.assert_array_equal(Parafac(rank=2).partial_fit(X).excitation_loadings_, 
+                                  Parafac(rank=2).fit(X).excitation_loadings_)
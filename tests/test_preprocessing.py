@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+from fluorescence_visualization_dash.preprocessing.preprocessing import DiskArrayCache, PreprocessingPipeline, \
+    RamanNormalization2D, Smoothing2D, make_pipeline
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path): 
+    array = np.zeros(1000, dtype=np.float64)
+    cache = DiskArrayCache(tmp_path, max_bytes=int(array.nbytes * 3.5))
+    for i, key in enumerate("abc"): 
+        cache.put(key, array + i)
+        os.utime(tmp_path/f"{key}.npy", (i, i))
+    assert cache.get("a")[0] == 0  # a is now the most recently used
+    cache.put("d", array + 3)
+    # trimmed to 80% of max_bytes: the two least recently used files go
+    assert cache.get("b") is None and cache.get("c") is None
+    assert {path.stem for path in tmp_path.glob("*.npy")} == {"a", "d"}
+    assert cache.nbytes <= cache.max_bytes
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+EXCITATION, EMISSION = np.arange(300, 401, 10), np.arange(360, 441, 2)
+
+
+def test_make_pipeline_uses_the_canonical_step_order(): 
+    rng = np.random.default_rng(0)
+    X = rng.uniform(1, 2, (3, EXCITATION.size, EMISSION.size)).astype(np.float32)
+    blank = rng.uniform(0, 0.5, X.shape[1:]).astype(np.float32)
+    pipeline = make_pipeline(["smoothing", "raman", "blank"], 
+                             {"Excitation": EXCITATION, "Emission": EMISSION}, blank=blank, smoothing_window=(1, 3))
+    assert [name for name, _ in pipeline.steps] == ["blank", "raman", "smoothing"]
+    # blank subtraction -> division by the blank's Raman area -> smoothing
+    raman = RamanNormalization2D({"Excitation": EXCITATION, "Emission": EMISSION}, blank=blank).fit(X)
+    expected = Smoothing2D((1, 3)).transform((X - blank) / raman.raman_area_[:, None, None])
+    np.testing.assert_allclose(pipeline.fit_transform(X), expected, rtol=1e-5)
+    with pytest.raises(ValueError, match="blank sample"): 
+        make_pipeline(["blank"], {"Excitation": EXCITATION, "Emission": EMISSION})
+
+
+class CountingSmoothing(Smoothing2D): 
+    """Smoothing2D counting the samples it processed."""
+    processed = 0
+
+    def transform(self, X: np.ndarray) -> np.ndarray: 
+        CountingSmoothing.processed += len(X)
+        return super().transform(X)
+
+
+def test_preprocess_only_computes_samples_not_cached(fluorescence): 
+    df = fluorescence.select()
+    pipeline = PreprocessingPipeline([("smoothing", CountingSmoothing((1, 3)))])
+    CountingSmoothing.processed = 0
+    first = fluorescence.preprocess(df.iloc[:2], pipeline)
+    assert CountingSmoothing.processed == 2
+    everything = fluorescence.preprocess(df, pipeline)
+    assert CountingSmoothing.processed == len(df)
+    for row in first.index: 
+        assert everything.Data[row] is first.Data[row]
+    fluorescence.preprocess(df, pipeline)
+    assert CountingSmoothing.processed == len(df)
+    # another configuration is another cache entry
+    fluorescence.preprocess(df.iloc[:1], PreprocessingPipeline([("smoothing", CountingSmoothing((1, 5)))]))
+    assert CountingSmoothing.processed == len(df) + 1
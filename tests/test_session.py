@@ -0,0 +1,101 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from fluorescence_visualization_dash.dataloader.dataloader import FluorescenceData
+from fluorescence_visualization_dash.session.session import SessionStore, payload_nbytes
+
+SESSION_ID = "0" * 32
+
+
+def overlay(n_samples: int = 3) -> pd.DataFrame: 
+    emission = np.arange(260, 601)
+    data = [np.random.default_rng(i).random((41, emission.size), dtype=np.float32) for i in range(n_samples)]
+    return pd.DataFrame({"Data": data, 
+                         "Pyramid": [FluorescenceData.build_pyramid(eem, emission) for eem in data]})
+
+
+def test_payload_nbytes_counts_pyramids(): 
+    payload = overlay()
+    data_bytes = sum(eem.nbytes for eem in payload.Data)
+    pyramid_bytes = sum(binned.nbytes for pyramid in payload.Pyramid for binned in pyramid.values())
+    assert payload_nbytes(payload) == data_bytes + pyramid_bytes
+    assert payload_nbytes(payload.assign(Pyramid=None)) == data_bytes
+
+
+def test_session_bound_includes_pyramids(tmp_path): 
+    payload = overlay()
+    data_bytes = sum(eem.nbytes for eem in payload.Data)
+    # fits if only Data were counted, the pyramids push it over the limit
+    store = SessionStore(tmp_path, max_session_bytes=int(data_bytes * 1.5))
+    with pytest.raises(MemoryError): 
+        store.put(SESSION_ID, payload)
+    store.put(SESSION_ID, payload.assign(Pyramid=None))
+    assert store.nbytes == data_bytes
+
+
+def test_derived_is_built_once_per_payload_and_key(tmp_path): 
+    store = SessionStore(tmp_path)
+    calls = []
+
+    def build(payload): 
+        calls.append(payload)
+        return object()
+
+    archive, new_archive = object(), object()
+    assert store.derived(SESSION_ID, archive, lambda payload: payload) is None
+    store.put(SESSION_ID, overlay(1))
+    first = store.derived(SESSION_ID, archive, build)
+    assert store.derived(SESSION_ID, archive, build) is first
+    assert store.derived(SESSION_ID, new_archive, build) is not first
+    store.put(SESSION_ID, overlay(1))
+    store.derived(SESSION_ID, new_archive, build)
+    assert len(calls) == 3
+
+
+class Gate: 
+    """Pickles only once opened, to hold a spill in progress."""
+    opened = threading.Event()
+
+    def __reduce__(self): 
+        assert Gate.opened.wait(5)
+        return Gate, ()
+
+
+def test_spilling_does_not_block_other_sessions(tmp_path): 
+    first, second = "1" * 32, "2" * 32
+    array = np.zeros(1024, dtype=np.float32)
+    store = SessionStore(tmp_path, max_bytes=array.nbytes)
+    store.put(first, {"Data": array.copy(), "gate": Gate()})
+    writer = threading.Thread(target=store.put, args=(second, {"Data": array.copy()}))
+    writer.start()
+    # the first session is being written to disk, the second one is served meanwhile
+    deadline = time.time() + 5
+    while not store._in_transit and time.time() < deadline: 
+        time.sleep(0.01)
+    assert store.get(second) is not None
+    Gate.opened.set()
+    writer.join(5)
+    assert isinstance(store.get(first)["gate"], Gate)
+
+
+def test_derived_counts_towards_the_bound(tmp_path): 
+    first, second = "1" * 32, "2" * 32
+    payload = overlay(1)
+    size = payload_nbytes(payload)
+    store = SessionStore(tmp_path, max_bytes=3 * size)
+    store.put(first, payload)
+    store.put(second, overlay(1))
+    assert store.nbytes == 2 * size
+    store.derived(second, None, lambda payload: "view", lambda view: 2 * size)
+    # the first session is spilled to make room for the view
+    assert store.nbytes == 3 * size
+    assert store._spilled.keys() == {first}
+
+
+def test_overlay_view_counts_only_its_catalogue(): 
+    archive = FluorescenceData(None)
+    archive.df = overlay(3).assign(Batch="archive.csv", Name=["a", "b", "c"], GridId=0)
+    view = archive.with_overlay(overlay(1).assign(Batch="upload.csv", Name="d", GridId=0))
+    assert 0 < view.view_nbytes() < sum(data.nbytes for data in view.df.Data) / 10
@@ -0,0 +1,170 @@
+import numpy as np
+import pytest
+from scipy.integrate import trapezoid
+from fluorescence_visualization_dash.utils.utils import compare_eems, contour_grid, lttb, subplot_domains, \
+    summary_statistics, eem_indices, index_lookup, EEM_PEAKS
+
+
+@pytest.fixture
+def stacks(): 
+    rng = np.random.default_rng(0)
+    data = rng.uniform(1, 2, (2, 3, 4))
+    reference = rng.uniform(1, 2, (5, 3, 4))
+    return data, reference
+
+
+def test_compare_eems_difference_and_ratio_use_the_reference_mean(stacks): 
+    data, reference = stacks
+    mean = reference.mean(axis=0)
+    np.testing.assert_allclose(compare_eems(data, reference, "difference"), data - mean)
+    np.testing.assert_allclose(compare_eems(data, reference, "ratio"), data / mean)
+    np.testing.assert_allclose(compare_eems(data, reference[:1], "difference"), data - reference[0])
+
+
+def test_compare_eems_zscore_uses_the_reference_spread_only(stacks): 
+    data, reference = stacks
+    expected = (data - reference.mean(axis=0)) / reference.std(axis=0)
+    np.testing.assert_allclose(compare_eems(data, reference, "zscore"), expected)
+    # independent of which other samples are selected
+    np.testing.assert_allclose(compare_eems(data[:1], reference, "zscore"), expected[:1])
+
+
+def test_compare_eems_zscore_rejects_a_single_reference_sample(stacks): 
+    data, reference = stacks
+    with pytest.raises(ValueError, match="at least 2 samples"): 
+        compare_eems(data[:1], reference[:1], "zscore")
+
+
+def test_compare_eems_divisions_by_zero_give_nan(stacks): 
+    data, reference = stacks
+    reference = reference.copy()
+    reference[:, 0, 0] = 0
+    assert np.isnan(compare_eems(data, reference, "ratio")[:, 0, 0]).all()
+    assert np.isnan(compare_eems(data, reference, "zscore")[:, 0, 0]).all()
+    with pytest.raises(ValueError, match="Unknown comparison mode"): 
+        compare_eems(data, reference, "quotient")
+
+
+@pytest.mark.parametrize("n_out", [3, 10, 100])
+def test_lttb_keeps_the_endpoints_and_n_out_sorted_points(n_out): 
+    rng = np.random.default_rng(0)
+    x = np.arange(1000.0)
+    y = np.cumsum(rng.normal(size=x.size))
+    kept = lttb(x, y, n_out)
+    assert kept[0] == 0 and kept[-1] == x.size - 1
+    assert kept.size == n_out
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_lttb_keeps_the_extreme_of_a_spike(): 
+    y = np.zeros(1000)
+    y[437] = 10
+    assert 437 in lttb(np.arange(1000.0), y, 20)
+
+
+def test_lttb_drops_nan_and_passes_short_series_through(): 
+    y = np.arange(50.0)
+    y[[0, 10, 49]] = np.nan
+    kept = lttb(np.arange(50.0), y, 10)
+    assert kept[0] == 1 and kept[-1] == 48
+    assert not np.isnan(y[kept]).any()
+    np.testing.assert_array_equal(lttb(np.arange(5.0), np.arange(5.0), 10), np.arange(5))
+
+
+@pytest.mark.parametrize("n_plots", [1, 3, 4, 8])
+def test_subplot_domains_match_make_subplots(n_plots): 
+    from plotly.subplots import make_subplots
+
+    rows = -(-n_plots // 3)
+    fig = make_subplots(rows=rows, cols=3, horizontal_spacing=0.17, 
+                        subplot_titles=[str(i) for i in range(n_plots)])
+    for i, (x_domain, y_domain) in enumerate(subplot_domains(n_plots)): 
+        suffix = "" if i == 0 else str(i + 1)
+        np.testing.assert_allclose(x_domain, fig.layout[f"xaxis{suffix}"].domain)
+        np.testing.assert_allclose(y_domain, fig.layout[f"yaxis{suffix}"].domain)
+        assert 0 <= x_domain[0] < x_domain[1] <= 1 + 1e-9 and 0 <= y_domain[0] < y_domain[1] <= 1 + 1e-9
+
+
+def test_subplot_domains_fill_rows_from_the_top(): 
+    domains = subplot_domains(5, cols=2)
+    assert domains[0][1][1] == pytest.approx(1) and domains[-1][1][0] == pytest.approx(0)
+    # 0.5 / rows between the rows
+    assert domains[0][1][0] - domains[2][1][1] == pytest.approx(0.5 / 3)
+    assert domains[0][1] == domains[1][1] and domains[0][0] == domains[2][0]
+
+
+@pytest.mark.parametrize("colorbar", ["individual", "shared", "hide"])
+def test_contour_grid_colorbar_modes(colorbar): 
+    data = np.random.default_rng(0).normal(size=(4, 3, 5))
+    fig = contour_grid(data, np.arange(3), np.arange(5), list("abcd"), colorbar=colorbar, cmid=0)
+    assert len(fig.data) == 4 and [a.text for a in fig.layout.annotations] == list("abcd")
+    assert [trace.showscale for trace in fig.data] == [colorbar != "hide"] * 4
+    if colorbar == "individual": 
+        # plotly names coloraxis1 coloraxis
+        assert [trace.coloraxis for trace in fig.data] == ["coloraxis", "coloraxis2", "coloraxis3", "coloraxis4"]
+        assert [fig.layout[axis].cmid for axis in ("coloraxis", "coloraxis4")] == [0, 0]
+        assert fig.layout.coloraxis.colorbar.x < fig.layout.coloraxis2.colorbar.x
+    if colorbar == "shared": 
+        assert {trace.coloraxis for trace in fig.data} == {"coloraxis"}
+        half = np.abs(data).max()
+        assert (fig.layout.coloraxis.cmin, fig.layout.coloraxis.cmax) == pytest.approx((-half, half))
+    if colorbar == "hide": 
+        assert {trace.coloraxis for trace in fig.data} == {None}
+
+
+def test_summary_statistics_match_numpy_per_sample(make_eems): 
+    for eem in make_eems(np.random.default_rng(0), 4): 
+        excitation, emission = eem.columns.to_numpy(), eem.index.to_numpy()
+        sample = eem.to_numpy().T
+        sample[0, :3] = np.nan
+        stacked = np.stack([sample, sample * 2])
+        stats = summary_statistics(stacked, excitation, emission)
+        for k, data in enumerate(stacked): 
+            peak_ex, peak_em = np.unravel_index(np.nanargmax(data), data.shape)
+            integral = trapezoid(trapezoid(np.nan_to_num(data.astype(np.float64)), emission, axis=1), excitation)
+            assert stats["Max"][k] == pytest.approx(np.nanmax(data), rel=1e-6)
+            assert stats["Min"][k] == pytest.approx(np.nanmin(data), rel=1e-6)
+            assert stats["Integral"][k] == pytest.approx(integral, rel=1e-5)
+            assert (stats["PeakEx"][k], stats["PeakEm"][k]) == (excitation[peak_ex], emission[peak_em])
+            assert stats["NaNCount"][k] == np.isnan(data).sum()
+            assert (stats["NEx"][k], stats["NEm"][k]) == data.shape
+
+
+def test_summary_statistics_of_an_all_nan_sample(): 
+    stats = summary_statistics(np.full((1, 2, 3), np.nan), np.arange(2), np.arange(3))
+    assert np.isnan(stats["Max"][0]) and np.isnan(stats["Min"][0])
+    assert stats["Integral"][0] == 0 and stats["NaNCount"][0] == 6
+
+
+def direct_indices(data: np.ndarray, excitation: np.ndarray, emission: np.ndarray) -> dict: 
+    """The indices of one (ex, em) sample with a wavelength lookup per value."""
+    def at(ex, em): 
+        return data[np.argmin(np.abs(excitation - ex)), np.argmin(np.abs(emission - em))]
+
+    def window(ex, low, high): 
+        return data[np.argmin(np.abs(excitation - ex)), (emission >= low) & (emission <= high)]
+
+    indices = {f"Peak{peak}": np.nanmax(window(ex, *em_range)) for peak, (ex, em_range) in EEM_PEAKS.items()}
+    high, low = np.nansum(window(254, 435, 480)), np.nansum(window(254, 300, 345))
+    indices["HIX"] = high / (high + low)
+    indices["FI"] = at(370, 470) / at(370, 520)
+    indices["BIX"] = at(310, 380) / at(310, 430)
+    return indices
+
+
+def test_eem_indices_match_a_direct_computation(make_eems): 
+    for eem in make_eems(np.random.default_rng(1), 4): 
+        excitation, emission = eem.columns.to_numpy(), eem.index.to_numpy()
+        stacked = eem.to_numpy().T[None]
+        indices = eem_indices(stacked, index_lookup(excitation, emission))
+        for name, value in direct_indices(stacked[0], excitation, emission).items(): 
+            assert indices[name][0] == pytest.approx(value, rel=1e-5, nan_ok=True)
+
+
+def test_eem_indices_are_nan_outside_the_grid(): 
+    excitation, emission = np.arange(250, 401, 5), np.arange(300, 401, 2)
+    indices = eem_indices(np.ones((2, excitation.size, emission.size)), index_lookup(excitation, emission))
+    assert indices["PeakB"].tolist() == indices["PeakA"].tolist() == [1, 1]
+    # no emission in 420-480 nm (Peak C, HIX), none within 5 nm of 470 (FI) or 430 nm (BIX)
+    for name in ("PeakC", "HIX", "FI", "BIX"): 
+        assert np.isnan(indices[name]).all()